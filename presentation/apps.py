@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class PresentationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "presentation"
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+
+        if getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            from . import metrics
+            metrics.install()
+
+        if getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None) is not None:
+            from . import slow_queries
+            slow_queries.install()
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.db import connections
+from django.test import Client
+from django.urls import URLPattern, get_resolver
+
+from .mixins import QueryCounter
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+class RouteFailed(Exception):
+    # A benchmarked request that did not answer 2xx
+    pass
+
+
+def is_read_route(view_class, include_writes=False):
+    # Routes without a GET (POST-only) are left out, as are views marked
+    # writes_on_get, which would change the dataset between runs
+    if view_class is None or not hasattr(view_class, 'get'):
+        return False
+    return include_writes or not getattr(view_class, 'writes_on_get', False)
+
+
+def get_routes(only=None, include_writes=False):
+    # (route, view class) of the URLconf, optionally those containing one of only
+    for pattern in get_resolver().url_patterns:
+        if not isinstance(pattern, URLPattern):
+            continue
+        route = str(pattern.pattern)
+        view_class = getattr(pattern.callback, 'view_class', None)
+        if not is_read_route(view_class, include_writes):
+            continue
+        if only and not any(part in route for part in only):
+            continue
+        yield route, view_class
+
+
+def first_pk(view_class):
+    # The lowest primary key of the view's model, books for views without a queryset
+    queryset = getattr(view_class, 'queryset', None)
+    model = queryset.model if queryset is not None else Book
+    return model._default_manager.order_by('pk').values_list('pk', flat=True).first()
+
+
+def route_urls(routes):
+    # (route, url) pairs with <int:pk> filled in from the view's model.
+    # Routes whose model has no rows, or with other path arguments, are skipped.
+    for route, view_class in routes:
+        url = '/' + route
+        if '<int:pk>' in url:
+            pk = first_pk(view_class)
+            if pk is None:
+                logger.info('Skipping %s: no rows to fill <int:pk> from', route)
+                continue
+            url = url.replace('<int:pk>', str(pk))
+        if '<' in url:
+            logger.info('Skipping %s: unsupported path arguments', route)
+            continue
+        if 'filtered_book_list' in url:
+            url += '?query=river'
+        yield route, url
+
+
+def fetch(client, url):
+    # GET url and read the whole body, streamed ones included, so the
+    # timings cover rendering it. Anything but 2xx raises RouteFailed.
+    response = client.get(url)
+    if not 200 <= response.status_code < 300:
+        raise RouteFailed(f'{url} answered {response.status_code}')
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def route_client():
+    # An address outside INTERNAL_IPS keeps the debug toolbar out
+    return Client(HTTP_HOST='127.0.0.1', REMOTE_ADDR='192.0.2.1',
+                  HTTP_ACCEPT='application/json')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(call, repeat=20, warmup=2):
+    # Latency percentiles (ms) and queries per call, then peak traced
+    # memory of one extra call so tracing does not skew the timings
+    for _ in range(warmup):
+        call()
+
+    timings = []
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p90_ms': round(percentile(timings, 0.90), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'queries': counter.count / repeat,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def throughput(timings, elapsed, failures=0):
+    return {
+        'requests': len(timings),
+        'failures': failures,
+        'requests_per_second': round(len(timings) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+    }
+
+
+def load_threads(make_call, concurrency, total):
+    # total calls spread over concurrency threads, the way a threaded WSGI
+    # server runs them. make_call builds one callable per thread; a call
+    # returns True on success.
+    local = threading.local()
+
+    def timed(_):
+        if not hasattr(local, 'call'):
+            local.call = make_call()
+        started = time.perf_counter()
+        ok = local.call()
+        return (time.perf_counter() - started) * 1000, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(total)))
+    elapsed = time.perf_counter() - started
+    return throughput([timing for timing, _ in results], elapsed,
+                      failures=sum(1 for _, ok in results if not ok))
+
+
+def load_tasks(call, concurrency, total):
+    # total awaits of call spread over concurrency tasks on one event loop,
+    # the way an ASGI server runs them
+    timings, failures = [], 0
+    pending = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for _ in pending:
+            started = time.perf_counter()
+            ok = await call()
+            timings.append((time.perf_counter() - started) * 1000)
+            failures += not ok
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return throughput(timings, time.perf_counter() - started, failures)
+
+
+def write_results(path, results):
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+
+def compare_results(baseline, current, metric='p50_ms'):
+    # (name, before, after, ratio) for every entry present in both runs
+    rows = []
+    for name in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[name][metric], current[name][metric]
+        rows.append((name, before, after, after / before if before else None))
+    return rows
@@ -0,0 +1,183 @@
+import hashlib
+import math
+import random
+import time
+import uuid
+from functools import wraps
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .models import Author, Book, Category
+from .sharding import QUERYSET_TYPES
+
+GENERATION_PREFIX = 'presentation:generation:'
+COUNTER_PREFIX = 'presentation:cache_counter:'
+ROW_PREFIX = 'presentation:row:'
+COUNTERS = ('hits', 'misses', 'invalidations', 'early_refreshes')
+CACHED_MODELS = (Book, Author, Category)
+# Cache alias shared by every process, web and run_jobs workers alike
+GENERATION_CACHE = 'generations'
+
+
+def generation_cache_key(model):
+    return GENERATION_PREFIX + model._meta.label_lower
+
+
+def generation(model):
+    generations = caches[GENERATION_CACHE]
+    key = generation_cache_key(model)
+    value = generations.get(key)
+    if value is None:
+        # A fresh value, so a generation that was evicted never resurrects
+        # one that older entries were stored under
+        generations.add(key, uuid.uuid4().hex, None)
+        value = generations.get(key)
+    return value
+
+
+def bump(model):
+    # A fresh value rather than incr(): FileBasedCache's incr is a get and a
+    # set, so two processes bumping at once could both store the same number
+    caches[GENERATION_CACHE].set(generation_cache_key(model), uuid.uuid4().hex, None)
+    count('invalidations')
+
+
+def count(counter):
+    key = COUNTER_PREFIX + counter
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def counters():
+    values = cache.get_many([COUNTER_PREFIX + counter for counter in COUNTERS])
+    return {counter: values.get(COUNTER_PREFIX + counter, 0) for counter in COUNTERS}
+
+
+def vary_key(request, models=CACHED_MODELS, *extra):
+    # Generations of the models a response depends on plus its query params
+    params = sorted(
+        (name, value)
+        for name in request.GET
+        for value in request.GET.getlist(name)
+    )
+    generations = [f'{model._meta.label_lower}={generation(model)}' for model in models]
+    raw = '|'.join([request.path, repr(params), *generations, *extra])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def refresh_early(delta, expires, beta=None):
+    # Probabilistic early expiration (XFetch): a request recomputes the
+    # entry before it expires with a chance that grows as expiry nears and
+    # with delta, the seconds the entry took to compute, so one request
+    # refreshes it ahead of the others instead of all of them at expiry
+    beta = settings.CACHE_EARLY_REFRESH_BETA if beta is None else beta
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires
+
+
+def generational_cache_page(timeout, models=CACHED_MODELS, prefix='presentation:page:v2:'):
+    # Like cache_page, but entries are keyed on model generations, so a
+    # write makes them unreachable at once and timeout can be long. v2 keys
+    # hold (response, seconds, expiry) entries: bare responses cached under
+    # the old prefix by a persistent cache are never read back.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            key = prefix + vary_key(request, models, request.META.get('HTTP_ACCEPT', ''))
+            # (response, seconds it took, expiry timestamp)
+            entry = cache.get(key)
+            if entry is None:
+                count('misses')
+            elif refresh_early(*entry[1:]):
+                count('early_refreshes')
+            else:
+                count('hits')
+                return entry[0]
+
+            start = time.perf_counter()
+
+            def store(response):
+                cache.set(key, (response, time.perf_counter() - start, time.time() + timeout),
+                          timeout)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                if hasattr(response, 'render') and callable(response.render):
+                    response.add_post_render_callback(store)
+                else:
+                    store(response)
+            return response
+        return wrapper
+    return decorator
+
+
+def row_value(book, name):
+    # Rows may be model instances or values() dicts
+    return book[name] if isinstance(book, dict) else getattr(book, name)
+
+
+def row_cache_key(template_name, book):
+    # The book id plus its version: updated_at moves on every save, price
+    # update and author rename, whose trigger also rewrites author_name
+    updated_at = row_value(book, 'updated_at')
+    raw = '|'.join([template_name, str(row_value(book, 'id')),
+                    updated_at.isoformat() if updated_at else '', row_value(book, 'author_name')])
+    return ROW_PREFIX + hashlib.md5(raw.encode()).hexdigest()
+
+
+class RowFragments:
+    # Books rendered one row at a time with template_name, each row cached
+    # under its own version so an edit re-renders that row only. Rows are
+    # looked up a chunk at a time with get_many, and nothing is read before
+    # the template iterates, so an enclosing {% cache %} hit never queries.
+
+    def __init__(self, books, template_name='book_row.html', timeout=60 * 60 * 6,
+                 chunk_size=1000, engine=None):
+        self.books = books
+        self.template_name = template_name
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        # A template backend to load the row from, the configured ones by default
+        self.engine = engine
+
+    def chunks(self):
+        if isinstance(self.books, QUERYSET_TYPES):
+            rows = self.books.iterator(chunk_size=self.chunk_size)
+        else:
+            rows = iter(self.books)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def __iter__(self):
+        template = (self.engine.get_template(self.template_name) if self.engine
+                    else get_template(self.template_name)).template
+        # Missing rows are rendered from the compiled row's nodes in one
+        # context, as {% for %} would, instead of a Template.render() per
+        # row, which the debug toolbar and the test client each record
+        context = Context(autoescape=template.engine.autoescape)
+        with context.render_context.push_state(template), context.bind_template(template):
+            for chunk in self.chunks():
+                keys = [row_cache_key(self.template_name, book) for book in chunk]
+                cached = cache.get_many(keys)
+                rendered = {}
+                for key, book in zip(keys, chunk):
+                    fragment = cached.get(key)
+                    if fragment is None:
+                        with context.push(book=book):
+                            fragment = rendered[key] = template.nodelist.render(context)
+                    yield mark_safe(fragment)
+                if rendered:
+                    cache.set_many(rendered, self.timeout)
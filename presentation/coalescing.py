@@ -0,0 +1,101 @@
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import caching, metrics
+
+
+class Flight:
+    # One computation in progress and what it ended with
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Calls with the same key while one is running wait for it and share
+    # its result (or exception) instead of running again. In-process only:
+    # every worker process still computes once.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, function, timeout=None):
+        # (result, shared), shared being True for the callers that waited.
+        # A caller that waited timeout seconds runs function() itself.
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                return function(), False
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = function()
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, False
+
+
+flights = SingleFlight()
+
+
+def rendered(response):
+    # DRF and template responses are rendered once, by the request that ran the view
+    if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+        response.render()
+    return response
+
+
+def copy_response(response):
+    # A response of its own for every waiting request, as middleware sets
+    # headers and cookies on it
+    copy = HttpResponse(response.content, status=response.status_code)
+    for name, value in response.items():
+        copy[name] = value
+    return copy
+
+
+def coalesced(request, view, models=caching.CACHED_MODELS):
+    # view() once for identical GET and HEAD requests in flight: same path,
+    # query params, Accept header and generations of models, so a request
+    # that comes in after a write never shares a response read before it
+    if request.method not in ('GET', 'HEAD'):
+        return view()
+
+    key = caching.vary_key(request, models, request.method, request.META.get('HTTP_ACCEPT', ''))
+    response, shared = flights.do(key, lambda: rendered(view()), settings.COALESCE_WAIT_SECONDS)
+    if not shared:
+        return response
+    if response.streaming:
+        # A streamed body can be iterated once only
+        return view()
+    route = request.resolver_match.route if request.resolver_match else 'unmatched'
+    metrics.registry.increment('coalesced_requests_total', route)
+    return copy_response(response)
+
+
+def coalesce_requests(models=caching.CACHED_MODELS):
+    # For whole views, e.g. coalesce_requests()(SomeView.as_view()) in
+    # urls.py; class-based views can use CoalescedRequestMixin instead
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return coalesced(request, lambda: view(request, *args, **kwargs), models)
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.fields import empty
+
+from . import metrics
+
+
+class NotCompilable(Exception):
+    pass
+
+
+class Leaf:
+    def __init__(self, key, path, to_representation, optional=False):
+        self.key = key
+        self.path = path
+        self.to_representation = to_representation
+        # Missing on the instance means DRF skips the key (SkipField)
+        self.optional = optional
+
+
+class Nested:
+    def __init__(self, key, path, children):
+        self.key = key
+        self.path = path
+        self.children = children
+
+
+def compile_fields(serializer, prefix='', columns=None):
+    # columns: values() paths of the fields of a serializer reading its
+    # parent's stored columns (stored_columns) instead of a joined row
+    model = serializer.Meta.model
+    nodes = []
+    for key, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        source = field.source
+        if source == '*' or '.' in source or isinstance(
+                field, (serializers.ListSerializer, serializers.ManyRelatedField,
+                        serializers.SerializerMethodField)):
+            raise NotCompilable(f'{type(serializer).__name__}.{key}')
+
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            model_field = None
+
+        if isinstance(field, serializers.ModelSerializer):
+            if model_field is None or model_field.many_to_many or model_field.one_to_many \
+                    or columns is not None:
+                raise NotCompilable(f'{type(serializer).__name__}.{key}')
+            stored = getattr(field, 'stored_columns', None)
+            path = prefix + source
+            if stored is not None:
+                children = compile_fields(field, columns={
+                    name: prefix + column for name, column in stored.items()})
+                # The foreign key column is the stored pk of the relation
+                path = prefix + stored.get(field.Meta.model._meta.pk.name, source)
+            else:
+                children = compile_fields(field, f'{prefix}{source}__')
+            nodes.append(Nested(key, path, children))
+        elif columns is not None:
+            if source not in columns:
+                raise NotCompilable(f'{type(serializer).__name__}.{key}')
+            nodes.append(Leaf(key, columns[source], field.to_representation))
+        elif isinstance(field, serializers.PrimaryKeyRelatedField):
+            if field.pk_field is not None or model_field is None:
+                raise NotCompilable(f'{type(serializer).__name__}.{key}')
+            # values() returns the raw foreign key, which is the pk
+            nodes.append(Leaf(key, prefix + source, lambda value: value))
+        elif isinstance(field, serializers.RelatedField):
+            raise NotCompilable(f'{type(serializer).__name__}.{key}')
+        elif model_field is not None and model_field.concrete:
+            nodes.append(Leaf(key, prefix + source, field.to_representation))
+        elif not prefix and not field.required and field.default is empty:
+            nodes.append(Leaf(key, source, field.to_representation, optional=True))
+        else:
+            raise NotCompilable(f'{type(serializer).__name__}.{key}')
+    return nodes
+
+
+class CompiledSerializer:
+    # Read-only fast path for a ModelSerializer: the field tree is compiled
+    # once, rows come from values() with relations joined in SQL (or read
+    # from stored columns, see BookAuthorSerializer), and output
+    # dicts are built with the fields' own to_representation, so the result
+    # matches serializer.data without instantiating any model.
+
+    def __init__(self, serializer_class, fields=None):
+        self.serializer_class = serializer_class
+        serializer = serializer_class() if fields is None else serializer_class(fields=fields)
+        self.nodes = compile_fields(serializer)
+
+    def active_nodes(self, queryset):
+        # Optional fields (annotations) exist only when annotated
+        available = set(queryset.query.annotations) | set(queryset.query.extra)
+        return [node for node in self.nodes
+                if not (isinstance(node, Leaf) and node.optional and node.path not in available)]
+
+    def paths(self, nodes):
+        for node in nodes:
+            # Nested relations also select their key to tell a null relation
+            # apart from a related row full of nulls
+            yield node.path
+            if isinstance(node, Nested):
+                yield from self.paths(node.children)
+
+    def values(self, queryset, extra=()):
+        # extra: columns needed besides the output, e.g. a keyset ordering
+        paths = dict.fromkeys([*self.paths(self.active_nodes(queryset)), *extra])
+        return queryset.prefetch_related(None).values(*paths)
+
+    def build(self, row, nodes):
+        output = {}
+        for node in nodes:
+            if isinstance(node, Nested):
+                output[node.key] = None if row[node.path] is None else self.build(
+                    row, node.children)
+            else:
+                value = row[node.path]
+                output[node.key] = None if value is None else node.to_representation(value)
+        return output
+
+    def iter_representation(self, queryset, chunk_size=2000):
+        nodes = self.active_nodes(queryset)
+        for row in self.values(queryset).iterator(chunk_size=chunk_size):
+            yield self.build(row, nodes)
+
+    async def aiter_representation(self, queryset, chunk_size=2000):
+        nodes = self.active_nodes(queryset)
+        async for row in self.values(queryset).aiterator(chunk_size=chunk_size):
+            yield self.build(row, nodes)
+
+    @metrics.timed('serializer')
+    def to_representation(self, rows, queryset):
+        nodes = self.active_nodes(queryset)
+        return [self.build(row, nodes) for row in rows]
+
+
+@lru_cache(maxsize=512)
+def get_compiled_serializer(serializer_class, fields=None):
+    # None when the serializer has fields the fast path cannot reproduce;
+    # fields is a parse_fields() tree for SparseFieldsMixin serializers
+    try:
+        return CompiledSerializer(serializer_class, fields)
+    except NotCompilable:
+        return None
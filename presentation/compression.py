@@ -0,0 +1,70 @@
+import zlib
+
+import brotli
+from django.conf import settings
+
+# Preferred first when the client weighs them the same
+ENCODINGS = ('br', 'gzip')
+# Bodies compressed already, e.g. the export's .gz downloads
+COMPRESSED_TYPES = ('application/gzip',)
+
+
+def accepted_encodings(header):
+    # {coding: q} of an Accept-Encoding header
+    qualities = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+
+def negotiate(header):
+    # The coding to send for an Accept-Encoding header, None for identity
+    qualities = accepted_encodings(header)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def gzip_compressor():
+    # wbits 31 writes the gzip header and trailer
+    return zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def compress(encoding, data):
+    if encoding == 'br':
+        return brotli.compress(data, quality=settings.BROTLI_QUALITY)
+    compressor = gzip_compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(encoding, chunks):
+    # Every chunk is flushed, so the client gets it as soon as it is produced
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = gzip_compressor()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
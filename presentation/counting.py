@@ -0,0 +1,114 @@
+import hashlib
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import DatabaseError, connections
+
+from . import caching
+from .sharding import ShardedQuerySet
+
+COUNT_PREFIX = 'presentation:count:'
+ESTIMATE_PREFIX = 'presentation:count_estimate:'
+
+# value is the row count, exact is False when it is the planner's estimate
+RowCount = namedtuple('RowCount', ['value', 'exact'])
+
+
+def query_and_aliases(queryset):
+    if isinstance(queryset, ShardedQuerySet):
+        return queryset.queryset.query, queryset.aliases, (queryset.low, queryset.high)
+    # Unpinned querysets count the same on the primary and its replicas
+    return queryset.query, [queryset._db], ()
+
+
+def fingerprint(queryset):
+    # The count's SQL, whatever the queryset selects or is ordered by, and
+    # the generations of the models it may join; None when it matches nothing
+    query, aliases, extra = query_and_aliases(queryset)
+    query = query.clone()
+    query.clear_ordering(force=True)
+    query.select_related = False
+    query.clear_select_clause()
+    try:
+        sql, params = query.sql_with_params()
+    except EmptyResultSet:
+        return None
+    generations = [f'{model._meta.label_lower}={caching.generation(model)}'
+                   for model in caching.CACHED_MODELS]
+    raw = '|'.join([query.model._meta.label_lower, sql, repr(params), repr(aliases),
+                    repr(extra), *generations])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def is_unfiltered(queryset):
+    query, _, extra = query_and_aliases(queryset)
+    return not query.where and not query.distinct and not query.combinator \
+        and not query.is_sliced and not any(extra)
+
+
+def table_estimate(model, alias):
+    # Rows the planner believes the table has: pg_class.reltuples on
+    # Postgres, sqlite_stat1 (written by ANALYZE) on SQLite
+    connection = connections[alias]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [connection.ops.quote_name(table)])
+                row = cursor.fetchone()
+                # -1 until the table is first vacuumed or analyzed
+                return row[0] if row and row[0] >= 0 else None
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+                # The first number of every row is the rows in the table or
+                # index; partial indexes hold fewer
+                counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+                return max(counts) if counts else None
+    except DatabaseError:
+        # No sqlite_stat1 before the first ANALYZE
+        return None
+    return None
+
+
+def estimate(queryset):
+    # Summed over the shards, cached without generations: an estimate is
+    # only refreshed by ANALYZE anyway
+    model = queryset.model
+    _, aliases, _ = query_and_aliases(queryset)
+    aliases = [alias or 'default' for alias in aliases]
+    key = ESTIMATE_PREFIX + hashlib.md5(
+        repr([model._meta.label_lower, aliases]).encode()).hexdigest()
+    value = cache.get(key)
+    if value is None:
+        estimates = [table_estimate(model, alias) for alias in aliases]
+        value = -1 if None in estimates else sum(estimates)
+        cache.set(key, value, settings.ESTIMATED_COUNT_SECONDS)
+    return None if value < 0 else value
+
+
+def count(queryset):
+    # RowCount of a queryset for paginators. Exact counts are cached under
+    # the query and model generations, so any write to a book, author or
+    # category recounts; unfiltered counts of tables estimated at
+    # APPROXIMATE_COUNT_THRESHOLD rows or more use the estimate instead.
+    if is_unfiltered(queryset):
+        estimated = estimate(queryset)
+        if estimated is not None and estimated >= settings.APPROXIMATE_COUNT_THRESHOLD:
+            return RowCount(estimated, False)
+
+    key = fingerprint(queryset)
+    if key is None:
+        return RowCount(0, True)
+    value = cache.get(COUNT_PREFIX + key)
+    if value is None:
+        value = queryset.count()
+        cache.set(COUNT_PREFIX + key, value, settings.COUNT_CACHE_SECONDS)
+    return RowCount(value, True)
+
+
+async def acount(queryset):
+    return await sync_to_async(count)(queryset)
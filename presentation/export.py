@@ -0,0 +1,126 @@
+import csv
+import io
+import logging
+import time
+from collections import defaultdict
+from itertools import islice
+
+from . import compression, sharding
+from .models import Book
+from .streaming import encode
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ['id', 'title', 'author', 'publishing_house', 'categories', 'publication_date', 'price']
+COLUMNS = ('id', 'title', 'author_name', 'author__authorprofile__publishing_house',
+           'publication_date', 'price')
+# Category names within one CSV cell
+CATEGORY_SEPARATOR = '|'
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def book_chunks(queryset, chunk_size):
+    # Lists of up to chunk_size rows in id order, read from one cursor
+    # (server-side on Postgres), so only a chunk is held at a time
+    rows = queryset.order_by('id').values_list(*COLUMNS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def chunk_categories(alias, chunk):
+    # {book id: [category names]} of a chunk in one query; the chunk is an
+    # id range, so the link table's (book_id, category_id) index serves it
+    links = Book.categories.through.objects.using(alias).filter(
+        book_id__gte=chunk[0][0], book_id__lte=chunk[-1][0],
+    ).order_by('book_id', 'category_id').values_list('book_id', 'category__name')
+    categories = defaultdict(list)
+    for book_id, name in links:
+        categories[book_id].append(name)
+    return categories
+
+
+def export_rows(queryset=None, chunk_size=2000):
+    # Every book with its author's name, publishing house and category
+    # names, shard after shard with BOOK_SHARDS
+    for shard_queryset in sharding.per_shard(queryset if queryset is not None
+                                             else Book.objects.all()):
+        # One alias for the books and their links, also behind read replicas
+        alias = shard_queryset.db
+        for chunk in book_chunks(shard_queryset.using(alias), chunk_size):
+            categories = chunk_categories(alias, chunk)
+            for book_id, title, author, publishing_house, publication_date, price in chunk:
+                yield {
+                    'id': book_id,
+                    'title': title,
+                    'author': author,
+                    'publishing_house': publishing_house,
+                    'categories': categories.get(book_id, []),
+                    'publication_date': publication_date.isoformat(),
+                    'price': str(price),
+                }
+
+
+def csv_chunks(rows, chunk_size=2000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for index, row in enumerate(rows, 1):
+        writer.writerow([CATEGORY_SEPARATOR.join(row[field]) if field == 'categories'
+                         else row[field] for field in FIELDS])
+        if index % chunk_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(rows, chunk_size=2000):
+    lines = []
+    for row in rows:
+        lines.append(encode(row))
+        if len(lines) == chunk_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+class ExportProgress:
+    # Rows and bytes written so far, and their rates
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.bytes = 0
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        throughput = self.bytes / elapsed / 1_048_576 if elapsed else 0.0
+        return (f'{self.rows} rows, {self.bytes / 1_048_576:.1f}MB in {elapsed:.1f}s '
+                f'({rate:.0f} rows/s, {throughput:.1f}MB/s)')
+
+
+def export(output_format='csv', gzip=False, queryset=None, chunk_size=2000, progress=None):
+    # The catalogue as byte chunks; progress (an ExportProgress) is
+    # updated as they are produced
+    progress = progress or ExportProgress()
+
+    def counted(rows):
+        for row in rows:
+            progress.rows += 1
+            yield row
+
+    writer = csv_chunks if output_format == 'csv' else ndjson_chunks
+    chunks = writer(counted(export_rows(queryset, chunk_size)), chunk_size)
+    if gzip:
+        chunks = compression.compress_stream('gzip', chunks)
+    for chunk in chunks:
+        progress.bytes += len(chunk)
+        yield chunk
+    logger.info('Exported %s', progress.report())
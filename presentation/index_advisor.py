@@ -0,0 +1,305 @@
+import hashlib
+import re
+import sqlite3
+import time
+from contextlib import ExitStack, closing
+
+from django.apps import apps
+from django.db import connections, migrations, models
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+
+from . import slow_queries
+
+# Django's SQLite backend turns %s into ? and %% into % the same way
+FORMAT_PLACEHOLDER = re.compile(r'(?<!%)%s')
+COLUMN = r'"(\w+)"\."(\w+)"'
+EQUALITY = re.compile(COLUMN + r'\s*(?:=|IN\b)')
+RANGE = re.compile(COLUMN + r'\s*(?:[<>]=?|BETWEEN\b)')
+ORDER_BY = re.compile(r'\bORDER BY\b(.*?)(?:\bLIMIT\b|\bOFFSET\b|\)|$)', re.S)
+ORDER_COLUMN = re.compile(COLUMN + r'\s*(?:ASC|DESC)?')
+READS = ('SELECT', 'WITH')
+MAX_COLUMNS = 3
+
+
+class Query:
+    # One fingerprint of the workload, weighted by how often it ran
+    def __init__(self, fingerprint, sql, params):
+        self.fingerprint = fingerprint
+        self.sql = FORMAT_PLACEHOLDER.sub('?', sql).replace('%%', '%')
+        self.params = params
+        self.count = 0
+
+    def run(self, db):
+        db.execute(self.sql, self.params).fetchall()
+
+    def timing(self, db, repeat):
+        # Best of repeat runs in ms, after one run to warm the page cache
+        self.run(db)
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            self.run(db)
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def plan(self, db):
+        rows = db.execute('EXPLAIN QUERY PLAN ' + self.sql, self.params).fetchall()
+        return '\n'.join(row[-1] for row in rows)
+
+
+class Workload:
+    def __init__(self):
+        self.queries = {}
+
+    def add(self, sql, params):
+        # Reads only, writes would change the scratch copy between runs
+        if not sql.lstrip().upper().startswith(READS):
+            return
+        normalized = slow_queries.normalize(sql)
+        key = slow_queries.fingerprint(normalized)
+        query = self.queries.get(key)
+        if query is None:
+            query = self.queries[key] = Query(key, sql, plain_params(params))
+        query.count += 1
+
+    def add_entries(self, entries):
+        # slow_queries log entries; SLOW_QUERY_THRESHOLD_MS = 0 logs them all
+        for entry in entries:
+            if entry.get('vendor', 'sqlite') == 'sqlite' and entry.get('params') is not None:
+                self.add(entry['sql'], entry['params'])
+
+    def recorder(self):
+        # execute_wrapper collecting what the connection runs
+        def record(execute, sql, params, many, context):
+            if not many:
+                self.add(sql, params)
+            return execute(sql, params, many, context)
+        return record
+
+    def capture(self, call):
+        # Records the queries call() runs on any alias
+        record = self.recorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record))
+            call()
+
+    def entries(self):
+        # The workload in the slow-query log format, for --log later
+        for query in self.queries.values():
+            for _ in range(query.count):
+                yield {'vendor': 'sqlite', 'fingerprint': query.fingerprint,
+                       'normalized': slow_queries.normalize(query.sql), 'sql': query.sql,
+                       'params': query.params}
+
+
+def plain_params(params):
+    # What sqlite3 binds the same way after a round trip through JSON
+    return [param if param is None or isinstance(param, (int, float, str)) else str(param)
+            for param in params or ()]
+
+
+class Candidate:
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = tuple(columns)
+
+    def __eq__(self, other):
+        return (self.table, self.columns) == (other.table, other.columns)
+
+    def __hash__(self):
+        return hash((self.table, self.columns))
+
+    def __str__(self):
+        return f"{self.table}({', '.join(self.columns)})"
+
+    @property
+    def name(self):
+        return 'advisor_' + hashlib.sha1(str(self).encode()).hexdigest()[:12]
+
+    def create(self, db):
+        columns = ', '.join(f'"{column}"' for column in self.columns)
+        db.execute(f'CREATE INDEX "{self.name}" ON "{self.table}" ({columns})')
+
+    def drop(self, db):
+        db.execute(f'DROP INDEX "{self.name}"')
+
+
+def model_tables(app_label):
+    # Tables of the app a migration can add indexes to: {table: model}
+    return {model._meta.db_table: model for model in apps.get_app_config(app_label).get_models()
+            if model._meta.managed and not model._meta.proxy}
+
+
+def query_candidates(query, tables):
+    # Single-column and composite indexes that could serve the query's
+    # filters and ordering: equality columns first, then one range column
+    # or the ORDER BY columns
+    equality, ranges, order = {}, {}, {}
+    for table, column in EQUALITY.findall(query.sql):
+        equality.setdefault(table, []).append(column)
+    for table, column in RANGE.findall(query.sql):
+        ranges.setdefault(table, []).append(column)
+    for clause in ORDER_BY.findall(query.sql):
+        for table, column in ORDER_COLUMN.findall(clause):
+            order.setdefault(table, []).append(column)
+
+    candidates = set()
+    for table in tables.keys() & (equality.keys() | ranges.keys() | order.keys()):
+        eq = list(dict.fromkeys(equality.get(table, [])))
+        rng = [column for column in dict.fromkeys(ranges.get(table, [])) if column not in eq]
+        by = list(dict.fromkeys(order.get(table, [])))
+        for column in eq + rng + by[:1]:
+            candidates.add((table, (column,)))
+        if eq and rng:
+            candidates.add((table, tuple(eq + rng[:1])))
+        if eq and by:
+            candidates.add((table, tuple(dict.fromkeys(eq + by))))
+        if len(by) > 1:
+            candidates.add((table, tuple(by)))
+    return {Candidate(table, columns[:MAX_COLUMNS]) for table, columns in candidates}
+
+
+def existing_indexes(db, table):
+    indexes = []
+    for row in db.execute(f'PRAGMA index_list("{table}")').fetchall():
+        indexes.append(tuple(info[2] for info in db.execute(f'PRAGMA index_info("{row[1]}")')))
+    return indexes
+
+
+def is_covered(candidate, indexes):
+    # An index starting with the candidate's columns serves it already;
+    # the rowid covers a lone primary key
+    if candidate.columns == ('id',):
+        return True
+    return any(index[:len(candidate.columns)] == candidate.columns for index in indexes)
+
+
+def scratch_copy(alias, path):
+    # Copy of an SQLite database at path, the candidates are tried on it
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        raise ValueError(f'{alias} is not an SQLite database')
+    scratch = sqlite3.connect(path)
+    with closing(sqlite3.connect(connection.settings_dict['NAME'])) as source:
+        source.backup(scratch)
+    return scratch
+
+
+class Advisor:
+    # Greedy search: each round creates every remaining candidate on the
+    # scratch copy, re-times the queries whose plan it changes and keeps the
+    # one saving the most weighted time, until none saves min_gain of the
+    # time of the queries it touches and at least min_ms (timer noise)
+
+    def __init__(self, db, workload, app_label, repeat=3, min_gain=0.1, min_ms=1.0,
+                 max_indexes=5):
+        self.db = db
+        self.repeat = repeat
+        self.min_gain = min_gain
+        self.min_ms = min_ms
+        self.max_indexes = max_indexes
+        self.tables = model_tables(app_label)
+        self.queries = []
+        self.failed = []
+        for query in workload.queries.values():
+            try:
+                query.plan(db)
+            except sqlite3.Error as exc:
+                self.failed.append((query, exc))
+            else:
+                self.queries.append(query)
+
+    def candidates(self):
+        found = {}
+        for query in self.queries:
+            for candidate in query_candidates(query, self.tables):
+                found.setdefault(candidate, []).append(query)
+        indexes = {}
+        for candidate in list(found):
+            if candidate.table not in indexes:
+                indexes[candidate.table] = existing_indexes(self.db, candidate.table)
+            if is_covered(candidate, indexes[candidate.table]):
+                del found[candidate]
+        return found
+
+    def run(self):
+        # Only queries some candidate could serve are timed
+        remaining = self.candidates()
+        touched = {query for queries in remaining.values() for query in queries}
+        baseline = {query: (query.plan(self.db), query.timing(self.db, self.repeat))
+                    for query in self.queries if query in touched}
+        current = dict(baseline)
+        chosen = []
+        while remaining and len(chosen) < self.max_indexes:
+            best = None
+            for candidate, queries in remaining.items():
+                result = self.evaluate(candidate, queries, current)
+                if result is not None and (best is None or result['gain_ms'] > best['gain_ms']):
+                    best = result
+            if best is None:
+                break
+            best['candidate'].create(self.db)
+            chosen.append(best)
+            current.update(best['after'])
+            del remaining[best['candidate']]
+        return {'baseline': baseline, 'current': current, 'chosen': chosen,
+                'failed': self.failed}
+
+    def evaluate(self, candidate, queries, current):
+        candidate.create(self.db)
+        try:
+            after = {}
+            for query in queries:
+                plan = query.plan(self.db)
+                if plan != current[query][0]:
+                    after[query] = (plan, query.timing(self.db, self.repeat))
+        finally:
+            candidate.drop(self.db)
+        if not after:
+            return None
+        before_ms = sum(current[query][1] * query.count for query in after)
+        gain_ms = before_ms - sum(timing * query.count for query, (_, timing) in after.items())
+        if gain_ms < max(self.min_ms, self.min_gain * before_ms):
+            return None
+        return {'candidate': candidate, 'gain_ms': gain_ms, 'before_ms': before_ms,
+                'after': after}
+
+
+def field_names(model, columns):
+    by_column = {field.column: field.name for field in model._meta.concrete_fields}
+    return [by_column[column] for column in columns]
+
+
+def index_name(model, fields):
+    # Index names are limited to 30 characters
+    name = f"{model._meta.model_name}_{'_'.join(fields)}_idx"
+    if len(name) > 30:
+        digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+        name = f'{model._meta.model_name[:17]}_{digest}_idx'
+    return name
+
+
+def advised_indexes(chosen, app_label):
+    # (model, models.Index) per chosen candidate
+    tables = model_tables(app_label)
+    for result in chosen:
+        model = tables[result['candidate'].table]
+        fields = field_names(model, result['candidate'].columns)
+        yield model, models.Index(fields=fields, name=index_name(model, fields))
+
+
+def build_migration(indexes, app_label, name='advised_indexes'):
+    # MigrationWriter for an AddIndex migration after the app's latest one
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    leaves = loader.graph.leaf_nodes(app_label)
+    number = max((int(leaf.split('_')[0]) for _, leaf in leaves), default=0) + 1
+    migration = migrations.Migration(f'{number:04d}_{name}', app_label)
+    migration.dependencies = leaves
+    migration.operations = [
+        migrations.AddIndex(model_name=model._meta.model_name, index=index)
+        for model, index in indexes
+    ]
+    return MigrationWriter(migration)
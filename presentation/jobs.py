@@ -0,0 +1,219 @@
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import price_updates
+from .models import BackgroundJob, PriceUpdateJob
+from .sync import BookSync
+
+logger = logging.getLogger(__name__)
+
+# The queue table lives on the primary default database, never a replica
+JOBS_ALIAS = 'default'
+TASKS = {}
+
+
+class LeaseLost(price_updates.Superseded):
+    # Another worker took the job over after this one stopped reporting. A
+    # Superseded, so a PriceUpdateRunner stopped by it leaves its job alone.
+    pass
+
+
+def task(kind):
+    # Registers function(job, report) as the handler of jobs of this kind.
+    # report(**progress) stores the progress and renews the job's lease.
+    # Handlers are retried after a failure, so they must be resumable.
+    def decorator(function):
+        TASKS[kind] = function
+        return function
+    return decorator
+
+
+def queue():
+    return BackgroundJob.objects.using(JOBS_ALIAS)
+
+
+def enqueue(kind, payload=None, max_attempts=5, coalesce=False):
+    # With coalesce, a job of the same kind and payload still waiting to
+    # run is returned instead of queueing another one
+    if kind not in TASKS:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    payload = payload or {}
+    if coalesce:
+        for job in queue().filter(kind=kind, status=BackgroundJob.PENDING).order_by('id'):
+            if job.payload == payload:
+                return job
+    return queue().create(kind=kind, payload=payload, max_attempts=max_attempts)
+
+
+def retry_delay(attempts):
+    # Exponential backoff with jitter, so failing jobs do not retry in step
+    delay = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+                settings.JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def release_expired():
+    # Running jobs whose worker has not reported within JOB_LEASE_SECONDS
+    # (it died or hangs) go back to the queue, or fail once out of attempts
+    now = timezone.now()
+    expired = queue().filter(status=BackgroundJob.RUNNING,
+                             locked_at__lt=now - timedelta(seconds=settings.JOB_LEASE_SECONDS))
+    expired.filter(attempts__gte=F('max_attempts')).update(
+        status=BackgroundJob.FAILED, error='Lease expired', locked_by='', finished_at=now,
+        updated_at=now)
+    expired.update(status=BackgroundJob.PENDING, error='Lease expired', locked_by='',
+                   run_after=now, updated_at=now)
+
+
+def claim(worker, kinds=None):
+    # The oldest due job, marked as this worker's. The status check in the
+    # UPDATE makes the claim atomic without row locks, so it works on
+    # SQLite as well as Postgres.
+    now = timezone.now()
+    due = queue().filter(status=BackgroundJob.PENDING, run_after__lte=now)
+    if kinds:
+        due = due.filter(kind__in=kinds)
+    for job_id in due.order_by('run_after', 'id').values_list('id', flat=True)[:10]:
+        claimed = queue().filter(pk=job_id, status=BackgroundJob.PENDING).update(
+            status=BackgroundJob.RUNNING, locked_by=worker, locked_at=now,
+            attempts=F('attempts') + 1, updated_at=now)
+        if claimed:
+            return queue().get(pk=job_id)
+    return None
+
+
+def owned(job):
+    return queue().filter(pk=job.pk, status=BackgroundJob.RUNNING, locked_by=job.locked_by)
+
+
+def run(job):
+    def report(**progress):
+        now = timezone.now()
+        if not owned(job).update(progress=progress, locked_at=now, updated_at=now):
+            raise LeaseLost(f'Job {job.pk} is no longer held by {job.locked_by}')
+        job.progress = progress
+
+    try:
+        handler = TASKS.get(job.kind)
+        if handler is None:
+            raise LookupError(f'Unknown job kind {job.kind!r}')
+        result = handler(job, report)
+    except LeaseLost:
+        logger.warning('Job %s lost its lease', job.pk)
+        return
+    except Exception as exc:
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            status, run_after = BackgroundJob.PENDING, now + timedelta(
+                seconds=retry_delay(job.attempts))
+            logger.warning('Job %s (%s) attempt %d failed, retrying at %s: %r',
+                           job.pk, job.kind, job.attempts, run_after, exc)
+        else:
+            status, run_after = BackgroundJob.FAILED, job.run_after
+            logger.exception('Job %s (%s) failed after %d attempts', job.pk, job.kind, job.attempts)
+        owned(job).update(status=status, run_after=run_after, error=repr(exc), locked_by='',
+                          finished_at=now if status == BackgroundJob.FAILED else None,
+                          updated_at=now)
+        return
+
+    now = timezone.now()
+    owned(job).update(status=BackgroundJob.DONE, result=result, error='', locked_by='',
+                      finished_at=now, updated_at=now)
+    logger.info('Job %s (%s) done', job.pk, job.kind)
+
+
+class Worker:
+    # Threads that claim and run one job at a time until stopped. With
+    # once, each thread exits when no job is due.
+
+    def __init__(self, threads=None, poll=None, kinds=None, once=False):
+        self.threads = threads or settings.JOB_WORKERS
+        if self.threads > 1 and connections[JOBS_ALIAS].vendor == 'sqlite':
+            # One writer at a time: parallel jobs would fail with "database
+            # is locked" and only burn their attempts
+            logger.warning('SQLite queue, running jobs in one thread instead of %d', self.threads)
+            self.threads = 1
+        self.poll = settings.JOB_POLL_SECONDS if poll is None else poll
+        self.kinds = kinds
+        self.once = once
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def run(self):
+        threads = [threading.Thread(target=self.loop, args=(f'{self.name}:{index}',),
+                                    name=f'job-worker-{index}', daemon=True)
+                   for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                # A timeout keeps the main thread responsive to Ctrl-C
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        # Running jobs finish their handler first
+        self.stopping.set()
+
+    def loop(self, worker):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    release_expired()
+                    job = claim(worker, self.kinds)
+                except DatabaseError as exc:
+                    # e.g. SQLite's "database is locked" under concurrent writers
+                    logger.warning('Worker %s could not poll the queue: %r', worker, exc)
+                    job = None
+                if job is None:
+                    if self.once:
+                        return
+                    self.stopping.wait(self.poll)
+                    continue
+                run(job)
+        finally:
+            connections.close_all()
+
+
+# Tasks
+
+@task('price_update')
+def price_update(job, report):
+    # Resumes the PriceUpdateJob from its last committed batch on a retry
+    price_job = PriceUpdateJob.objects.get(pk=job.payload['price_job'])
+
+    def before_commit(price_job):
+        # Checked inside the batch transaction: a worker whose lease expired
+        # rolls its batch back instead of committing it next to the worker
+        # that took the job over. On Postgres the renewed lease row stays
+        # locked until the commit, so release_expired cannot slip in between.
+        report(last_id=price_job.last_id, max_id=price_job.max_id,
+               rows_updated=price_job.rows_updated)
+
+    price_updates.PriceUpdateRunner(price_job, sleep=job.payload.get('sleep', 0),
+                                    before_commit=before_commit).run()
+    return {'price_job': price_job.pk, 'rows_updated': price_job.rows_updated}
+
+
+@task('sync_books_to_db2')
+def sync_books_to_db2(job, report):
+    # Resumes from the sync's high-water mark on a retry
+    sync_report = BookSync(on_batch=lambda sync_report: report(
+        rows=sync_report.rows, reread=sync_report.reread)).run()
+    data = sync_report.as_dict()
+    del data['batches']
+    return data
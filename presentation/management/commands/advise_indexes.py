@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.utils import run_formatters
+
+from presentation import index_advisor, slow_queries
+from presentation.benchmarking import RouteFailed, fetch, get_routes, route_client, route_urls
+
+
+class Command(BaseCommand):
+    help = ('Try candidate indexes for a captured query workload on a scratch copy of an '
+            'SQLite database and write a migration adding the ones that pay off')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', action='append', default=[],
+                            help='Slow-query log to read the workload from (repeatable); '
+                                 'run with SLOW_QUERY_THRESHOLD_MS = 0 to log every query')
+        parser.add_argument('--replay', action='store_true',
+                            help='Capture the workload by requesting every read-only route')
+        parser.add_argument('--only', nargs='+', help='Substrings of the routes to replay')
+        parser.add_argument('--save-workload', help='Write the workload as a log for --log')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--app', default='presentation')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per query')
+        parser.add_argument('--min-gain', type=float, default=10,
+                            help='Percent of the affected queries\' time an index must save')
+        parser.add_argument('--min-ms', type=float, default=1.0,
+                            help='Weighted milliseconds an index must save')
+        parser.add_argument('--max-indexes', type=int, default=5)
+        parser.add_argument('--plans', action='store_true', help='Show plans before and after')
+        parser.add_argument('--write', action='store_true',
+                            help='Write the migration to the app instead of printing it')
+
+    def handle(self, *args, **options):
+        workload = index_advisor.Workload()
+        for path in options['log']:
+            workload.add_entries(slow_queries.read_entries(Path(path)))
+        if options['replay']:
+            client = route_client()
+            for _, url in route_urls(get_routes(options['only'])):
+                try:
+                    workload.capture(lambda: fetch(client, url))
+                except RouteFailed as exc:
+                    raise CommandError(str(exc))
+        if not options['log'] and not options['replay']:
+            workload.add_entries(slow_queries.read_entries(Path(settings.SLOW_QUERY_LOG)))
+        if not workload.queries:
+            raise CommandError('The workload is empty, pass --log or --replay')
+
+        if options['save_workload']:
+            with open(options['save_workload'], 'w') as output:
+                for entry in workload.entries():
+                    output.write(json.dumps(entry) + '\n')
+
+        runs = sum(query.count for query in workload.queries.values())
+        self.stdout.write(f'Workload: {len(workload.queries)} queries, {runs} runs')
+
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                db = index_advisor.scratch_copy(
+                    options['database'], os.path.join(directory, 'scratch.sqlite3'))
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            try:
+                advisor = index_advisor.Advisor(
+                    db, workload, options['app'], repeat=options['repeat'],
+                    min_gain=options['min_gain'] / 100, min_ms=options['min_ms'],
+                    max_indexes=options['max_indexes'])
+                result = advisor.run()
+            finally:
+                db.close()
+
+        if result['failed']:
+            self.stdout.write(f"Skipped {len(result['failed'])} queries SQLite cannot run")
+        self.report(result, options['plans'])
+        if not result['chosen']:
+            self.stdout.write('No candidate index pays off for this workload')
+            return
+
+        indexes = list(index_advisor.advised_indexes(result['chosen'], options['app']))
+        self.stdout.write('\nAdd to the models\' Meta.indexes:')
+        for model, index in indexes:
+            self.stdout.write(f'    {model.__name__}: models.Index(fields={index.fields!r}, '
+                              f'name={index.name!r}),')
+
+        writer = index_advisor.build_migration(indexes, options['app'])
+        if options['write']:
+            os.makedirs(os.path.dirname(writer.path), exist_ok=True)
+            with open(writer.path, 'w') as output:
+                output.write(writer.as_string())
+            run_formatters([writer.path])
+            self.stdout.write(self.style.SUCCESS(f'Wrote {writer.path}'))
+        else:
+            self.stdout.write(f'\n# {writer.filename}')
+            self.stdout.write(writer.as_string())
+
+    def report(self, result, plans):
+        baseline, current = result['baseline'], result['current']
+        before = sum(timing * query.count for query, (_, timing) in baseline.items())
+        after = sum(timing * query.count for query, (_, timing) in current.items())
+        self.stdout.write(f'Queries with candidates: {len(baseline)}, weighted time '
+                          f'{before:.1f}ms -> {after:.1f}ms')
+        for position, chosen in enumerate(result['chosen'], 1):
+            self.stdout.write(
+                f"{position:>3}. {chosen['candidate']}  saves {chosen['gain_ms']:.1f}ms of "
+                f"{chosen['before_ms']:.1f}ms ({chosen['gain_ms'] / chosen['before_ms']:.0%}) "
+                f"over {len(chosen['after'])} queries"
+            )
+            for query, (plan, timing) in chosen['after'].items():
+                self.stdout.write(f"     {baseline[query][1]:>9.2f}ms -> {timing:>9.2f}ms  x"
+                                  f"{query.count}  {slow_queries.normalize(query.sql)[:200]}")
+                if plans:
+                    for line in baseline[query][0].splitlines():
+                        self.stdout.write(f'       before: {line}')
+                    for line in plan.splitlines():
+                        self.stdout.write(f'       after:  {line}')
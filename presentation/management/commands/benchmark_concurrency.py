@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+
+from presentation.benchmarking import load_tasks, load_threads, write_results
+from presentation.models import Book
+
+# Sync route and its async counterpart
+ROUTES = [
+    ('books/<int:pk>/', 'async/books/<int:pk>/'),
+    ('books/aggregate/', 'async/books/aggregate/'),
+    ('books/limitoffset_pagination_view?limit=20', 'async/books/limitoffset_pagination_view?limit=20'),
+    ('books/keyset_pagination_view', 'async/books/keyset_pagination_view'),
+]
+# An address outside INTERNAL_IPS keeps the debug toolbar out
+REMOTE_ADDR = '192.0.2.1'
+
+
+class Command(BaseCommand):
+    help = ('Compare requests/sec and p99 of the sync views under WSGI with the sync '
+            'and async views under ASGI at increasing concurrency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 100, 250, 500])
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per route, mode and concurrency level')
+        parser.add_argument('--output', default='benchmark_concurrency.json')
+        parser.add_argument('--only', nargs='+', help='Substrings of the routes to run')
+
+    def handle(self, *args, **options):
+        book = Book.objects.order_by('id').first()
+        pk = str(book.pk if book else 1)
+
+        results = {}
+        for sync_route, async_route in ROUTES:
+            if options['only'] and not any(part in sync_route for part in options['only']):
+                continue
+            sync_url = '/' + sync_route.replace('<int:pk>', pk)
+            async_url = '/' + async_route.replace('<int:pk>', pk)
+            for concurrency in options['concurrency']:
+                runs = {
+                    'wsgi_sync': self.wsgi(sync_url, concurrency, options['requests']),
+                    'asgi_sync': self.asgi(sync_url, concurrency, options['requests']),
+                    'asgi_async': self.asgi(async_url, concurrency, options['requests']),
+                }
+                for mode, row in runs.items():
+                    results[f'{sync_route} {mode} c={concurrency}'] = row
+                    self.stdout.write(
+                        f"{sync_route:<45} {mode:<10} c={concurrency:<4} "
+                        f"{row['requests_per_second']:>8.1f} req/s  p50 {row['p50_ms']:>9.2f}ms  "
+                        f"p99 {row['p99_ms']:>9.2f}ms  {row['failures']} failed"
+                    )
+
+        write_results(options['output'], results)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    @staticmethod
+    def wsgi(url, concurrency, total):
+        def make_call():
+            client = Client(REMOTE_ADDR=REMOTE_ADDR, HTTP_ACCEPT='application/json')
+            return lambda: client.get(url).status_code == 200
+        return load_threads(make_call, concurrency, total)
+
+    @staticmethod
+    def asgi(url, concurrency, total):
+        client = AsyncClient(client=[REMOTE_ADDR, 0])
+
+        async def call():
+            response = await client.get(url, ACCEPT='application/json')
+            return response.status_code == 200
+        return load_tasks(call, concurrency, total)
@@ -0,0 +1,62 @@
+import json
+import time
+
+import msgpack
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from presentation import compression
+from presentation.compiled import get_compiled_serializer
+from presentation.models import Book
+from presentation.renderers import ColumnarJSONRenderer, MessagePackRenderer, rows_from_columnar
+from presentation.serializers import BookSerializer, OnlyBookSerializer
+
+RENDERERS = [
+    ('json', JSONRenderer(), json.loads),
+    ('msgpack', MessagePackRenderer(), msgpack.unpackb),
+    ('columnar', ColumnarJSONRenderer(), lambda body: rows_from_columnar(json.loads(body))),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare body size and encode time of the list renderers, plain and compressed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        for serializer_class in (BookSerializer, OnlyBookSerializer):
+            compiled = get_compiled_serializer(serializer_class)
+            queryset = Book.objects.order_by('id')[:options['rows']]
+            # What the compiled list endpoints hand to the renderer
+            data = compiled.to_representation(compiled.values(queryset), queryset)
+            self.stdout.write(f'{serializer_class.__name__}, {len(data)} rows')
+
+            baseline = None
+            for name, renderer, decode in RENDERERS:
+                body, render_ms = self.timed(lambda: renderer.render(data), options['repeat'])
+                if decode(body) != json.loads(json.dumps(data, default=str)):
+                    raise CommandError(f'{name} does not decode to the rows')
+                baseline = baseline or len(body)
+                self.write_row(name, 'identity', len(body), baseline, render_ms)
+                for encoding in compression.ENCODINGS:
+                    compressed, compress_ms = self.timed(
+                        lambda: compression.compress(encoding, body), options['repeat'])
+                    self.write_row(name, encoding, len(compressed), baseline,
+                                   render_ms + compress_ms)
+
+    def write_row(self, name, encoding, size, baseline, encode_ms):
+        self.stdout.write(f'  {name:<9} {encoding:<9} {size:>11} bytes  {size / baseline:>6.1%} '
+                          f'of json  encode {encode_ms:>9.2f}ms')
+
+    @staticmethod
+    def timed(call, repeat):
+        # Result and best time in ms
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = call()
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
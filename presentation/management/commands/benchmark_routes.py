@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from presentation.benchmarking import RouteFailed, compare_results, fetch, get_routes, \
+    measure, route_client, route_urls, write_results
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, query count and peak memory of every route'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare', help='Earlier results file to diff against')
+        parser.add_argument('--include-writes', action='store_true')
+        parser.add_argument('--only', nargs='+', help='Substrings of the routes to run')
+
+    def handle(self, *args, **options):
+        client = route_client()
+
+        results = {}
+        routes = get_routes(options['only'], options['include_writes'])
+        for route, url in route_urls(routes):
+            try:
+                results[route] = measure(lambda: fetch(client, url), repeat=options['repeat'])
+            except RouteFailed as exc:
+                raise CommandError(f'{route}: {exc}')
+            row = results[route]
+            self.stdout.write(
+                f"{route:<45} p50 {row['p50_ms']:>9.2f}ms  p99 {row['p99_ms']:>9.2f}ms  "
+                f"{row['queries']:>6.1f} queries  {row['peak_memory_kb']:>9.1f}KB"
+            )
+
+        write_results(options['output'], results)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                rows = compare_results(json.load(baseline), results)
+            for route, before, after, ratio in rows:
+                change = f'{ratio:.2f}x' if ratio is not None else 'n/a'
+                self.stdout.write(f'{route:<45} {before:>9.2f}ms -> {after:>9.2f}ms  {change}')
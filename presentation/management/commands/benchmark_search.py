@@ -0,0 +1,69 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from presentation.models import Author, Book
+from presentation.search import IcontainsSearchBackend, get_search_backend
+
+WORDS = [
+    'shadow', 'river', 'empire', 'garden', 'winter', 'silver', 'storm', 'night',
+    'crown', 'forest', 'glass', 'ember', 'harbor', 'iron', 'journey', 'lantern',
+]
+QUERIES = ['river', 'silv', 'winter crown', 'nowak', 'zzz']
+
+
+class Command(BaseCommand):
+    help = 'Compare the icontains filter with the indexed search backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        backends = [
+            ('icontains', IcontainsSearchBackend()),
+            ('indexed', get_search_backend()),
+        ]
+        for rows in options['rows']:
+            # Synthetic rows are rolled back once the scale has been measured
+            with transaction.atomic():
+                self.seed(rows, random.Random(options['seed']))
+                for name, backend in backends:
+                    timings = self.measure(backend, options['repeat'])
+                    self.stdout.write(
+                        f'{rows:>9} rows  {name:<10} ' +
+                        '  '.join(f'{query!r}: {ms:.2f}ms' for query, ms in timings)
+                    )
+                transaction.set_rollback(True)
+
+    def seed(self, rows, rng):
+        authors = Author.objects.bulk_create(
+            Author(name=f'{rng.choice(["Nowak", "Kowalski", "Smith"])} {i}')
+            for i in range(max(rows // 100, 1))
+        )
+        batch = []
+        for i in range(rows):
+            batch.append(Book(
+                title=' '.join(rng.sample(WORDS, 3)),
+                author=rng.choice(authors),
+                publication_date=datetime.date(2000, 1, 1) + datetime.timedelta(days=i % 8000),
+                price=rng.randint(100, 9999) / 100,
+            ))
+            if len(batch) == 10_000:
+                Book.objects.bulk_create(batch)
+                batch = []
+        Book.objects.bulk_create(batch)
+
+    def measure(self, backend, repeat):
+        timings = []
+        for query in QUERIES:
+            queryset = backend.search(Book.objects.all(), query)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.values_list('id', flat=True))
+            timings.append((query, (time.perf_counter() - started) * 1000 / repeat))
+        return timings
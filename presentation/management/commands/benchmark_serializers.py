@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Length
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from presentation.compiled import get_compiled_serializer
+from presentation.mixins import optimize_queryset
+from presentation.models import Author, AuthorProfile, Book
+from presentation.serializers import AnnotatedBookSerializer, AuthorProfileSerializer, \
+    AuthorSerializer, BookSerializer, OnlyBookSerializer
+
+
+class JoinedBookSerializer(AnnotatedBookSerializer):
+    # AnnotatedBookSerializer before the stored columns: the author joined and the
+    # title length computed in SQL, for comparison with the join-free path
+    title_length = serializers.IntegerField(source='computed_title_length', read_only=True)
+    author = AuthorSerializer()
+
+
+def cases():
+    yield 'BookSerializer', BookSerializer, Book.objects.all()
+    yield 'AnnotatedBookSerializer', AnnotatedBookSerializer, Book.objects.all()
+    yield 'JoinedBookSerializer', JoinedBookSerializer, Book.objects.annotate(
+        computed_title_length=Length('title'))
+    yield 'OnlyBookSerializer', OnlyBookSerializer, Book.objects.only('title', 'price')
+    yield 'AuthorSerializer', AuthorSerializer, Author.objects.all()
+    yield 'AuthorProfileSerializer', AuthorProfileSerializer, AuthorProfile.objects.all()
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of DRF serializers with their compiled fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        for name, serializer_class, queryset in cases():
+            queryset = optimize_queryset(queryset, serializer_class())
+            compiled = get_compiled_serializer(serializer_class)
+
+            def drf():
+                return renderer.render(serializer_class(queryset.all(), many=True).data)
+
+            def fast():
+                rows = compiled.values(queryset.all())
+                return renderer.render(compiled.to_representation(rows, queryset))
+
+            if drf() != fast():
+                raise CommandError(f'{name}: compiled output differs from DRF output')
+
+            rows = queryset.count()
+            before = self.rows_per_second(drf, rows, options['repeat'])
+            after = self.rows_per_second(fast, rows, options['repeat'])
+            self.stdout.write(
+                f'{name:<30} {rows:>8} rows  drf {before:>11.0f} rows/s  '
+                f'compiled {after:>11.0f} rows/s  {after / before:>5.1f}x'
+            )
+
+    @staticmethod
+    def rows_per_second(call, rows, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            call()
+        return rows * repeat / (time.perf_counter() - started)
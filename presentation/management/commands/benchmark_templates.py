@@ -0,0 +1,77 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.template.backends.django import DjangoTemplates
+
+from presentation import caching
+from presentation.models import Book
+
+
+def template_backend(loaders):
+    configured = settings.TEMPLATES[0]
+    options = {key: value for key, value in configured.get('OPTIONS', {}).items()
+               if key != 'loaders'}
+    return DjangoTemplates({
+        'NAME': 'benchmark',
+        'DIRS': configured.get('DIRS', []),
+        'APP_DIRS': False,
+        'OPTIONS': {**options, 'loaders': loaders},
+    })
+
+
+class Command(BaseCommand):
+    help = ('Time rendering the book list page per 1k rows, with templates read from disk or '
+            'kept by the cached loader, and with rows rendered, cached cold and cached warm')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        books = list(Book.objects.order_by('id')[:options['rows']])
+        keys = [caching.row_cache_key('book_row.html', book) for book in books]
+        backends = [
+            ('filesystem', template_backend(settings.TEMPLATE_LOADERS)),
+            ('cached', template_backend(
+                [('django.template.loaders.cached.Loader', settings.TEMPLATE_LOADERS)])),
+        ]
+        scale = 1000 / max(len(books), 1)
+        self.stdout.write(f'{len(books)} rows, best of {options["repeat"]}, ms per 1k rows')
+        self.stdout.write(f'  {"loader":<12} {"plain rows":>12} {"rows cold":>12} {"rows warm":>12}')
+
+        for name, backend in backends:
+            def plain():
+                # The row markup inlined in one {% for %} loop, as the pages
+                # were before rows were cached
+                source = backend.get_template('book_row.html').template.source
+                rows = backend.from_string('{% for book in books %}' + source + '{% endfor %}')
+                return self.render_page(backend, [rows.render({'books': books})])
+
+            def rows():
+                return self.render_page(backend, caching.RowFragments(books, engine=backend))
+
+            def cold():
+                cache.delete_many(keys)
+                return rows()
+
+            timings = [self.timed(call, options['repeat']) * scale for call in (plain, cold, rows)]
+            self.stdout.write(f'  {name:<12} ' + ' '.join(f'{ms:>12.2f}' for ms in timings))
+        cache.delete_many(keys)
+
+    @staticmethod
+    def render_page(backend, book_rows):
+        return backend.get_template('book_list_2.html').render(
+            {'book_list': [], 'book_rows': book_rows})
+
+    @staticmethod
+    def timed(call, repeat):
+        # Best time in ms
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
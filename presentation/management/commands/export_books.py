@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from presentation import export
+
+
+class Command(BaseCommand):
+    help = 'Stream every book to a CSV or NDJSON file in one pass, optionally gzipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(export.FORMATS), default='csv')
+        parser.add_argument('--output', default='-', help='File to write, - for stdout')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows read and written at a time')
+        parser.add_argument('--progress-every', type=float, default=5.0,
+                            help='Seconds between progress lines on stderr, 0 for none')
+
+    def handle(self, *args, **options):
+        progress = export.ExportProgress()
+        chunks = export.export(options['format'], options['gzip'],
+                               chunk_size=options['chunk_size'], progress=progress)
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        reported = time.perf_counter()
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                if options['progress_every'] and \
+                        time.perf_counter() - reported >= options['progress_every']:
+                    self.stderr.write(progress.report())
+                    reported = time.perf_counter()
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f'Exported {progress.report()}'))
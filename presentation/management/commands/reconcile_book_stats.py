@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from presentation import stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the BookStats aggregates from the books table'
+
+    def handle(self, *args, **options):
+        stats.reconcile()
+        overall = stats.summary()
+        total = overall[0]['total_books'] if overall else 0
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt book stats for {total} books'))
@@ -0,0 +1,46 @@
+import sqlite3
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from routers import replicas
+
+
+class Command(BaseCommand):
+    help = 'Copy each SQLite primary onto its SQLite read replicas (local stand-ins for replication)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--primary', nargs='+', help='Only these primary aliases')
+
+    def handle(self, *args, **options):
+        configured = getattr(settings, 'DATABASE_REPLICAS', {})
+        if not configured:
+            raise CommandError('DATABASE_REPLICAS is empty')
+
+        for primary, replica_weights in configured.items():
+            if options['primary'] and primary not in options['primary']:
+                continue
+            source = connections[primary]
+            if source.vendor != 'sqlite':
+                self.stdout.write(f'Skipping {primary}: not SQLite')
+                continue
+            for alias in replica_weights:
+                target = connections[alias]
+                if target.vendor != 'sqlite':
+                    self.stdout.write(f'Skipping {alias}: not SQLite')
+                    continue
+                # Drop open handles so the copy is what the next read sees
+                target.close()
+                try:
+                    with closing(sqlite3.connect(source.settings_dict['NAME'])) as src, \
+                            closing(sqlite3.connect(target.settings_dict['NAME'])) as dst:
+                        src.backup(dst)
+                except sqlite3.Error as exc:
+                    self.stderr.write(f'Could not copy {primary} -> {alias}: {exc}')
+                    continue
+                self.stdout.write(f'Copied {primary} -> {alias}')
+
+        replicas.health.reset()
+        self.stdout.write(self.style.SUCCESS('Replicas refreshed'))
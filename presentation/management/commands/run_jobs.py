@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from presentation import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs in a pool of worker threads until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, help='Worker threads (JOB_WORKERS)')
+        parser.add_argument('--poll', type=float, help='Seconds between polls of an empty queue')
+        parser.add_argument('--kind', action='append', dest='kinds',
+                            help='Only run jobs of this kind (repeatable)')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        unknown = set(options['kinds'] or ()) - set(jobs.TASKS)
+        if unknown:
+            raise CommandError(f"Unknown job kinds: {', '.join(sorted(unknown))}. "
+                               f"Known: {', '.join(sorted(jobs.TASKS))}")
+        worker = jobs.Worker(threads=options['threads'], poll=options['poll'],
+                             kinds=options['kinds'], once=options['once'])
+        self.stdout.write(f'{worker.name}: {worker.threads} threads, kinds: '
+                          f"{', '.join(options['kinds'] or sorted(jobs.TASKS))}")
+        worker.run()
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
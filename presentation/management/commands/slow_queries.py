@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from presentation import slow_queries
+
+
+class Command(BaseCommand):
+    help = 'Rank the slow-query log by total time per query fingerprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', help='Log file, SLOW_QUERY_LOG by default')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--view', help='Only queries run by views containing this')
+        parser.add_argument('--plans', action='store_true', help='Show the latest EXPLAIN plan')
+
+    def handle(self, *args, **options):
+        path = Path(options['log'] or settings.SLOW_QUERY_LOG)
+        entries = slow_queries.read_entries(path)
+        if options['view']:
+            entries = (entry for entry in entries if options['view'] in (entry['view'] or ''))
+        groups = slow_queries.rank(entries)
+        if not groups:
+            self.stdout.write(f'No slow queries in {path}')
+            return
+
+        for position, group in enumerate(groups[:options['limit']], 1):
+            self.stdout.write(
+                f"{position:>3}. {group['fingerprint']}  total {group['total_ms']:>10.1f}ms  "
+                f"{group['count']:>5} runs  mean {group['total_ms'] / group['count']:>8.1f}ms  "
+                f"max {group['max_ms']:>8.1f}ms"
+            )
+            self.stdout.write(f"     {group['normalized'][:300]}")
+            self.stdout.write(f"     views: {', '.join(sorted(group['views']))}")
+            if options['plans'] and group['plan']:
+                for line in group['plan'].splitlines():
+                    self.stdout.write(f'       {line}')
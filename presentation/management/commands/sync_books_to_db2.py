@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from presentation.sync import BookSync
+
+
+class Command(BaseCommand):
+    help = 'Copy new or changed books to SecondTableBooks on the second database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--full', action='store_true',
+                            help='Forget the high-water mark and copy every book')
+
+    def handle(self, *args, **options):
+        sync = BookSync(batch_size=options['batch_size'])
+        if options['full']:
+            sync.reset()
+
+        report = sync.run()
+        for number, (rows, seconds) in enumerate(report.batch_timings, start=1):
+            self.stdout.write(f'batch {number}: {rows} rows in {seconds:.4f}s')
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {report.rows} books ({report.reread} reread) in {report.elapsed:.3f}s '
+            f'({report.rows_per_second:.1f} rows/s)'
+        ))
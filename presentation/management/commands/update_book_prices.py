@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from presentation import price_updates
+from presentation.models import PriceUpdateJob
+from presentation.serializers import PriceUpdateJobSerializer
+
+
+class Command(BaseCommand):
+    help = 'Multiply book prices in primary-key batches, resumable by job id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--multiplier', default='1.1')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--resume', type=int, metavar='JOB_ID',
+                            help='Continue an existing job instead of starting one')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                job = PriceUpdateJob.objects.get(pk=options['resume'])
+            except PriceUpdateJob.DoesNotExist:
+                raise CommandError(f"Job {options['resume']} does not exist")
+        else:
+            job = price_updates.create_job(options['multiplier'], options['batch_size'])
+        self.stdout.write(f'Job {job.pk}: ids {job.last_id + 1}..{job.max_id}')
+
+        def report(job, rows, lock_seconds):
+            self.stdout.write(f'up to id {job.last_id}: {rows} rows, lock held {lock_seconds:.4f}s')
+
+        price_updates.PriceUpdateRunner(job, sleep=options['sleep'], on_batch=report).run()
+        data = PriceUpdateJobSerializer(job).data
+        self.stdout.write(self.style.SUCCESS(
+            f"Job {job.pk} {data['status']}: {data['rows_updated']} rows, "
+            f"{data['rows_per_second']} rows/s, longest lock {data['max_lock_seconds']:.4f}s"
+        ))
@@ -0,0 +1,272 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Timings of the request being measured, None outside one
+_current = ContextVar('request_metrics', default=None)
+
+# Prometheus bucket edges in the recorded units (microseconds, queries, bytes)
+DURATION_EDGES = [500, 1_000, 2_500, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000,
+                  500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000]
+QUERY_EDGES = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+SIZE_EDGES = [256, 1_024, 4_096, 16_384, 65_536, 262_144, 1_048_576, 4_194_304]
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# name: (help, recorded units per Prometheus unit, bucket edges)
+MEASURES = {
+    'request_duration_seconds': ('Wall time of the request', 1_000_000, DURATION_EDGES),
+    'request_db_seconds': ('Time spent in database queries', 1_000_000, DURATION_EDGES),
+    'request_db_queries': ('Database queries run', 1, QUERY_EDGES),
+    'request_serializer_seconds': ('Time spent in serializer.data', 1_000_000, DURATION_EDGES),
+    'request_template_seconds': ('Time spent rendering templates', 1_000_000, DURATION_EDGES),
+    'response_size_bytes': ('Size of the response body', 1, SIZE_EDGES),
+}
+# name: help of the counters kept per route next to the histograms
+COUNTERS = {
+    'coalesced_requests_total': 'Requests answered with the response of an identical '
+                                'request in flight (presentation.coalescing)',
+}
+PREFIX = 'presentation_'
+
+
+class Histogram:
+    # HDR-style log-linear histogram of non-negative integers for quantiles:
+    # values below 2**precision are exact, above that every power of two is
+    # split in 2**(precision - 1) buckets (under 2% error at precision 7).
+    # The fixed Prometheus buckets are counted next to it.
+
+    def __init__(self, edges, precision=7):
+        self.precision = precision
+        self.exact = 1 << precision
+        self.half = self.exact >> 1
+        self.counts = {}
+        self.edges = edges
+        self.buckets = [0] * (len(edges) + 1)
+        self.count = 0
+        self.total = 0
+
+    def index(self, value):
+        if value < self.exact:
+            return value
+        shift = value.bit_length() - self.precision
+        return shift * self.half + (value >> shift)
+
+    def highest(self, index):
+        # Largest value counted in bucket index
+        if index < self.exact:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, value):
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.buckets[bisect_left(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.highest(index)
+
+    def cumulative(self):
+        # (edge, values <= edge) pairs, the last edge being None for +Inf
+        seen = 0
+        for edge, count in zip(self.edges + [None], self.buckets):
+            seen += count
+            yield edge, seen
+
+
+class RequestTimings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {'db': 0.0, 'serializer': 0.0, 'template': 0.0}
+        self.queries = 0
+        # Stages being timed, so nested calls are not counted twice
+        self.running = set()
+
+    def add(self, stage, seconds):
+        # Shard queries of one request run on several threads
+        with self.lock:
+            self.seconds[stage] += seconds
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (route, method) -> {measure: Histogram}
+        self.histograms = {}
+        # (route, method, status) -> responses
+        self.responses = {}
+        # (counter, route) -> count
+        self.counts = {}
+
+    def observe(self, route, method, status, values):
+        # values: {measure: value in recorded units}, None when unknown
+        key = (route, method)
+        with self.lock:
+            histograms = self.histograms.get(key)
+            if histograms is None:
+                histograms = self.histograms[key] = {
+                    name: Histogram(edges) for name, (_, _, edges) in MEASURES.items()}
+            for name, value in values.items():
+                if value is not None:
+                    histograms[name].record(value)
+            self.responses[key + (status,)] = self.responses.get(key + (status,), 0) + 1
+
+    def increment(self, counter, route):
+        with self.lock:
+            self.counts[counter, route] = self.counts.get((counter, route), 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.responses.clear()
+            self.counts.clear()
+
+
+registry = Registry()
+
+
+def begin(timings):
+    # Measures the rest of the current context's work into timings, until
+    # end() with the returned token
+    return _current.set(timings)
+
+
+def end(token):
+    _current.reset(token)
+
+
+def observe(route, method, status, wall, timings, size):
+    registry.observe(route, method, status, {
+        'request_duration_seconds': int(wall * 1e6),
+        'request_db_seconds': int(timings.seconds['db'] * 1e6),
+        'request_db_queries': timings.queries,
+        'request_serializer_seconds': int(timings.seconds['serializer'] * 1e6),
+        'request_template_seconds': int(timings.seconds['template'] * 1e6),
+        'response_size_bytes': size,
+    })
+
+
+@contextmanager
+def stage(name):
+    # Adds the block's time to the current request's stage
+    timings = _current.get()
+    if timings is None or name in timings.running:
+        yield
+        return
+    timings.running.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+        timings.running.discard(name)
+
+
+def timed(name):
+    # stage() around every call of the decorated function
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        with timings.lock:
+            timings.queries += 1
+            timings.seconds['db'] += elapsed
+
+
+def add_query_timer(sender, connection, **kwargs):
+    # First in the list: execute_wrapper() contexts pop the last wrapper
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
+
+
+def install():
+    # Times the queries of every connection; called once from
+    # PresentationConfig.ready(). Serializers time themselves through
+    # serializers.MeasuredSerializerMixin and views their templates.
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(add_query_timer)
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return '{' + ','.join(f'{name}="{label_value(value)}"' for name, value in values.items()) + '}'
+
+
+def number(value, per=1):
+    return str(value) if per == 1 else repr(value / per)
+
+
+def render():
+    # Everything recorded so far in the Prometheus text format
+    with registry.lock:
+        histograms = {key: {name: (list(histogram.cumulative()), histogram.total, histogram.count)
+                            for name, histogram in measures.items()}
+                      for key, measures in registry.histograms.items()}
+        quantiles = {key: [(q, measures['request_duration_seconds'].quantile(q))
+                           for q in QUANTILES]
+                     for key, measures in registry.histograms.items()}
+        responses = dict(registry.responses)
+        counts = dict(registry.counts)
+
+    lines = [f'# HELP {PREFIX}requests_total Responses by route, method and status',
+             f'# TYPE {PREFIX}requests_total counter']
+    for (route, method, status), count in sorted(responses.items()):
+        lines.append(f'{PREFIX}requests_total'
+                     f'{labels(route=route, method=method, status=status)} {count}')
+
+    for name, (help_text, per, _) in MEASURES.items():
+        lines += [f'# HELP {PREFIX}{name} {help_text}', f'# TYPE {PREFIX}{name} histogram']
+        for (route, method), measures in sorted(histograms.items()):
+            buckets, total, count = measures[name]
+            for edge, seen in buckets:
+                le = '+Inf' if edge is None else number(edge, per)
+                lines.append(f'{PREFIX}{name}_bucket'
+                             f'{labels(route=route, method=method, le=le)} {seen}')
+            lines.append(f'{PREFIX}{name}_sum{labels(route=route, method=method)} '
+                         f'{number(total, per)}')
+            lines.append(f'{PREFIX}{name}_count{labels(route=route, method=method)} {count}')
+
+    name = 'request_duration_quantile_seconds'
+    lines += [f'# HELP {PREFIX}{name} Wall time quantiles from the HDR histogram',
+              f'# TYPE {PREFIX}{name} gauge']
+    for (route, method), values in sorted(quantiles.items()):
+        for q, value in values:
+            lines.append(f'{PREFIX}{name}{labels(route=route, method=method, quantile=q)} '
+                         f'{number(value, 1_000_000)}')
+
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {PREFIX}{name} {help_text}', f'# TYPE {PREFIX}{name} counter']
+        for (counter, route), count in sorted(counts.items()):
+            if counter == name:
+                lines.append(f'{PREFIX}{name}{labels(route=route)} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,183 @@
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import compression, metrics, slow_queries
+
+
+class RequestMetricsMiddleware:
+    # Records wall, DB, serializer and template time, query count and body
+    # size of every request under its resolved route (presentation.metrics).
+    # Streamed responses are recorded once their body has been sent.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # The request runs in a context of its own, which a streamed body is
+        # iterated in again after this returns
+        timings = metrics.RequestTimings()
+        context = contextvars.copy_context()
+        context.run(metrics.begin, timings)
+        start = time.perf_counter()
+        response = context.run(self.get_response, request)
+        return self.finish(request, response, timings, start, context)
+
+    async def __acall__(self, request):
+        # Under ASGI the request is a task with a context of its own already
+        timings = metrics.RequestTimings()
+        token = metrics.begin(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            context = contextvars.copy_context()
+        finally:
+            metrics.end(token)
+        return self.finish(request, response, timings, start, context)
+
+    def finish(self, request, response, timings, start, context):
+        route = request.resolver_match.route if request.resolver_match else 'unmatched'
+
+        def record(size):
+            metrics.observe(route, request.method, response.status_code,
+                            time.perf_counter() - start, timings, size)
+
+        if not response.streaming:
+            record(len(response.content))
+        elif getattr(response, 'is_async', False):
+            record(None)
+        else:
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, context, record)
+        return response
+
+    @staticmethod
+    def measure_stream(chunks, context, record):
+        size = 0
+        chunks = iter(chunks)
+        try:
+            while True:
+                try:
+                    chunk = context.run(next, chunks)
+                except StopIteration:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            record(size)
+
+
+class SlowQueryViewMiddleware:
+    # Tags queries with the view that ran them for the slow-query log,
+    # including the queries run while a streamed body is sent
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = slow_queries.current_view.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            slow_queries.current_view.reset(token)
+        return self.tag_response(request, response)
+
+    async def __acall__(self, request):
+        token = slow_queries.current_view.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            slow_queries.current_view.reset(token)
+        return self.tag_response(request, response)
+
+    def tag_response(self, request, response):
+        if response.streaming and not getattr(response, 'is_async', False) \
+                and request.resolver_match:
+            response.streaming_content = self.tag_stream(
+                response.streaming_content, slow_queries.view_path(request.resolver_match.func))
+        return response
+
+    @staticmethod
+    def process_view(request, view_func, view_args, view_kwargs):
+        slow_queries.current_view.set(slow_queries.view_path(view_func))
+
+    @staticmethod
+    def tag_stream(chunks, view):
+        chunks = iter(chunks)
+        while True:
+            token = slow_queries.current_view.set(view)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                slow_queries.current_view.reset(token)
+            yield chunk
+
+
+class CompressionMiddleware:
+    # Brotli or gzip as negotiated by Accept-Encoding for bodies of at least
+    # RESPONSE_COMPRESSION_MIN_BYTES; streamed bodies are compressed as they
+    # are sent (async streams are left alone)
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    @staticmethod
+    def compress(request, response):
+        if response.has_header('Content-Encoding') or getattr(response, 'is_async', False) \
+                or response.get('Content-Type', '').startswith(compression.COMPRESSED_TYPES):
+            return response
+        if not response.streaming and \
+                len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compression.compress_stream(
+                encoding, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed = compression.compress(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The body differs byte for byte from the uncompressed one
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0003_alter_secondtablebooks_table"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("last_updated_at", models.DateTimeField(null=True)),
+                ("last_id", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="secondtablebooks",
+            name="source_id",
+            field=models.BigIntegerField(null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["updated_at", "id"], name="book_updated_at_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0004_book_sync_state"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["publication_date", "id"], name="book_pub_date_id_idx"
+            ),
+        ),
+    ]
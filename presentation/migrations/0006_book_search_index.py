@@ -0,0 +1,95 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE presentation_book_fts
+    USING fts5(title, author_name, tokenize='unicode61')
+    """,
+    """
+    INSERT INTO presentation_book_fts (rowid, title, author_name)
+    SELECT book.id, book.title, author.name
+    FROM presentation_book book
+    JOIN presentation_author author ON author.id = book.author_id
+    """,
+    """
+    CREATE TRIGGER presentation_book_fts_insert AFTER INSERT ON presentation_book
+    BEGIN
+        INSERT INTO presentation_book_fts (rowid, title, author_name)
+        SELECT NEW.id, NEW.title, name FROM presentation_author WHERE id = NEW.author_id;
+    END
+    """,
+    """
+    CREATE TRIGGER presentation_book_fts_update
+    AFTER UPDATE OF title, author_id ON presentation_book
+    BEGIN
+        DELETE FROM presentation_book_fts WHERE rowid = OLD.id;
+        INSERT INTO presentation_book_fts (rowid, title, author_name)
+        SELECT NEW.id, NEW.title, name FROM presentation_author WHERE id = NEW.author_id;
+    END
+    """,
+    """
+    CREATE TRIGGER presentation_book_fts_delete AFTER DELETE ON presentation_book
+    BEGIN
+        DELETE FROM presentation_book_fts WHERE rowid = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER presentation_author_fts_update AFTER UPDATE OF name ON presentation_author
+    BEGIN
+        UPDATE presentation_book_fts SET author_name = NEW.name
+        WHERE rowid IN (SELECT id FROM presentation_book WHERE author_id = NEW.id);
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS presentation_author_fts_update',
+    'DROP TRIGGER IF EXISTS presentation_book_fts_delete',
+    'DROP TRIGGER IF EXISTS presentation_book_fts_update',
+    'DROP TRIGGER IF EXISTS presentation_book_fts_insert',
+    'DROP TABLE IF EXISTS presentation_book_fts',
+]
+
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE INDEX IF NOT EXISTS book_title_trgm_idx
+    ON presentation_book USING gin (title gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS book_title_tsv_idx
+    ON presentation_book USING gin (to_tsvector('simple', title))
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS author_name_tsv_idx
+    ON presentation_author USING gin (to_tsvector('simple', name))
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS author_name_tsv_idx',
+    'DROP INDEX IF EXISTS book_title_tsv_idx',
+    'DROP INDEX IF EXISTS book_title_trgm_idx',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0005_book_pub_date_id_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+            hints={'model_name': 'book'},
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:41
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_book_stats(apps, schema_editor):
+    Book = apps.get_model("presentation", "Book")
+    BookStats = apps.get_model("presentation", "BookStats")
+    Link = Book.categories.through
+
+    overall = Book.objects.aggregate(count=Count("id"), total=Sum("price"))
+    stats = [
+        BookStats(
+            scope="all",
+            key=0,
+            book_count=overall["count"],
+            total_price=overall["total"] or 0,
+        )
+    ]
+    for row in Book.objects.values("author_id").annotate(
+        count=Count("id"), total=Sum("price")
+    ):
+        stats.append(
+            BookStats(
+                scope="author",
+                key=row["author_id"],
+                book_count=row["count"],
+                total_price=row["total"],
+            )
+        )
+    for row in Link.objects.values("category_id").annotate(
+        count=Count("id"), total=Sum("book__price")
+    ):
+        stats.append(
+            BookStats(
+                scope="category",
+                key=row["category_id"],
+                book_count=row["count"],
+                total_price=row["total"],
+            )
+        )
+    BookStats.objects.bulk_create(stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0006_book_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scope", models.CharField(max_length=10)),
+                ("key", models.BigIntegerField(default=0)),
+                ("book_count", models.BigIntegerField(default=0)),
+                (
+                    "total_price",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=19),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="bookstats",
+            constraint=models.UniqueConstraint(
+                fields=("scope", "key"), name="book_stats_scope_key_uniq"
+            ),
+        ),
+        migrations.RunPython(backfill_book_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0007_bookstats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PriceUpdateJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("multiplier", models.DecimalField(decimal_places=4, max_digits=6)),
+                ("batch_size", models.PositiveIntegerField(default=1000)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("last_id", models.BigIntegerField(default=0)),
+                ("max_id", models.BigIntegerField(default=0)),
+                ("rows_updated", models.BigIntegerField(default=0)),
+                ("elapsed", models.FloatField(default=0)),
+                ("max_lock_seconds", models.FloatField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
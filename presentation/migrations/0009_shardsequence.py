@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0008_priceupdatejob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShardSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("last_value", models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,165 @@
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Length
+
+# SQLite adds columns by rebuilding presentation_book, which its renaming
+# step refuses while a trigger elsewhere (0006's author trigger) names the
+# table; the search index triggers are dropped around the rebuild
+search_index = import_module('presentation.migrations.0006_book_search_index')
+SQLITE_SEARCH_TRIGGERS = [
+    statement.replace('CREATE TRIGGER', 'CREATE TRIGGER IF NOT EXISTS')
+    for statement in search_index.SQLITE_FORWARD if 'CREATE TRIGGER' in statement
+]
+SQLITE_DROP_SEARCH_TRIGGERS = [
+    statement for statement in search_index.SQLITE_BACKWARD if 'DROP TRIGGER' in statement
+]
+
+# Django has no generated columns before 5.0 and author_name comes from
+# another table, so triggers keep the stored columns right for writes that
+# skip Book.save(): update(), bulk paths without the values, raw SQL and
+# author renames.
+SQLITE_FORWARD = [
+    """
+    CREATE TRIGGER presentation_book_stored_insert AFTER INSERT ON presentation_book
+    WHEN NEW.title_length IS NOT length(NEW.title)
+        OR NEW.author_name IS NOT (SELECT name FROM presentation_author WHERE id = NEW.author_id)
+    BEGIN
+        UPDATE presentation_book
+        SET title_length = length(NEW.title),
+            author_name = (SELECT name FROM presentation_author WHERE id = NEW.author_id)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER presentation_book_stored_update
+    AFTER UPDATE OF title, author_id, title_length, author_name ON presentation_book
+    WHEN NEW.title_length IS NOT length(NEW.title)
+        OR NEW.author_name IS NOT (SELECT name FROM presentation_author WHERE id = NEW.author_id)
+    BEGIN
+        UPDATE presentation_book
+        SET title_length = length(NEW.title),
+            author_name = (SELECT name FROM presentation_author WHERE id = NEW.author_id)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER presentation_author_stored_name AFTER UPDATE OF name ON presentation_author
+    WHEN OLD.name IS NOT NEW.name
+    BEGIN
+        UPDATE presentation_book SET author_name = NEW.name WHERE author_id = NEW.id;
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS presentation_author_stored_name',
+    'DROP TRIGGER IF EXISTS presentation_book_stored_update',
+    'DROP TRIGGER IF EXISTS presentation_book_stored_insert',
+]
+
+POSTGRES_FORWARD = [
+    """
+    CREATE OR REPLACE FUNCTION presentation_book_stored_columns() RETURNS trigger AS $$
+    BEGIN
+        NEW.title_length := char_length(NEW.title);
+        NEW.author_name := (SELECT name FROM presentation_author WHERE id = NEW.author_id);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER presentation_book_stored_columns
+    BEFORE INSERT OR UPDATE OF title, author_id, title_length, author_name
+    ON presentation_book
+    FOR EACH ROW EXECUTE FUNCTION presentation_book_stored_columns()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION presentation_author_stored_name() RETURNS trigger AS $$
+    BEGIN
+        UPDATE presentation_book SET author_name = NEW.name WHERE author_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER presentation_author_stored_name
+    AFTER UPDATE OF name ON presentation_author
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION presentation_author_stored_name()
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    'DROP TRIGGER IF EXISTS presentation_author_stored_name ON presentation_author',
+    'DROP FUNCTION IF EXISTS presentation_author_stored_name()',
+    'DROP TRIGGER IF EXISTS presentation_book_stored_columns ON presentation_book',
+    'DROP FUNCTION IF EXISTS presentation_book_stored_columns()',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def backfill(apps, schema_editor):
+    Author = apps.get_model('presentation', 'Author')
+    Book = apps.get_model('presentation', 'Book')
+    Book.objects.using(schema_editor.connection.alias).update(
+        title_length=Length('title'),
+        author_name=Subquery(Author.objects.filter(pk=OuterRef('author_id')).values('name')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0009_shardsequence"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_DROP_SEARCH_TRIGGERS}),
+            run_for_vendor({'sqlite': SQLITE_SEARCH_TRIGGERS}),
+            hints={'model_name': 'book'},
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="title_length",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="author_name",
+            field=models.CharField(default="", max_length=100),
+        ),
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_SEARCH_TRIGGERS}),
+            run_for_vendor({'sqlite': SQLITE_DROP_SEARCH_TRIGGERS}),
+            hints={'model_name': 'book'},
+        ),
+        migrations.RunPython(
+            backfill, migrations.RunPython.noop, hints={'model_name': 'book'}
+        ),
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+            hints={'model_name': 'book'},
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["title_length", "id"], name="book_title_length_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["author_name", "id"], name="book_author_name_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,62 @@
+from importlib import import_module
+
+from django.db import migrations
+
+stored_columns = import_module('presentation.migrations.0010_book_stored_columns')
+
+# An author rename rewrites author_name on the author's books; it now moves
+# their updated_at too, so the db2 sync (presentation.sync), which follows
+# updated_at, copies the new name. The timestamps match Now() on each vendor.
+SQLITE_FORWARD = [
+    'DROP TRIGGER IF EXISTS presentation_author_stored_name',
+    """
+    CREATE TRIGGER presentation_author_stored_name AFTER UPDATE OF name ON presentation_author
+    WHEN OLD.name IS NOT NEW.name
+    BEGIN
+        UPDATE presentation_book
+        SET author_name = NEW.name, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE author_id = NEW.id;
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS presentation_author_stored_name',
+    *[statement for statement in stored_columns.SQLITE_FORWARD
+      if 'presentation_author_stored_name' in statement],
+]
+
+POSTGRES_FORWARD = [
+    """
+    CREATE OR REPLACE FUNCTION presentation_author_stored_name() RETURNS trigger AS $$
+    BEGIN
+        UPDATE presentation_book SET author_name = NEW.name, updated_at = now()
+        WHERE author_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    statement for statement in stored_columns.POSTGRES_FORWARD
+    if 'FUNCTION presentation_author_stored_name()' in statement
+    and 'CREATE TRIGGER' not in statement
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0011_backgroundjob"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            stored_columns.run_for_vendor(
+                {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            stored_columns.run_for_vendor(
+                {'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+            hints={'model_name': 'book'},
+        ),
+    ]
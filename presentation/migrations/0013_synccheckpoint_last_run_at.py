@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("presentation", "0012_author_rename_touches_books"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="synccheckpoint",
+            name="last_run_at",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
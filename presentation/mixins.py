@@ -0,0 +1,306 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import Prefetch, QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from . import caching, coalescing
+from .compiled import get_compiled_serializer
+from .serializers import SparseFieldsMixin, parse_fields
+from .sharding import QUERYSET_TYPES, sharded
+from .streaming import stream_json_array
+
+logger = logging.getLogger(__name__)
+
+
+def relation_for(model, source):
+    # Field or reverse relation behind a serializer source such as book_set
+    try:
+        return model._meta.get_field(source)
+    except FieldDoesNotExist:
+        return next((relation for relation in model._meta.related_objects
+                     if relation.get_accessor_name() == source), None)
+
+
+def serializer_lookups(serializer):
+    # Walk the nested serializers and return (select_related, prefetch)
+    # lookups that load everything the serializer will touch up front.
+    select_related, prefetch = [], []
+    for field in serializer.fields.values():
+        source = field.source
+        if field.write_only or source == '*' or '.' in source:
+            continue
+
+        if isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(Prefetch(source))
+            continue
+
+        many = isinstance(field, serializers.ListSerializer)
+        nested = field.child if many else field
+        if not isinstance(nested, serializers.ModelSerializer):
+            continue
+        if not many and getattr(nested, 'stored_columns', None) is not None:
+            # Read from the parent's own columns, nothing to join
+            continue
+
+        child_select, child_prefetch = serializer_lookups(nested)
+        if many:
+            queryset = nested.Meta.model._default_manager.prefetch_related(*child_prefetch)
+            if child_select:
+                # select_related() without lookups would follow every foreign key
+                queryset = queryset.select_related(*child_select)
+            relation = relation_for(serializer.Meta.model, source)
+            # A reverse foreign key matches rows on their link to the parent
+            backlink = [relation.field.name] if relation is not None and relation.one_to_many \
+                else []
+            prefetch.append(Prefetch(source, queryset=sparse_only(queryset, nested, backlink)))
+        else:
+            select_related.append(source)
+            select_related.extend(f'{source}__{lookup}' for lookup in child_select)
+            prefetch.extend(
+                Prefetch(f'{source}__{lookup.prefetch_through}', queryset=lookup.queryset)
+                for lookup in child_prefetch
+            )
+    return select_related, prefetch
+
+
+def serializer_columns(serializer, prefix=''):
+    # only() paths of the columns the serializer reads, select_related
+    # relations included; None when a field could read any attribute
+    model = serializer.Meta.model
+    columns = []
+    for field in serializer.fields.values():
+        source = field.source
+        if field.write_only or isinstance(field, (serializers.ListSerializer,
+                                                  serializers.ManyRelatedField)):
+            # Many relations are prefetched with a queryset of their own
+            continue
+        if source == '*' or '.' in source or isinstance(field, serializers.SerializerMethodField):
+            return None
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            # Annotations and extra() selects are not deferrable
+            continue
+
+        stored = getattr(field, 'stored_columns', None)
+        if stored is not None:
+            columns.append(prefix + source)
+            columns.extend(prefix + stored[child.source] for child in field.fields.values())
+        elif isinstance(field, serializers.ModelSerializer):
+            nested = serializer_columns(field, f'{prefix}{source}__')
+            if nested is None:
+                return None
+            columns.append(prefix + source)
+            columns.extend(nested)
+        elif model_field.concrete:
+            columns.append(prefix + source)
+    return columns
+
+
+def ordering_fields(queryset):
+    # Plain model fields the queryset is ordered on, rows are compared on them
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    names = []
+    for field in ordering:
+        if not isinstance(field, str):
+            continue
+        name = field.lstrip('-')
+        try:
+            queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        names.append(name)
+    return names
+
+
+def sparse_only(queryset, serializer, extra=()):
+    # Loads only the requested columns (plus extra ones, e.g. a keyset
+    # ordering) when the serializer was given a sparse fieldset
+    if getattr(serializer, 'sparse_fields', None) is None:
+        return queryset
+    columns = serializer_columns(serializer)
+    if columns is None:
+        return queryset
+    if not queryset.ordered:
+        # Fewer columns can make the database read a covering index and
+        # return rows in another order; keep the pk order of full lists
+        queryset = queryset.order_by('pk')
+    return queryset.only(*dict.fromkeys([*columns, *ordering_fields(queryset), *extra]))
+
+
+def optimize_queryset(queryset, serializer, extra=()):
+    select_related, prefetch = serializer_lookups(serializer)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return sparse_only(queryset, serializer, extra)
+
+
+def pagination_fields(paginator):
+    # Columns a cursor/keyset paginator reads from every row
+    ordering = getattr(paginator, 'ordering', None) or ()
+    if isinstance(ordering, str):
+        ordering = (ordering,)
+    return [field.lstrip('-') for field in ordering]
+
+
+def sparse_fields(request, serializer_class, query_param='fields'):
+    # The parse_fields() tree requested with ?fields= on a read, None
+    # when absent or when the serializer cannot trim its output
+    if query_param is None or request.method not in ('GET', 'HEAD') or \
+            not issubclass(serializer_class, SparseFieldsMixin):
+        return None
+    return parse_fields(request.GET.get(query_param))
+
+
+class SparseFieldsetMixin:
+    # ?fields=id,title,author.name trims the output of SparseFieldsMixin
+    # serializers. The lookups below are derived from the trimmed
+    # serializer, so unrequested columns and relations are never read.
+    # Views handing instances to templates set fields_query_param = None.
+    fields_query_param = 'fields'
+
+    def get_sparse_fields(self):
+        return sparse_fields(self.request, self.get_serializer_class(), self.fields_query_param)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+
+class SerializerPrefetchMixin:
+    # Applies the select_related/Prefetch lookups derived from the view's
+    # serializer, so nested serializers never query once per row. Hooks
+    # filter_queryset so views overriding get_queryset are covered too.
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not isinstance(queryset, QuerySet):
+            return queryset
+        return optimize_queryset(queryset, self.get_serializer(), pagination_fields(self.paginator))
+
+
+class ShardedQueryMixin:
+    # Lists and lookups of sharded models scatter-gather over BOOK_SHARDS
+    def filter_queryset(self, queryset):
+        return sharded(super().filter_queryset(queryset))
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMixin:
+    # Counts the queries of one request across every database alias. Over
+    # max_queries it logs a warning, or raises when QUERY_BUDGET_RAISE is
+    # set (tests).
+    max_queries = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.max_queries is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = super().dispatch(request, *args, **kwargs)
+
+        if counter.count > self.max_queries:
+            message = (f'{type(self).__name__} ran {counter.count} queries, '
+                       f'budget is {self.max_queries}')
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class CoalescedRequestMixin:
+    # Identical GETs arriving while one is being answered wait for it and
+    # get a copy of its response (presentation.coalescing). First in the
+    # bases, so waiting requests skip the whole view, query budget included.
+    coalesce_models = caching.CACHED_MODELS
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = super().dispatch
+        return coalescing.coalesced(request, lambda: dispatch(request, *args, **kwargs),
+                                    self.coalesce_models)
+
+
+class OptimizedQueryMixin(QueryBudgetMixin, ShardedQueryMixin, SerializerPrefetchMixin,
+                          SparseFieldsetMixin):
+    pass
+
+
+class CompiledListMixin:
+    # Opt-in read-only fast path for list(), taken with COMPILED_LIST_VIEWS
+    # or a view's compiled_list = True (False keeps a view off it).
+    # Serializers the compiler cannot reproduce exactly fall back to the
+    # regular DRF path.
+    compiled_list = None
+
+    def use_compiled_list(self):
+        if self.compiled_list is not None:
+            return self.compiled_list
+        return getattr(settings, 'COMPILED_LIST_VIEWS', False)
+
+    def list(self, request, *args, **kwargs):
+        compiled = get_compiled_serializer(self.get_serializer_class(), self.get_sparse_fields()) \
+            if self.use_compiled_list() else None
+        queryset = self.filter_queryset(self.get_queryset())
+        if compiled is None or not isinstance(queryset, QUERYSET_TYPES):
+            return self.serialize_list(queryset)
+
+        rows = compiled.values(queryset, pagination_fields(self.paginator))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.to_representation(page, queryset))
+        return Response(compiled.to_representation(rows, queryset))
+
+    def serialize_list(self, queryset):
+        # ListModelMixin.list() from the already filtered queryset
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+
+class StreamingListMixin:
+    # With ?stream=1 list() returns a StreamingHttpResponse that encodes
+    # rows as they are read in chunks, so memory stays flat and the first
+    # byte leaves before the last row is fetched. Unpaginated JSON only.
+    stream_query_param = 'stream'
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.stream_query_param) not in ('1', 'true'):
+            return super().list(request, *args, **kwargs)
+        return StreamingHttpResponse(stream_json_array(self.get_stream_items()),
+                                     content_type='application/json')
+
+    def get_stream_items(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        compiled = get_compiled_serializer(self.get_serializer_class(), self.get_sparse_fields())
+        if compiled is not None:
+            return compiled.iter_representation(queryset, self.stream_chunk_size)
+        return (self.get_serializer(obj).data
+                for obj in queryset.iterator(chunk_size=self.stream_chunk_size))
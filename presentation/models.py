@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Author(models.Model):
@@ -21,10 +22,112 @@ class Book(models.Model):
     publication_date = models.DateField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     categories = models.ManyToManyField(Category)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Stored copies of len(title) and author.name so lists neither compute
+    # nor join them; set on save and kept right by database triggers
+    title_length = models.PositiveIntegerField(default=0)
+    author_name = models.CharField(max_length=100, default='')
+
+    class Meta:
+        indexes = [
+            # High-water mark scan used by the db2 sync
+            models.Index(fields=['updated_at', 'id'], name='book_updated_at_id_idx'),
+            # Keyset pagination by publication date
+            models.Index(fields=['publication_date', 'id'], name='book_pub_date_id_idx'),
+            # Filtering and sorting on the stored columns
+            models.Index(fields=['title_length', 'id'], name='book_title_length_id_idx'),
+            models.Index(fields=['author_name', 'id'], name='book_author_name_id_idx'),
+        ]
 
 
 class SecondTableBooks(models.Model):
     title = models.CharField(max_length=100)
     author = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=5, decimal_places=2)
+    source_id = models.BigIntegerField(unique=True, null=True)
+
+
+class SyncCheckpoint(models.Model):
+    # High-water mark of the last synced Book, stored next to the copied
+    # rows, and when the last complete run started
+    name = models.CharField(max_length=50, unique=True)
+    last_updated_at = models.DateTimeField(null=True)
+    last_id = models.BigIntegerField(default=0)
+    last_run_at = models.DateTimeField(null=True)
+
+
+class BookStats(models.Model):
+    # Running count and price sum of books, overall and per author/category
+    SCOPE_ALL = 'all'
+    SCOPE_AUTHOR = 'author'
+    SCOPE_CATEGORY = 'category'
+
+    scope = models.CharField(max_length=10)
+    key = models.BigIntegerField(default=0)
+    book_count = models.BigIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='book_stats_scope_key_uniq'),
+        ]
+
+
+class PriceUpdateJob(models.Model):
+    # Progress of a chunked price update, walked in primary-key order
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    multiplier = models.DecimalField(max_digits=6, decimal_places=4)
+    batch_size = models.PositiveIntegerField(default=1000)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    last_id = models.BigIntegerField(default=0)
+    max_id = models.BigIntegerField(default=0)
+    rows_updated = models.BigIntegerField(default=0)
+    elapsed = models.FloatField(default=0)
+    max_lock_seconds = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ShardSequence(models.Model):
+    # Last primary key handed out for a model spread over BOOK_SHARDS, so
+    # ids stay unique across shards
+    name = models.CharField(max_length=100, unique=True)
+    last_value = models.BigIntegerField(default=0)
+
+
+class BackgroundJob(models.Model):
+    # A queued call of a presentation.jobs task, claimed by run_jobs workers.
+    # Failed attempts wait run_after before the next one; a running job whose
+    # worker stopped renewing locked_at is handed to another worker.
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True)
+    progress = models.JSONField(default=dict)
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True)
 
+    class Meta:
+        indexes = [
+            # Workers pick the oldest due job of a status
+            models.Index(fields=['status', 'run_after', 'id'], name='job_status_run_after_idx'),
+        ]
@@ -0,0 +1,243 @@
+from functools import reduce
+from operator import or_
+
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from . import counting
+
+CURSOR_SALT = 'presentation.pagination.keyset'
+
+
+def encode_cursor(position, reverse=False):
+    return signing.dumps({'p': position, 'r': reverse}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    # Raises signing.BadSignature for tampered or malformed cursors
+    data = signing.loads(cursor, salt=CURSOR_SALT)
+    return data['p'], data['r']
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    # Seeks past the last seen sort key instead of counting and skipping
+    # rows, so every page costs one indexed range scan no matter how deep
+    # it is. The ordering must end with a unique, non-null column (id).
+
+    def __init__(self, queryset, per_page, ordering=('id',)):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    @property
+    def fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def page(self, cursor=None):
+        queryset, position, reverse = self._prepare(cursor)
+        return self._build_page(list(queryset[:self.per_page + 1]), position, reverse)
+
+    async def apage(self, cursor=None):
+        # page() on the async ORM, for async views
+        queryset, position, reverse = self._prepare(cursor)
+        rows = [row async for row in queryset[:self.per_page + 1]]
+        return self._build_page(rows, position, reverse)
+
+    def _prepare(self, cursor):
+        position, reverse = decode_cursor(cursor) if cursor else (None, False)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._flip(field) for field in ordering)
+
+        queryset = self.queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek(ordering, position))
+        return queryset, position, reverse
+
+    def _build_page(self, rows, position, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows)
+
+        if reverse:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(self._position(rows[-1])) if has_next else None,
+            previous_cursor=encode_cursor(self._position(rows[0]), reverse=True)
+            if has_previous else None,
+        )
+
+    def get_page(self, cursor=None):
+        # Like Paginator.get_page: fall back to the first page on bad input
+        try:
+            return self.page(cursor)
+        except signing.BadSignature:
+            return self.page()
+
+    def _position(self, obj):
+        position = []
+        for field in self.fields:
+            # Rows may be model instances or values() dicts
+            value = obj[field] if isinstance(obj, dict) else getattr(obj, field)
+            position.append(value if isinstance(value, (int, str)) else str(value))
+        return position
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _seek(ordering, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {ordering[i].lstrip('-'): position[i] for i in range(index)}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[index]}))
+        return reduce(or_, conditions)
+
+
+class KeysetPagination(BasePagination):
+    page_size = 2
+    ordering = ('id',)
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.page_size, self.ordering)
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except signing.BadSignature:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.page_size, self.ordering)
+        try:
+            self.page = await paginator.apage(request.query_params.get(self.cursor_query_param))
+        except signing.BadSignature:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.get_link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self.get_link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PublicationDateKeysetPagination(KeysetPagination):
+    ordering = ('publication_date', 'id')
+
+
+class CountedPaginator(Paginator):
+    # Paginator taking its count from presentation.counting: cached between
+    # pages, estimated for very large tables (count_exact is then False)
+    @cached_property
+    def row_count(self):
+        return counting.count(self.object_list)
+
+    @cached_property
+    def count(self):
+        return self.row_count.value
+
+    @property
+    def count_exact(self):
+        return self.row_count.exact
+
+
+class CountedLimitOffsetPagination(LimitOffsetPagination):
+    # LimitOffsetPagination with the count from presentation.counting and
+    # count_exact telling clients whether it is an estimate
+    count_exact = True
+
+    def get_count(self, queryset):
+        row_count = counting.count(queryset)
+        self.count_exact = row_count.exact
+        return row_count.value
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_exact'] = self.count_exact
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_exact'] = {'type': 'boolean', 'example': True}
+        return response_schema
+
+
+class AsyncLimitOffsetPagination(CountedLimitOffsetPagination):
+    # CountedLimitOffsetPagination with an async count and slice, for async views
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        row_count = await counting.acount(queryset)
+        self.count, self.count_exact = row_count.value, row_count.exact
+        self.offset = self.get_offset(request)
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [row async for row in queryset[self.offset:self.offset + self.limit]]
@@ -0,0 +1,105 @@
+import logging
+import time
+from decimal import Decimal
+
+from django.db.models import F, Max
+from django.db.models.functions import Now
+
+from . import caching, sharding, stats
+from .models import Book, PriceUpdateJob
+
+logger = logging.getLogger(__name__)
+
+
+class Superseded(Exception):
+    # Raised by a before_commit hook when another runner has taken the job
+    # over: the batch is rolled back and the job's status left to that runner
+    pass
+
+
+def create_job(multiplier, batch_size=1000):
+    # Books created after this point are not part of the job
+    max_id = sharding.sharded(Book.objects.all()).aggregate(max_id=Max('id'))['max_id'] or 0
+    return PriceUpdateJob.objects.create(
+        multiplier=Decimal(str(multiplier)), batch_size=batch_size, max_id=max_id)
+
+
+class PriceUpdateRunner:
+    # Applies a job batch by batch. Each batch updates one primary-key range
+    # and advances job.last_id in the same transaction, so a stopped job
+    # resumes where it left off and no row is ever multiplied twice. Two
+    # runners of one job take turns on the job's row lock; before_commit(job)
+    # runs inside each batch transaction and can stop a runner that no longer
+    # owns the job by raising Superseded.
+
+    def __init__(self, job, sleep=0.0, on_batch=None, before_commit=None):
+        self.job = job
+        self.sleep = sleep
+        self.on_batch = on_batch
+        self.before_commit = before_commit
+
+    def next_upper_bound(self):
+        ids = sharding.sharded(Book.objects.filter(
+            id__gt=self.job.last_id, id__lte=self.job.max_id,
+        ).order_by('id').values_list('id', flat=True))
+        upper = ids[self.job.batch_size - 1:self.job.batch_size]
+        return upper[0] if upper else self.job.max_id
+
+    def run(self):
+        job = self.job
+        if job.status == PriceUpdateJob.DONE:
+            return job
+        job.status = PriceUpdateJob.RUNNING
+        job.save(update_fields=['status', 'updated_at'])
+
+        try:
+            while job.last_id < job.max_id:
+                self.run_batch()
+                if self.sleep:
+                    time.sleep(self.sleep)
+        except Superseded:
+            logger.warning('Price job %s was taken over by another runner', job.pk)
+            raise
+        except Exception as exc:
+            job.status = PriceUpdateJob.FAILED
+            job.error = repr(exc)
+            job.save(update_fields=['status', 'error', 'updated_at'])
+            raise
+
+        job.status = PriceUpdateJob.DONE
+        job.save(update_fields=['status', 'updated_at'])
+        return job
+
+    def run_batch(self):
+        job = self.job
+        upper = self.next_upper_bound()
+        started = time.perf_counter()
+        rows = 0
+        with sharding.atomic_all():
+            # Another runner may have committed batches since last_id was
+            # read: continue from its position instead of repeating them
+            current = PriceUpdateJob.objects.select_for_update().get(pk=job.pk)
+            if current.last_id != job.last_id:
+                job.last_id, job.rows_updated = current.last_id, current.rows_updated
+                return
+            for books in sharding.per_shard(Book.objects.filter(id__gt=job.last_id, id__lte=upper)):
+                with stats.track_bulk_update(books):
+                    rows += books.update(price=F('price') * job.multiplier, updated_at=Now())
+            job.last_id = upper
+            job.rows_updated += rows
+            job.save(update_fields=['last_id', 'rows_updated', 'updated_at'])
+            if self.before_commit:
+                self.before_commit(job)
+        lock_seconds = time.perf_counter() - started
+        # Once per committed batch, so cached lists never serve the old
+        # prices of a batch for the rest of a long job
+        caching.bump(Book)
+
+        job.elapsed += lock_seconds
+        job.max_lock_seconds = max(job.max_lock_seconds, lock_seconds)
+        job.save(update_fields=['elapsed', 'max_lock_seconds'])
+        logger.debug('Price job %s: %d rows up to id %d in %.4fs',
+                     job.pk, rows, upper, lock_seconds)
+        if self.on_batch:
+            self.on_batch(job, rows, lock_seconds)
+
@@ -0,0 +1,87 @@
+import json
+
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+# Values msgpack has no type for (Decimal, dates, UUIDs) become what the
+# JSON renderer would write for them
+_json_encoder = encoders.JSONEncoder()
+
+
+class MessagePackRenderer(BaseRenderer):
+    # The JSON renderer's data as MessagePack, no text escaping or number
+    # formatting and a smaller body
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_json_encoder.default)
+
+
+def dictionary_key(value):
+    # Canonical JSON, hashable whatever the object nests (lists, dicts)
+    return json.dumps(value, sort_keys=True, cls=encoders.JSONEncoder)
+
+
+def columnar(rows):
+    # One array per field instead of one object per row. Fields holding
+    # objects (a book's author) are dictionary-encoded: the column holds
+    # indexes into a table of the distinct objects.
+    keys = {}
+    for row in rows:
+        keys.update(dict.fromkeys(row))
+    columns = {key: [row.get(key) for row in rows] for key in keys}
+
+    dictionaries = {}
+    for key, values in columns.items():
+        if not any(isinstance(value, dict) for value in values) or \
+                not all(value is None or isinstance(value, dict) for value in values):
+            continue
+        table, positions, codes = [], {}, []
+        for value in values:
+            if value is None:
+                codes.append(None)
+                continue
+            marker = dictionary_key(value)
+            code = positions.get(marker)
+            if code is None:
+                code = positions[marker] = len(table)
+                table.append(value)
+            codes.append(code)
+        columns[key] = codes
+        dictionaries[key] = table
+    return {'count': len(rows), 'columns': columns, 'dictionaries': dictionaries}
+
+
+def rows_from_columnar(payload):
+    # The row objects back, for clients and checks
+    columns, dictionaries = payload['columns'], payload['dictionaries']
+    rows = [{} for _ in range(payload['count'])]
+    for key, values in columns.items():
+        table = dictionaries.get(key)
+        for row, value in zip(rows, values):
+            row[key] = table[value] if table is not None and value is not None else value
+    return rows
+
+
+def is_rows(data):
+    return isinstance(data, list) and all(isinstance(row, dict) for row in data)
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    # Lists (and the results of a paginated list) in the columnar() layout,
+    # anything else (a single object, errors) as plain JSON
+    media_type = 'application/vnd.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if is_rows(data):
+            data = columnar(data)
+        elif isinstance(data, dict) and is_rows(data.get('results')):
+            data = {**data, 'results': columnar(data['results'])}
+        return super().render(data, accepted_media_type, renderer_context)
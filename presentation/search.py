@@ -0,0 +1,99 @@
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils.module_loading import import_string
+
+from .models import Book
+
+FTS_TABLE = 'presentation_book_fts'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def query_terms(query):
+    return WORD_RE.findall(query.lower())
+
+
+class IcontainsSearchBackend:
+    # Unindexed LIKE '%query%' on the title, kept as the baseline
+    def search(self, queryset, query):
+        return queryset.filter(title__icontains=query)
+
+
+class SQLiteFTSSearchBackend:
+    # FTS5 table over (title, author name), maintained by triggers
+    # created in migration 0006 so bulk writes stay indexed as well.
+    title_weight = 10.0
+    author_weight = 1.0
+
+    def match_expression(self, query):
+        # Every term must match, the last one as a prefix: "tolk" finds
+        # "Tolkien". Terms are quoted so FTS5 operators in user input are
+        # treated as plain text.
+        terms = [f'"{term}"' for term in query_terms(query)]
+        if terms:
+            terms[-1] += '*'
+        return ' AND '.join(terms)
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            # Punctuation alone matches nothing, as icontains did
+            return queryset.none() if query else queryset
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE}.rowid = presentation_book.id',
+                f'{FTS_TABLE} MATCH %s',
+            ],
+            params=[expression],
+            select={'rank': f'bm25({FTS_TABLE}, %s, %s)'},
+            select_params=[self.title_weight, self.author_weight],
+            order_by=['rank'],
+        )
+
+
+class PostgresSearchBackend:
+    # tsvector search backed by the GIN expression indexes from
+    # migration 0006, ranked with ts_rank on the title.
+    config = 'simple'
+
+    def tsquery(self, query):
+        terms = query_terms(query)
+        if terms:
+            terms[-1] += ':*'
+        return ' & '.join(terms)
+
+    def search(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset.none() if query else queryset
+        title_vector = f"to_tsvector('{self.config}', presentation_book.title)"
+        ts_query = f"to_tsquery('{self.config}', %s)"
+        return queryset.extra(
+            where=[
+                f'({title_vector} @@ {ts_query} OR presentation_book.author_id IN ('
+                f"SELECT id FROM presentation_author "
+                f"WHERE to_tsvector('{self.config}', name) @@ {ts_query}))"
+            ],
+            params=[tsquery, tsquery],
+            select={'rank': f'ts_rank({title_vector}, {ts_query})'},
+            select_params=[tsquery],
+            order_by=['-rank', 'id'],
+        )
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend():
+    # BOOK_SEARCH_BACKEND overrides the choice made from the database vendor
+    backend_path = getattr(settings, 'BOOK_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    vendor = connections[router.db_for_read(Book)].vendor
+    return VENDOR_BACKENDS.get(vendor, IcontainsSearchBackend)()
@@ -1,34 +1,126 @@
 from rest_framework import serializers
-from .models import Book, Author, AuthorProfile, Category
 
-
-class AuthorSerializer(serializers.ModelSerializer):
+from . import metrics
+from .models import Book, Author, AuthorProfile, Category, PriceUpdateJob, BackgroundJob
+
+
+def parse_fields(value):
+    # "id,title,author.name" -> (('author', (('name', None),)), ('id', None),
+    # ('title', None)); None below a name keeps all of its fields. Nested
+    # tuples so the result can key caches. None for an empty value.
+    if not value:
+        return None
+    tree = {}
+    for path in value.split(','):
+        names = [name.strip() for name in path.split('.')]
+        if not all(names):
+            raise serializers.ValidationError({'fields': [f'Invalid field path "{path}".']})
+        node = tree
+        for name in names[:-1]:
+            if name in node and node[name] is None:
+                # The whole field is requested already
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = None
+    return freeze_fields(tree)
+
+
+def freeze_fields(tree):
+    return tuple(sorted((name, None if branch is None else freeze_fields(branch))
+                        for name, branch in tree.items()))
+
+
+class MeasuredListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with metrics.stage('serializer'):
+            return super().data
+
+
+class MeasuredSerializerMixin:
+    # Time spent in .data counts as the request's serializer time
+    # (presentation.metrics); serializers listed with many=True also set
+    # Meta.list_serializer_class = MeasuredListSerializer
+    @property
+    def data(self):
+        with metrics.stage('serializer'):
+            return super().data
+
+
+class SparseFieldsMixin:
+    # Serializes only the fields of a parse_fields() tree, nested
+    # serializers get their branch of it
+    def __init__(self, *args, fields=None, **kwargs):
+        self.sparse_fields = fields
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.sparse_fields is None:
+            return fields
+
+        requested = dict(self.sparse_fields)
+        unknown = [name for name in requested if name not in fields or fields[name].write_only]
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': [f'Unknown field "{name}".' for name in unknown]})
+        for name, branch in requested.items():
+            if branch is None:
+                continue
+            nested = getattr(fields[name], 'child', fields[name])
+            if not isinstance(nested, SparseFieldsMixin):
+                raise serializers.ValidationError(
+                    {'fields': [f'Field "{name}" has no fields to select.']})
+            nested.sparse_fields = branch
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class AuthorSerializer(MeasuredSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Author
         fields = ['id', 'name']
+        list_serializer_class = MeasuredListSerializer
+
+
+class BookAuthorSerializer(AuthorSerializer):
+    # A book's author read from the book's own author_id and author_name
+    # columns, so books are listed without joining the authors
+    stored_columns = {'id': 'author_id', 'name': 'author_name'}
 
+    def get_attribute(self, instance):
+        if not isinstance(instance, Book):
+            return super().get_attribute(instance)
+        if instance.author_id is None:
+            return None
+        # Only the selected fields, a sparse fieldset defers the other columns
+        return Author(**{field.source: getattr(instance, self.stored_columns[field.source])
+                         for field in self.fields.values()})
 
-class AuthorProfileSerializer(serializers.ModelSerializer):
+
+class AuthorProfileSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
 
     class Meta:
         model = AuthorProfile
         fields = ('author', 'publishing_house', 'date_of_birth')
+        list_serializer_class = MeasuredListSerializer
 
 
-class OnlyBookSerializer(serializers.ModelSerializer):
+class OnlyBookSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ['title', 'price']
+        list_serializer_class = MeasuredListSerializer
 
 
-class BookSerializer(serializers.ModelSerializer):
-    title_length = serializers.IntegerField(read_only=True)
-    author = AuthorSerializer()
+class BookSerializer(MeasuredSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    author = BookAuthorSerializer()
 
     class Meta:
         model = Book
-        fields = ['id', 'title', 'author', 'publication_date', 'price', 'title_length']
+        fields = ['id', 'title', 'author', 'publication_date', 'price']
+        list_serializer_class = MeasuredListSerializer
 
     def create(self, validated_data):
         author_data = validated_data.pop('author')
@@ -37,15 +129,67 @@ class BookSerializer(serializers.ModelSerializer):
         return book
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class AnnotatedBookSerializer(BookSerializer):
+    # Books of the views that used to annotate Length('title'), read from
+    # the stored column now
+    title_length = serializers.IntegerField(read_only=True)
+
+    class Meta(BookSerializer.Meta):
+        fields = BookSerializer.Meta.fields + ['title_length']
+
+
+class BookIngestSerializer(BookSerializer):
+    # Row validation for bulk ingestion, the rows are written in bulk
+    categories = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, default=list)
+
+    class Meta(BookSerializer.Meta):
+        fields = BookSerializer.Meta.fields + ['categories']
+
+    def validate_row(self, row):
+        try:
+            return self.run_validation(row), None
+        except serializers.ValidationError as exc:
+            return None, exc.detail
+
+
+class CategorySerializer(MeasuredSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     book_set = BookSerializer(many=True)
 
     class Meta:
         model = Category
         fields = ['name', 'book_set']
+        list_serializer_class = MeasuredListSerializer
 
 
-class Db2BookSerializer(serializers.ModelSerializer):
+class Db2BookSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ['title', 'author', 'price']
+        list_serializer_class = MeasuredListSerializer
+
+
+class BackgroundJobSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = BackgroundJob
+        fields = ['id', 'kind', 'payload', 'status', 'attempts', 'max_attempts', 'run_after',
+                  'progress', 'result', 'error', 'created_at', 'updated_at', 'finished_at']
+        read_only_fields = fields
+
+
+class PriceUpdateJobSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
+    rows_per_second = serializers.SerializerMethodField()
+    # Seconds the runner pauses between batches, not stored on the job
+    sleep = serializers.FloatField(min_value=0, default=0, write_only=True)
+
+    class Meta:
+        model = PriceUpdateJob
+        fields = ['id', 'status', 'multiplier', 'batch_size', 'last_id', 'max_id',
+                  'rows_updated', 'rows_per_second', 'max_lock_seconds', 'error',
+                  'created_at', 'updated_at', 'sleep']
+        read_only_fields = ['status', 'last_id', 'max_id', 'rows_updated',
+                            'max_lock_seconds', 'error', 'created_at', 'updated_at']
+        extra_kwargs = {'batch_size': {'min_value': 1}}
+
+    def get_rows_per_second(self, job):
+        return round(job.rows_updated / job.elapsed, 1) if job.elapsed else 0.0
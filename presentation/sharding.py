@@ -0,0 +1,432 @@
+import contextvars
+import heapq
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import cmp_to_key
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Avg, Count, F, Max, Min, QuerySet, Sum
+from django.db.models.query import FlatValuesListIterable, ModelIterable, ValuesIterable
+
+from routers import replicas, shards
+
+from .models import Book, ShardSequence
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class NotMergeable(ValueError):
+    # The query cannot be answered by combining per-shard results
+    pass
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BOOK_SHARD_WORKERS', 8),
+                thread_name_prefix='shard',
+            )
+    return _executor
+
+
+def on_shard(call, alias):
+    # Worker threads keep their connections between tasks, drop broken ones
+    connections[alias].close_if_unusable_or_obsolete()
+    return call(alias)
+
+
+def gather(call, aliases):
+    # call(alias) on every alias in parallel, results in alias order. Each
+    # call sees the caller's context (replica pins, request metrics).
+    if len(aliases) == 1:
+        return [call(aliases[0])]
+    contexts = [contextvars.copy_context() for _ in aliases]
+    return list(executor().map(
+        lambda alias, context: context.run(on_shard, call, alias), aliases, contexts))
+
+
+def compare_values(a, b, descending, nulls_largest):
+    if a == b:
+        return 0
+    if a is None:
+        result = 1 if nulls_largest else -1
+    elif b is None:
+        result = -1 if nulls_largest else 1
+    else:
+        result = -1 if a < b else 1
+    return -result if descending else result
+
+
+class ShardedQuerySet:
+    # Scatter-gather over BOOK_SHARDS: every shard runs the same query in
+    # parallel, ordered results are merged on the query's ordering and
+    # slices are applied after the merge, so pagination, counts and
+    # aggregates match what a single database would return. Text ordering
+    # is merged by code point, which is SQLite's default collation.
+
+    def __init__(self, queryset, aliases=None, low=0, high=None):
+        self.queryset = queryset
+        self.aliases = list(aliases or shards.shard_aliases())
+        self.low, self.high = low, high
+        self._result_cache = None
+
+    @property
+    def model(self):
+        return self.queryset.model
+
+    @property
+    def query(self):
+        return self.queryset.query
+
+    @property
+    def ordered(self):
+        return self.queryset.ordered
+
+    def _chain(self, queryset):
+        if self.low or self.high is not None:
+            raise TypeError('Cannot filter a query once a slice has been taken.')
+        return type(self)(queryset, self.aliases)
+
+    def _chainable(name):
+        def method(self, *args, **kwargs):
+            return self._chain(getattr(self.queryset, name)(*args, **kwargs))
+        method.__name__ = name
+        return method
+
+    all = _chainable('all')
+    filter = _chainable('filter')
+    exclude = _chainable('exclude')
+    order_by = _chainable('order_by')
+    annotate = _chainable('annotate')
+    select_related = _chainable('select_related')
+    prefetch_related = _chainable('prefetch_related')
+    values_list = _chainable('values_list')
+    only = _chainable('only')
+    defer = _chainable('defer')
+    extra = _chainable('extra')
+    del _chainable
+
+    def values(self, *fields, **expressions):
+        # Ordering columns join the selection while extra() names still resolve
+        if fields:
+            fields += tuple(self.missing_ordering([*fields, *expressions]))
+        return self._chain(self.queryset.values(*fields, **expressions))
+
+    def using(self, alias):
+        return self.queryset.using(alias)
+
+    def read_aliases(self):
+        # Resolved in the calling thread, where read-your-writes state lives
+        return [replicas.read_alias(alias) for alias in self.aliases]
+
+    # Merging
+
+    def ordering(self):
+        query = self.queryset.query
+        if query.extra_order_by:
+            ordering = query.extra_order_by
+        elif query.order_by or not query.default_ordering:
+            ordering = query.order_by
+        else:
+            ordering = query.get_meta().ordering
+        if any(not isinstance(field, str) for field in ordering):
+            raise NotMergeable('Only field name orderings can be merged across shards')
+        if '?' in ordering:
+            return []
+        # Unordered rows come back in primary key order, so slices are stable
+        return list(ordering) or ['pk']
+
+    def missing_ordering(self, fields):
+        names = [field.lstrip('-') for field in self.ordering()]
+        return [name for name in names
+                if name not in fields and self.attname(name) not in fields]
+
+    def shard_queryset(self):
+        # values() rows must carry the ordering columns the merge compares,
+        # also when order_by() came after values()
+        queryset = self.queryset
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        if queryset._iterable_class is ValuesIterable and queryset._fields:
+            missing = self.missing_ordering(queryset._fields)
+            if missing:
+                queryset = queryset.values(*queryset._fields, *missing)
+        return queryset
+
+    def attname(self, name):
+        meta = self.model._meta
+        if name == 'pk':
+            return meta.pk.attname
+        if '__' not in name:
+            field = next((field for field in meta.concrete_fields if field.name == name), None)
+            if field is not None:
+                return field.attname
+        return name
+
+    def sort_key(self, queryset):
+        ordering = self.ordering()
+        fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        getters = [self.getter(queryset, name) for name, _ in fields]
+        nulls_largest = connections[self.aliases[0]].features.nulls_order_largest
+
+        def compare(a, b):
+            for getter, (_, descending) in zip(getters, fields):
+                result = compare_values(getter(a), getter(b), descending, nulls_largest)
+                if result:
+                    return result
+            return 0
+        return cmp_to_key(compare)
+
+    def getter(self, queryset, name):
+        attname = self.attname(name)
+        iterable = queryset._iterable_class
+        if iterable is ModelIterable:
+            parts = attname.split('__')
+
+            def value(obj):
+                for part in parts:
+                    obj = getattr(obj, part)
+                return obj
+            return value
+        if iterable is ValuesIterable:
+            return lambda row: row[name] if name in row else row[attname]
+        fields = list(queryset._fields)
+        for candidate in (name, attname):
+            if candidate in fields:
+                index = fields.index(candidate)
+                if iterable is FlatValuesListIterable:
+                    return lambda row: row
+                return lambda row: row[index]
+        raise NotMergeable(f'values_list() rows need the ordering column {name!r}')
+
+    def merge(self, results, queryset):
+        if not self.ordering():
+            return chain.from_iterable(results)
+        return heapq.merge(*results, key=self.sort_key(queryset))
+
+    # Evaluation
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            queryset = self.shard_queryset()
+            if self.high is not None:
+                queryset = queryset[:self.high]
+            results = gather(lambda alias: list(queryset.using(alias)), self.read_aliases())
+            self._result_cache = list(islice(self.merge(results, queryset), self.low, self.high))
+        return self._result_cache
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __bool__(self):
+        return bool(self._fetch_all())
+
+    def __getitem__(self, k):
+        if self._result_cache is not None:
+            return self._result_cache[k]
+        if isinstance(k, int):
+            if k < 0:
+                raise ValueError('Negative indexing is not supported.')
+            rows = list(self[k:k + 1])
+            if not rows:
+                raise IndexError('ShardedQuerySet index out of range')
+            return rows[0]
+        if k.step is not None or (k.start or 0) < 0 or (k.stop is not None and k.stop < 0):
+            raise ValueError('Only non-negative slices without a step are supported.')
+        low = self.low + (k.start or 0)
+        high = self.high
+        if k.stop is not None:
+            high = self.low + k.stop if high is None else min(high, self.low + k.stop)
+        return type(self)(self.queryset, self.aliases, low, max(low, high) if high is not None else None)
+
+    def iterator(self, chunk_size=None):
+        # Lazily merged shard iterators, read one after another
+        queryset = self.shard_queryset()
+        if self.high is not None:
+            queryset = queryset[:self.high]
+        iterators = [queryset.using(alias).iterator(chunk_size=chunk_size)
+                     for alias in self.read_aliases()]
+        return islice(self.merge(iterators, queryset), self.low, self.high)
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        total = sum(gather(lambda alias: self.queryset.using(alias).count(), self.read_aliases()))
+        total = max(0, total - self.low)
+        return total if self.high is None else min(total, self.high - self.low)
+
+    def exists(self):
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        return any(gather(lambda alias: self.queryset.using(alias).exists(), self.read_aliases()))
+
+    def get(self, *args, **kwargs):
+        queryset = self.filter(*args, **kwargs) if args or kwargs else self
+        rows = list(queryset[:2])
+        if len(rows) == 1:
+            return rows[0]
+        if not rows:
+            raise self.model.DoesNotExist(
+                f'{self.model._meta.object_name} matching query does not exist.')
+        raise self.model.MultipleObjectsReturned(
+            f'get() returned more than one {self.model._meta.object_name}.')
+
+    def first(self):
+        queryset = self if self.ordered else self.order_by('pk')
+        for obj in queryset[:1]:
+            return obj
+        return None
+
+    def aggregate(self, *args, **kwargs):
+        # Count, Sum, Min and Max combine directly; Avg is rebuilt from a
+        # per-shard Sum and Count. Distinct aggregates cannot be combined.
+        for arg in args:
+            kwargs[arg.default_alias] = arg
+        parts = {}
+        for name, aggregate in kwargs.items():
+            if getattr(aggregate, 'distinct', False):
+                raise NotMergeable(f'Distinct aggregate {name!r} cannot be combined across shards')
+            if isinstance(aggregate, Avg):
+                parts[f'{name}__sum'] = Sum(*aggregate.source_expressions, filter=aggregate.filter)
+                parts[f'{name}__count'] = Count(*aggregate.source_expressions,
+                                                filter=aggregate.filter)
+            elif isinstance(aggregate, (Count, Sum, Min, Max)):
+                parts[name] = aggregate
+            else:
+                raise NotMergeable(f'{type(aggregate).__name__} cannot be combined across shards')
+
+        results = gather(lambda alias: self.queryset.using(alias).aggregate(**parts),
+                         self.read_aliases())
+        combined = {}
+        for name, aggregate in kwargs.items():
+            if isinstance(aggregate, Avg):
+                total = sum(row[f'{name}__sum'] or 0 for row in results)
+                count = sum(row[f'{name}__count'] for row in results)
+                combined[name] = total / count if count else None
+                continue
+            values = [row[name] for row in results if row[name] is not None]
+            if isinstance(aggregate, Count):
+                combined[name] = sum(values)
+            elif isinstance(aggregate, Sum):
+                combined[name] = sum(values) if values else None
+            elif isinstance(aggregate, Min):
+                combined[name] = min(values, default=None)
+            else:
+                combined[name] = max(values, default=None)
+        return combined
+
+    # Async counterparts run the scatter-gather in the sync thread
+
+    async def acount(self):
+        return await sync_to_async(self.count)()
+
+    async def aexists(self):
+        return await sync_to_async(self.exists)()
+
+    async def aget(self, *args, **kwargs):
+        return await sync_to_async(self.get)(*args, **kwargs)
+
+    async def aaggregate(self, *args, **kwargs):
+        return await sync_to_async(self.aggregate)(*args, **kwargs)
+
+    async def aiterator(self, chunk_size=None):
+        for row in await sync_to_async(self._fetch_all)():
+            yield row
+
+    def __aiter__(self):
+        return self.aiterator()
+
+
+QUERYSET_TYPES = (QuerySet, ShardedQuerySet)
+
+
+def sharded(queryset):
+    # Scatter-gather wrapper for querysets of sharded models; anything else,
+    # or a queryset already pinned with using(), is returned unchanged
+    if not isinstance(queryset, QuerySet) or queryset._db is not None \
+            or not shards.is_sharded(queryset.model):
+        return queryset
+    return ShardedQuerySet(queryset)
+
+
+def per_shard(queryset):
+    # The queryset pinned to each shard, or as is without sharding
+    if not shards.is_sharded(queryset.model):
+        return [queryset]
+    return [queryset.using(alias) for alias in shards.shard_aliases()]
+
+
+def group_by_shard(rows, author_id):
+    # [(alias, rows)] of the rows split by the shard of author_id(row)
+    if not shards.is_sharded(Book):
+        return [(router.db_for_write(Book), list(rows))]
+    groups = defaultdict(list)
+    for row in rows:
+        groups[shards.shard_for_author(author_id(row))].append(row)
+    return list(groups.items())
+
+
+@contextmanager
+def atomic_all():
+    # One transaction per shard plus default, committed together at exit.
+    # A failure while committing can still leave earlier shards committed.
+    with ExitStack() as stack:
+        for alias in dict.fromkeys(['default', *shards.shard_aliases()]):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def allocate_ids(model, count):
+    # count fresh primary keys for a sharded model, from its ShardSequence
+    name = model._meta.label_lower
+    using = router.db_for_write(ShardSequence)
+    sequences = ShardSequence.objects.using(using)
+    with transaction.atomic(using=using):
+        if not sequences.filter(name=name).update(last_value=F('last_value') + count):
+            start = ShardedQuerySet(model.objects.all()).aggregate(last=Max('pk'))['last'] or 0
+            sequences.get_or_create(name=name, defaults={'last_value': start})
+            sequences.filter(name=name).update(last_value=F('last_value') + count)
+        last = sequences.filter(name=name).values_list('last_value', flat=True).get()
+    return range(last - count + 1, last + 1)
+
+
+def assign_ids(model, objs):
+    # Primary keys for objects about to be bulk created on a shard
+    if not shards.is_sharded(model):
+        return
+    missing = [obj for obj in objs if obj.pk is None]
+    for obj, pk in zip(missing, allocate_ids(model, len(missing))):
+        obj.pk = pk
+
+
+def copy_reference_rows(model, objs):
+    # Mirror rows of a reference model (authors, categories, ...) from default
+    # onto the other shards, so books and links there keep their foreign keys
+    aliases = [alias for alias in shards.shard_aliases() if alias != 'default']
+    if not aliases or not objs or model._meta.model_name not in shards.REFERENCE_MODELS:
+        return
+    fields = [field.attname for field in model._meta.concrete_fields if not field.primary_key]
+    for alias in aliases:
+        model.objects.using(alias).bulk_create(
+            [model(pk=obj.pk, **{name: getattr(obj, name) for name in fields}) for obj in objs],
+            update_conflicts=True,
+            unique_fields=[model._meta.pk.name],
+            update_fields=fields,
+        )
+
+
+def delete_reference_rows(model, pks):
+    for alias in shards.shard_aliases():
+        if alias != 'default':
+            model.objects.using(alias).filter(pk__in=pks).delete()
@@ -0,0 +1,134 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from routers import shards
+
+from . import caching, sharding, stats
+from .models import Author, AuthorProfile, Book, BookStats, Category
+
+
+@receiver(pre_save, sender=Book)
+def remember_previous_book(sender, instance, raw=False, using=None, **kwargs):
+    instance._stats_previous = None
+    if raw or instance._state.adding:
+        return
+    instance._stats_previous = Book.objects.using(using).filter(pk=instance.pk).values(
+        'author_id', 'price').first()
+
+
+@receiver(pre_save, sender=Book)
+def assign_sharded_book_id(sender, instance, raw=False, **kwargs):
+    # Shards cannot share an autoincrement, ids come from one sequence
+    if not raw and instance.pk is None and shards.is_sharded(Book):
+        instance.pk = sharding.allocate_ids(Book, 1)[0]
+
+
+@receiver(pre_save, sender=Book)
+def fill_stored_columns(sender, instance, raw=False, using=None, **kwargs):
+    # The database triggers store the same values, setting them here keeps
+    # the saved instance in step with its row
+    if raw:
+        return
+    instance.title_length = len(instance.title)
+    if Book.author.is_cached(instance):
+        instance.author_name = instance.author.name
+    elif instance.author_id is not None:
+        instance.author_name = Author.objects.using(using).values_list(
+            'name', flat=True).get(pk=instance.author_id)
+
+
+@receiver(post_save, sender=Book)
+def count_saved_book(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = stats.new_deltas()
+    previous = getattr(instance, '_stats_previous', None)
+    price = stats.book_price(instance.price)
+    if created or previous is None:
+        # A new book has no categories yet, m2m_changed counts them later
+        stats.add_book(deltas, instance.author_id, [], price)
+    elif previous['author_id'] != instance.author_id or previous['price'] != price:
+        category_ids = list(instance.categories.values_list('id', flat=True))
+        stats.add_book(deltas, previous['author_id'], category_ids, previous['price'], sign=-1)
+        stats.add_book(deltas, instance.author_id, category_ids, price)
+    stats.apply_deltas(deltas)
+
+
+@receiver(pre_delete, sender=Book)
+def remember_deleted_book_categories(sender, instance, **kwargs):
+    # Link rows are gone by the time post_delete fires
+    instance._stats_category_ids = list(instance.categories.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Book)
+def uncount_deleted_book(sender, instance, **kwargs):
+    deltas = stats.new_deltas()
+    stats.add_book(deltas, instance.author_id, getattr(instance, '_stats_category_ids', []),
+                   stats.book_price(instance.price), sign=-1)
+    stats.apply_deltas(deltas)
+
+
+@receiver(pre_delete, sender=Category)
+def uncount_deleted_category(sender, instance, **kwargs):
+    # Its links are deleted along with it, without an m2m_changed signal
+    stats.remove_bucket((BookStats.SCOPE_CATEGORY, instance.pk))
+
+
+def linked_books(instance, reverse, using, pk_set=None):
+    # (category id, book price) pairs for the links touched by m2m_changed
+    links = Book.categories.through.objects.using(using).filter(
+        **{'category_id' if reverse else 'book_id': instance.pk})
+    if pk_set is not None:
+        links = links.filter(**{'book_id__in' if reverse else 'category_id__in': pk_set})
+    return list(links.values_list('category_id', 'book__price'))
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def count_category_links(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action in ('pre_remove', 'pre_clear'):
+        # Capture the links that really exist before they are deleted
+        instance._stats_unlinked = linked_books(instance, reverse, using, pk_set)
+        return
+
+    if action == 'post_add':
+        links, sign = linked_books(instance, reverse, using, pk_set), 1
+    elif action in ('post_remove', 'post_clear'):
+        links, sign = instance._stats_unlinked, -1
+    else:
+        return
+
+    deltas = stats.new_deltas()
+    for category_id, price in links:
+        stats.add_to_bucket(deltas, (BookStats.SCOPE_CATEGORY, category_id), price, sign)
+    stats.apply_deltas(deltas)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=AuthorProfile)
+@receiver(post_save, sender=Category)
+def mirror_reference_row(sender, instance, raw=False, using=None, **kwargs):
+    if not raw and using == 'default':
+        sharding.copy_reference_rows(sender, [instance])
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=AuthorProfile)
+@receiver(post_delete, sender=Category)
+def delete_mirrored_reference_row(sender, instance, using=None, **kwargs):
+    if using == 'default' and shards.is_sharded(Book):
+        sharding.delete_reference_rows(sender, [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Category)
+def bump_cache_generation(sender, **kwargs):
+    caching.bump(sender)
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def bump_category_links_generation(sender, action, **kwargs):
+    # Django sends no model signals for the auto-created link table
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        caching.bump(Book)
+        caching.bump(Category)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Dotted path of the view handling the current request, None outside one
+current_view = ContextVar('slow_query_view', default=None)
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+EXPLAIN_SAVEPOINT = 'slow_query_explain'
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    # Same text for queries that only differ in their values, e.g.
+    # "... IN (%s, %s)" and "... IN (%s)" or LIMIT 20 and LIMIT 40
+    sql = sql.replace('%s', '?')
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def view_path(view_func):
+    view = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None) or view_func
+    return f'{view.__module__}.{view.__qualname__}'
+
+
+def explain(connection, sql, params):
+    # The plan as text, from a cursor of its own so the slow query's
+    # results are left untouched and the EXPLAIN is neither counted nor
+    # logged itself; None where there is nothing to explain
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    # A failed EXPLAIN must not break the transaction the query ran in,
+    # which only PostgreSQL aborts on an error
+    savepoint = connection.in_atomic_block and connection.vendor == 'postgresql'
+    cursor = connection.create_cursor()
+    try:
+        if savepoint:
+            cursor.execute(connection.ops.savepoint_create_sql(EXPLAIN_SAVEPOINT))
+        try:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        except connection.Database.Error:
+            if savepoint:
+                cursor.execute(connection.ops.savepoint_rollback_sql(EXPLAIN_SAVEPOINT))
+            raise
+        finally:
+            if savepoint:
+                cursor.execute(connection.ops.savepoint_commit_sql(EXPLAIN_SAVEPOINT))
+    except connection.Database.Error as exc:
+        return f'EXPLAIN failed: {exc}'
+    finally:
+        cursor.close()
+    if connection.vendor == 'sqlite':
+        # id, parent, notused, detail
+        rows = [row[-1:] for row in rows]
+    return '\n'.join(' | '.join(str(value) for value in row) for row in rows)
+
+
+def log_slow_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= settings.SLOW_QUERY_THRESHOLD_MS:
+            record(context['connection'], sql, params, many, elapsed_ms)
+
+
+def record(connection, sql, params, many, elapsed_ms):
+    normalized = normalize(sql)
+    entry = {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'alias': connection.alias,
+        'vendor': connection.vendor,
+        'view': current_view.get(),
+        'fingerprint': fingerprint(normalized),
+        'normalized': normalized,
+        'duration_ms': round(elapsed_ms, 3),
+        'sql': sql,
+        'params': None if many else [str(param) for param in params or ()],
+        'plan': None if many else explain(connection, sql, params),
+    }
+    logger.warning(json.dumps(entry))
+
+
+def add_slow_query_log(sender, connection, **kwargs):
+    # First in the list: execute_wrapper() contexts pop the last wrapper
+    if log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, log_slow_query)
+
+
+def install():
+    # Wraps every connection of every alias as it connects, which also
+    # covers shard worker threads and the async ORM's threads; called once
+    # from PresentationConfig.ready()
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(add_slow_query_log)
+
+
+def read_entries(path):
+    # Entries of the log and its rotated backups (log.1 is the newest),
+    # oldest file first
+    backups = [backup for backup in path.parent.glob(path.name + '.*')
+               if backup.suffix[1:].isdigit()]
+    paths = sorted(backups, key=lambda backup: int(backup.suffix[1:]), reverse=True) + [path]
+    for log_path in paths:
+        if not log_path.exists():
+            continue
+        with open(log_path) as lines:
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def rank(entries):
+    # Fingerprints by total time spent, with their latest sample and plan
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(entry['fingerprint'], {
+            'fingerprint': entry['fingerprint'],
+            'normalized': entry['normalized'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'views': set(),
+        })
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        group['views'].add(entry['view'] or '-')
+        group['sql'] = entry['sql']
+        group['plan'] = entry['plan']
+    return sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
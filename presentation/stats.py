@@ -0,0 +1,148 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Count, Sum
+
+from . import sharding
+from .models import Book, BookStats
+
+ALL_KEY = (BookStats.SCOPE_ALL, 0)
+
+
+def book_price(value):
+    # A Book.price as the database stores it: the ORM also takes strings
+    # and floats, which neither add to a Decimal nor compare equal to one
+    field = Book._meta.get_field('price')
+    return field.to_python(value).quantize(Decimal(1).scaleb(-field.decimal_places))
+
+
+def book_buckets(author_id, category_ids):
+    buckets = [ALL_KEY, (BookStats.SCOPE_AUTHOR, author_id)]
+    buckets.extend((BookStats.SCOPE_CATEGORY, category_id) for category_id in category_ids)
+    return buckets
+
+
+def increment_sql(connection):
+    qn = connection.ops.quote_name
+    return (
+        f'UPDATE {qn(BookStats._meta.db_table)} '
+        f'SET {qn("book_count")} = {qn("book_count")} + %s, '
+        f'{qn("total_price")} = {qn("total_price")} + %s '
+        f'WHERE {qn("scope")} = %s AND {qn("key")} = %s'
+    )
+
+
+def apply_deltas(deltas):
+    # deltas: {(scope, key): (count_delta, price_delta)}. Missing buckets
+    # are created in one statement and each increment is one precompiled
+    # UPDATE, so a bulk write touching many authors skips per-bucket ORM
+    # query building while concurrent writers still add atomically.
+    params = [
+        (count, price, scope, key)
+        for (scope, key), (count, price) in deltas.items()
+        if count or price
+    ]
+    if not params:
+        return
+    using = router.db_for_write(BookStats)
+    with transaction.atomic(using=using):
+        BookStats.objects.using(using).bulk_create(
+            [BookStats(scope=scope, key=key) for _, _, scope, key in params],
+            ignore_conflicts=True,
+        )
+        connection = connections[using]
+        sql = increment_sql(connection)
+        with connection.cursor() as cursor:
+            for row in params:
+                cursor.execute(sql, row)
+
+
+def add_to_bucket(deltas, bucket, price, sign=1):
+    count, total = deltas[bucket]
+    deltas[bucket] = (count + sign, total + sign * price)
+
+
+def remove_bucket(bucket):
+    scope, key = bucket
+    BookStats.objects.using(router.db_for_write(BookStats)).filter(scope=scope, key=key).delete()
+
+
+def add_book(deltas, author_id, category_ids, price, sign=1):
+    for bucket in book_buckets(author_id, category_ids):
+        add_to_bucket(deltas, bucket, price, sign)
+
+
+def new_deltas():
+    return defaultdict(lambda: (0, Decimal(0)))
+
+
+def snapshot(queryset):
+    # Grouped count and price sum of the rows in queryset, per bucket
+    totals = {}
+    overall = queryset.aggregate(count=Count('id'), total=Sum('price'))
+    totals[ALL_KEY] = (overall['count'], overall['total'] or Decimal(0))
+
+    for row in queryset.order_by().values('author_id').annotate(
+            count=Count('id'), total=Sum('price')):
+        totals[(BookStats.SCOPE_AUTHOR, row['author_id'])] = (row['count'], row['total'])
+
+    through = Book.categories.through.objects.using(queryset.db).filter(book__in=queryset)
+    for row in through.order_by().values('category_id').annotate(
+            count=Count('id'), total=Sum('book__price')):
+        totals[(BookStats.SCOPE_CATEGORY, row['category_id'])] = (row['count'], row['total'])
+    return totals
+
+
+@contextmanager
+def track_bulk_update(queryset):
+    # Wraps a queryset.update() that bypasses model signals. The filter of
+    # queryset must not depend on the columns being updated.
+    with transaction.atomic():
+        before = snapshot(queryset)
+        yield
+        after = snapshot(queryset)
+
+        deltas = new_deltas()
+        for bucket in before.keys() | after.keys():
+            before_count, before_total = before.get(bucket, (0, Decimal(0)))
+            after_count, after_total = after.get(bucket, (0, Decimal(0)))
+            deltas[bucket] = (after_count - before_count, after_total - before_total)
+        apply_deltas(deltas)
+
+
+def reconcile():
+    # Rebuild every bucket from the books table, summed over the shards
+    totals = new_deltas()
+    for queryset in sharding.per_shard(Book.objects.all()):
+        for bucket, (count, total) in snapshot(queryset).items():
+            previous_count, previous_total = totals[bucket]
+            totals[bucket] = (previous_count + count, previous_total + total)
+
+    with transaction.atomic():
+        BookStats.objects.all().delete()
+        BookStats.objects.bulk_create(
+            BookStats(scope=scope, key=key, book_count=count, total_price=total)
+            for (scope, key), (count, total) in totals.items()
+        )
+
+
+def summary_queryset(scope):
+    return BookStats.objects.filter(scope=scope, book_count__gt=0).order_by('key')
+
+
+def summary_row(row):
+    return {
+        'key': row.key,
+        'average_price': row.total_price / row.book_count if row.book_count else None,
+        'total_books': row.book_count,
+    }
+
+
+def summary(scope=BookStats.SCOPE_ALL):
+    return [summary_row(row) for row in summary_queryset(scope)]
+
+
+async def asummary(scope=BookStats.SCOPE_ALL):
+    return [summary_row(row) async for row in summary_queryset(scope)]
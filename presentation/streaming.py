@@ -0,0 +1,45 @@
+import json
+
+from django.db import connections
+from rest_framework.utils import encoders
+
+FLUSH_BYTES = 64 * 1024
+
+
+def encode(item):
+    # Same bytes as DRF's JSONRenderer with its default compact, unicode output
+    return json.dumps(
+        item, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':'),
+    ).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def stream_json_array(items):
+    # Yields a JSON array in ~64KB pieces, holding at most one piece in memory
+    buffer = ['[']
+    size = 1
+    for index, item in enumerate(items):
+        if index:
+            buffer.append(',')
+        text = encode(item)
+        buffer.append(text)
+        size += len(text) + 1
+        if size >= FLUSH_BYTES:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    buffer.append(']')
+    yield ''.join(buffer).encode()
+
+
+def iter_raw(sql, params=None, using='default', chunk_size=2000):
+    # Rows of a raw query as dicts, fetched chunk by chunk. chunked_cursor()
+    # is a server-side cursor on Postgres and a plain cursor elsewhere.
+    connection = connections[using]
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params or [])
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(columns, row))
@@ -0,0 +1,155 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding
+from .models import Book, SecondTableBooks, SyncCheckpoint
+
+logger = logging.getLogger(__name__)
+
+DB2_ALIAS = 'mydatabase'
+CHECKPOINT_NAME = 'books_to_db2'
+
+
+@dataclass
+class SyncReport:
+    # rows are books past the high-water mark; reread are the overlap rows
+    # at or before it, copied again in case one committed late
+    rows: int = 0
+    reread: int = 0
+    elapsed: float = 0.0
+    batch_timings: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return self.rows / self.elapsed
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'reread': self.reread,
+            'elapsed': round(self.elapsed, 4),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'batches': [
+                {'rows': rows, 'seconds': round(seconds, 4)}
+                for rows, seconds in self.batch_timings
+            ],
+        }
+
+
+class BookSync:
+    # Copies new or changed books to SecondTableBooks on the db2 alias
+    # in chunks, upserting on source_id and advancing a high-water mark
+    # of (updated_at, id) after every committed batch. updated_at is
+    # stamped before its row commits, so a row can commit after the mark
+    # has passed it, though no later than overlap seconds after its stamp.
+    # Every run therefore rereads the rows stamped since overlap seconds
+    # before the previous run started, which the upserts make harmless; once
+    # writes stop, the window moves past the mark and nothing is reread.
+
+    def __init__(self, batch_size=1000, using=DB2_ALIAS, on_batch=None, overlap=None):
+        self.batch_size = batch_size
+        self.using = using
+        self.on_batch = on_batch
+        self.overlap = settings.BOOK_SYNC_OVERLAP_SECONDS if overlap is None else overlap
+
+    def get_checkpoint(self):
+        checkpoint, _ = SyncCheckpoint.objects.using(self.using).get_or_create(
+            name=CHECKPOINT_NAME)
+        return checkpoint
+
+    def reset(self):
+        SyncCheckpoint.objects.using(self.using).filter(name=CHECKPOINT_NAME).delete()
+
+    def pending(self, checkpoint):
+        # Merged from every shard in (updated_at, id) order with BOOK_SHARDS
+        queryset = Book.objects.only(
+            'id', 'title', 'price', 'updated_at', 'author_name',
+        ).order_by('updated_at', 'id')
+        if checkpoint.last_updated_at is not None:
+            # Checkpoints from before last_run_at was stored reread once
+            # from the mark
+            since = (checkpoint.last_run_at or checkpoint.last_updated_at) - timedelta(
+                seconds=self.overlap)
+            queryset = queryset.filter(
+                Q(updated_at__gte=since) |
+                Q(updated_at__gt=checkpoint.last_updated_at) |
+                Q(updated_at=checkpoint.last_updated_at, id__gt=checkpoint.last_id)
+            )
+        return sharding.sharded(queryset)
+
+    @staticmethod
+    def position(checkpoint):
+        return checkpoint.last_updated_at, checkpoint.last_id
+
+    def write_batch(self, books):
+        rows = [
+            SecondTableBooks(
+                source_id=book.id,
+                title=book.title,
+                author=book.author_name,
+                price=book.price,
+            )
+            for book in books
+        ]
+        SecondTableBooks.objects.using(self.using).bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['source_id'],
+            update_fields=['title', 'author', 'price'],
+        )
+
+    def run(self):
+        report = SyncReport()
+        checkpoint = self.get_checkpoint()
+        # Taken before reading, so the next run's window covers every row
+        # that was not yet committed when this one looked
+        run_at = timezone.now()
+        started = time.perf_counter()
+        mark = self.position(checkpoint) if checkpoint.last_updated_at is not None else None
+
+        batch = []
+        for book in self.pending(checkpoint).iterator(chunk_size=self.batch_size):
+            batch.append(book)
+            if len(batch) >= self.batch_size:
+                self._flush(batch, checkpoint, report, mark)
+                batch = []
+        if batch:
+            self._flush(batch, checkpoint, report, mark)
+
+        checkpoint.last_run_at = run_at
+        checkpoint.save(using=self.using, update_fields=['last_run_at'])
+        report.elapsed = time.perf_counter() - started
+        logger.info('Synced %d books (%d reread) to %s in %.3fs (%.1f rows/s)',
+                    report.rows, report.reread, self.using, report.elapsed,
+                    report.rows_per_second)
+        return report
+
+    def _flush(self, batch, checkpoint, report, mark):
+        batch_started = time.perf_counter()
+        last = batch[-1]
+        with transaction.atomic(using=self.using):
+            self.write_batch(batch)
+            # A batch of rereads ends before the mark, which never goes back
+            if (checkpoint.last_updated_at is None
+                    or (last.updated_at, last.id) > self.position(checkpoint)):
+                checkpoint.last_updated_at = last.updated_at
+                checkpoint.last_id = last.id
+                checkpoint.save(using=self.using, update_fields=['last_updated_at', 'last_id'])
+
+        seconds = time.perf_counter() - batch_started
+        reread = 0 if mark is None else sum((book.updated_at, book.id) <= mark for book in batch)
+        report.reread += reread
+        report.rows += len(batch) - reread
+        report.batch_timings.append((len(batch), seconds))
+        logger.debug('Synced batch of %d books in %.4fs', len(batch), seconds)
+        if self.on_batch:
+            self.on_batch(report)
@@ -1,3 +1,1519 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import brotli
+import msgpack
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.http import HttpResponse
+from django.template.backends.django import Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.serializers import BaseSerializer
+
+from routers import replicas
+from routers.middleware import ReplicaPinMiddleware
+
+from . import benchmarking, caching, coalescing, export, index_advisor, jobs, metrics, \
+    pagination, price_updates, search, sharding, slow_queries, stats, views
+from .ingest import BookIngest
+from .middleware import CompressionMiddleware, RequestMetricsMiddleware, \
+    SlowQueryViewMiddleware
+from .mixins import QueryBudgetMixin
+from .models import Author, AuthorProfile, BackgroundJob, Book, BookStats, Category, \
+    PriceUpdateJob, SecondTableBooks, ShardSequence, SyncCheckpoint
+from .renderers import columnar, rows_from_columnar
+from .sync import BookSync
+
+
+def create_catalogue(authors=3, books_per_author=4):
+    categories = [Category.objects.create(name=name) for name in ('Poetry', 'Crime')]
+    for index in range(authors):
+        author = Author.objects.create(name=f'Author {index}')
+        AuthorProfile.objects.create(author=author, publishing_house=f'House {index % 2}',
+                                     date_of_birth=date(1970, 1, index + 1))
+        for number in range(books_per_author):
+            book = Book.objects.create(
+                title=f'River book {index}-{number}', author=author,
+                publication_date=date(2000 + number, 1, index + 1),
+                price=Decimal('10.00') + number)
+            book.categories.set(categories[:number % 2 + 1])
+
+
+def add_sqlite_database(alias, name):
+    connections.settings[alias] = connections.configure_settings({
+        'default': connections.settings['default'],
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name},
+    })[alias]
+
+
+def remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+class ExtraDatabasesMixin:
+    # SQLite files registered as extra_databases for one test class, each a
+    # copy of the test database's schema, as refresh_sqlite_replicas makes
+    extra_databases = ()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database_dir = tempfile.mkdtemp()
+        primary = connections['default']
+        primary.ensure_connection()
+        for alias in cls.extra_databases:
+            name = os.path.join(cls.database_dir, f'{alias}.sqlite3')
+            with closing(sqlite3.connect(name)) as target:
+                primary.connection.backup(target)
+            add_sqlite_database(alias, name)
+        cls.databases = {'default', *cls.extra_databases}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.extra_databases:
+            remove_database(alias)
+        shutil.rmtree(cls.database_dir)
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(TestCase):
+    # Every view with a max_queries is requested with budgets raising,
+    # first with cold caches and then with warm ones
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+        cls.book = Book.objects.order_by('id').first()
+        cls.job = jobs.enqueue('sync_books_to_db2')
+        cls.price_job = price_updates.create_job(multiplier='1.1')
+
+    def setUp(self):
+        cache.clear()
+
+    def read_urls(self):
+        return [
+            f'/books/{self.book.pk}/',
+            '/books/annotate/',
+            '/books/aggregate/',
+            '/books/aggregate/?group_by=category',
+            '/books/select_related/',
+            '/books/prefetch_related/',
+            '/books/defer/',
+            '/books/only/',
+            '/books/raw/',
+            '/books/extra/',
+            '/update_prices_with_f_objects/',
+            f'/jobs/{self.job.pk}',
+            f'/books/price_update_jobs/{self.price_job.pk}',
+            '/filtered_book_list/?query=river',
+            '/books/with_cache',
+            '/books/fragment_cached_book_list',
+            '/cache/stats',
+            '/books/list_with_paginator?page=2',
+            '/books/pagination_based_on_template?page=2',
+            '/books/limitoffset_pagination_view?limit=5&offset=5',
+            '/books/custom_limitoffset_pagination_view',
+            '/books/keyset_pagination_view',
+            '/books/keyset_pagination_by_date_view',
+            '/books/keyset_pagination_based_on_template',
+            '/author/one_to_one_relation',
+            '/books/many_to_many_relation',
+            '/books/filtered_books_to_db2',
+        ]
+
+    def queued_urls(self):
+        return ['/books/price_update_jobs', f'/books/price_update_jobs/{self.price_job.pk}']
+
+    def test_every_budgeted_view_is_requested(self):
+        requested = {resolve(url.partition('?')[0]).func.view_class
+                     for url in self.read_urls() + self.queued_urls()}
+        budgeted = {view for view in vars(views).values()
+                    if isinstance(view, type) and issubclass(view, QueryBudgetMixin)
+                    and view.max_queries is not None}
+        self.assertEqual(budgeted - requested, set())
+
+    def test_reads_stay_within_budget(self):
+        for url in self.read_urls():
+            with self.subTest(url=url):
+                for _ in range(2):
+                    response = self.client.get(url)
+                    self.assertIn(response.status_code, (200, 202))
+
+    def test_creates_stay_within_budget(self):
+        for index, url in enumerate(['/books/annotate/', '/books/with_cache',
+                                     '/books/fragment_cached_book_list']):
+            with self.subTest(url=url):
+                # A new author is the most expensive create
+                response = self.client.post(url, {
+                    'title': 'Budget', 'author': {'name': f'New author {index}'},
+                    'publication_date': '2001-01-01', 'price': '5.00',
+                }, content_type='application/json')
+                self.assertEqual(response.status_code, 201)
+
+    def test_queued_jobs_stay_within_budget(self):
+        for url in self.queued_urls():
+            with self.subTest(url=url):
+                response = self.client.post(url, {'multiplier': '1.1'},
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 202)
+
+
+class BookSyncTests(ExtraDatabasesMixin, TransactionTestCase):
+    # BookSync into an SQLite stand-in for the db2 alias
+    extra_databases = ('sync_db2',)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with connections['sync_db2'].schema_editor() as editor:
+            editor.create_model(SecondTableBooks)
+            editor.create_model(SyncCheckpoint)
+
+    def setUp(self):
+        create_catalogue()
+
+    def sync(self, overlap=60, on_batch=None):
+        return BookSync(batch_size=5, using='sync_db2', overlap=overlap, on_batch=on_batch).run()
+
+    def copies(self):
+        return dict(SecondTableBooks.objects.using('sync_db2').values_list('source_id', 'title'))
+
+    def checkpoint(self):
+        return SyncCheckpoint.objects.using('sync_db2').values_list(
+            'last_updated_at', 'last_id').get()
+
+    def test_incremental_runs(self):
+        report = self.sync()
+        self.assertEqual((report.rows, report.reread), (12, 0))
+        self.assertEqual(self.copies(), dict(Book.objects.values_list('id', 'title')))
+
+        book = Book.objects.order_by('id').first()
+        book.title = 'Renamed'
+        book.save()
+        Book.objects.create(title='New', author=book.author, publication_date=date(2001, 1, 1),
+                            price=Decimal('5.00'))
+        report = self.sync(overlap=0)
+        self.assertEqual((report.rows, report.reread), (2, 0))
+        self.assertEqual(self.copies(), dict(Book.objects.values_list('id', 'title')))
+        self.assertEqual(self.checkpoint(), Book.objects.order_by('-updated_at', '-id').values_list(
+            'updated_at', 'id').first())
+
+    def test_second_run_is_idempotent(self):
+        self.sync()
+        copies, checkpoint = self.copies(), self.checkpoint()
+        # Rows stamped in the last overlap seconds are reread, not counted
+        report = self.sync()
+        self.assertEqual((report.rows, report.reread), (0, 12))
+        self.assertEqual((self.copies(), self.checkpoint()), (copies, checkpoint))
+
+        # Once the window has moved past the mark nothing is read again
+        SyncCheckpoint.objects.using('sync_db2').update(
+            last_run_at=timezone.now() + timedelta(seconds=120))
+        report = self.sync()
+        self.assertEqual((report.rows, report.reread), (0, 0))
+
+    def test_late_commit_inside_the_overlap(self):
+        self.sync()
+        checkpoint = self.checkpoint()
+        # Stamped before the mark, committed after the run had passed it
+        book = Book.objects.create(title='Late', author=Author.objects.first(),
+                                   publication_date=date(2001, 1, 1), price=Decimal('5.00'))
+        Book.objects.filter(pk=book.pk).update(updated_at=checkpoint[0] - timedelta(seconds=1))
+        positions = []
+        report = self.sync(on_batch=lambda report: positions.append(self.checkpoint()))
+        self.assertEqual(report.rows + report.reread, 13)
+        self.assertEqual(self.copies()[book.pk], 'Late')
+        # The first batch ends on the late row, before the mark
+        self.assertEqual(positions, [checkpoint] * 3)
+
+
+class BookStatsTests(TestCase):
+    # BookStats kept by the receivers, ingestion and tracked bulk updates
+    # equals the aggregates recomputed from the books
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def recomputed(self):
+        totals = {}
+        overall = Book.objects.aggregate(count=Count('id'), total=Sum('price'))
+        if overall['count']:
+            totals[BookStats.SCOPE_ALL, 0] = (overall['count'], overall['total'])
+        for author in Author.objects.annotate(count=Count('book'), total=Sum('book__price')):
+            if author.count:
+                totals[BookStats.SCOPE_AUTHOR, author.pk] = (author.count, author.total)
+        for category in Category.objects.annotate(count=Count('book'), total=Sum('book__price')):
+            if category.count:
+                totals[BookStats.SCOPE_CATEGORY, category.pk] = (category.count, category.total)
+        return totals
+
+    def maintained(self):
+        return {(row.scope, row.key): (row.book_count, row.total_price)
+                for row in BookStats.objects.filter(book_count__gt=0)}
+
+    def assertStatsMatch(self):
+        self.assertEqual(self.maintained(), self.recomputed())
+
+    def test_single_writes(self):
+        self.assertStatsMatch()
+        categories = list(Category.objects.all())
+        book = Book.objects.create(title='Counted', author=Author.objects.first(),
+                                   publication_date=date(2001, 1, 1), price='7.5')
+        book.categories.set(categories)
+        self.assertStatsMatch()
+
+        book.title = 'Renamed'
+        book.save()
+        self.assertStatsMatch()
+        book.price = 9.99
+        book.save()
+        self.assertStatsMatch()
+        book.author = Author.objects.last()
+        book.save()
+        self.assertStatsMatch()
+
+        book.categories.remove(categories[0])
+        self.assertStatsMatch()
+        categories[0].book_set.add(book)
+        self.assertStatsMatch()
+        book.categories.clear()
+        self.assertStatsMatch()
+
+        book.delete()
+        self.assertStatsMatch()
+        Book.objects.filter(author=Author.objects.first()).delete()
+        self.assertStatsMatch()
+        categories[1].delete()
+        self.assertStatsMatch()
+
+    def test_bulk_writes(self):
+        categories = list(Category.objects.values_list('pk', flat=True))
+        BookIngest().ingest([
+            {'title': f'Ingested {index}', 'author': {'name': f'Author {index % 4}'},
+             'publication_date': '2001-01-01', 'price': '5.25', 'categories': categories}
+            for index in range(8)
+        ])
+        self.assertStatsMatch()
+
+        # Filtered on ids, which the update leaves alone
+        books = Book.objects.filter(pk__in=list(Book.objects.filter(
+            author__name='Author 1').values_list('pk', flat=True)))
+        with stats.track_bulk_update(books):
+            books.update(price=F('price') * 2, author=Author.objects.get(name='Author 2'))
+        self.assertStatsMatch()
+
+        price_updates.PriceUpdateRunner(price_updates.create_job('1.1', batch_size=5)).run()
+        self.assertStatsMatch()
+
+    def test_reconcile_repairs_drift(self):
+        BookStats.objects.filter(scope=BookStats.SCOPE_ALL).update(book_count=999)
+        BookStats.objects.filter(scope=BookStats.SCOPE_AUTHOR).first().delete()
+        BookStats.objects.create(scope=BookStats.SCOPE_CATEGORY, key=12345, book_count=3,
+                                 total_price=30)
+        self.assertNotEqual(self.maintained(), self.recomputed())
+        call_command('reconcile_book_stats', stdout=StringIO())
+        self.assertStatsMatch()
+
+        overall = Book.objects.aggregate(count=Count('id'), average=Avg('price'))
+        response = self.client.get('/books/aggregate/').json()
+        self.assertEqual(response['total_books'], overall['count'])
+        self.assertEqual(Decimal(str(response['average_price'])).quantize(Decimal('0.01')),
+                         overall['average'].quantize(Decimal('0.01')))
+
+
+class SearchTests(TestCase):
+    # The FTS5 backend of the SQLite test database, kept in step by triggers
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def titles(self, query):
+        return [book['title'] for book in
+                self.client.get('/filtered_book_list/', {'query': query}).json()]
+
+    def test_match(self):
+        author = Author.objects.create(name='Herman Melville')
+        Book.objects.create(title='Moby-Dick', author=author, publication_date=date(2001, 1, 1),
+                            price=Decimal('5.00'))
+        self.assertEqual(self.titles('dick moby'), ['Moby-Dick'])
+        # The last term is a prefix, and author names match too
+        self.assertEqual(self.titles('Melv'), ['Moby-Dick'])
+        self.assertEqual(len(self.titles('riv')), 12)
+
+    def test_no_match(self):
+        self.assertEqual(self.titles('ocean'), [])
+
+    def test_punctuation_only_matches_nothing(self):
+        for query in ['!!!', '"', "'"]:
+            with self.subTest(query=query):
+                self.assertEqual(self.titles(query), [])
+                self.assertFalse(search.PostgresSearchBackend().search(Book.objects.all(), query))
+        self.assertEqual(len(self.titles('')), 12)
+
+    def test_title_matches_rank_first(self):
+        author = Author.objects.create(name='Tolkien')
+        Book.objects.create(title='Letters', author=author, publication_date=date(2001, 1, 1),
+                            price=Decimal('5.00'))
+        Book.objects.create(title='Reading Tolkien', author=Author.objects.first(),
+                            publication_date=date(2001, 1, 1), price=Decimal('5.00'))
+        self.assertEqual(self.titles('tolkien'), ['Reading Tolkien', 'Letters'])
+
+    def test_edits_are_indexed(self):
+        book = Book.objects.get(title='River book 0-0')
+        book.title = 'Ocean crossing'
+        book.save()
+        self.assertEqual(self.titles('ocean'), ['Ocean crossing'])
+        self.assertNotIn('River book 0-0', self.titles('river'))
+        book.title = 'River book 0-0'
+        book.save()
+        self.assertIn('River book 0-0', self.titles('river'))
+        self.assertEqual(self.titles('ocean'), [])
+
+        Author.objects.filter(pk=book.author_id).update(name='Renamed writer')
+        self.assertEqual(len(self.titles('renamed')), 4)
+        book.delete()
+        self.assertEqual(len(self.titles('renamed')), 3)
+
+
+class BenchmarkRouteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+        cls.job = jobs.enqueue('sync_books_to_db2')
+        cls.price_job = price_updates.create_job(multiplier='1.1')
+
+    def test_routes_are_read_only_and_filled(self):
+        urls = dict(benchmarking.route_urls(benchmarking.get_routes()))
+        for route in ['books/bulk_create/', 'books/price_update_jobs',
+                      'update_prices_with_f_objects/', 'books/filtered_books_to_db2']:
+            self.assertNotIn(route, urls)
+        self.assertEqual(urls['jobs/<int:pk>'], f'/jobs/{self.job.pk}')
+        self.assertEqual(urls['books/price_update_jobs/<int:pk>'],
+                         f'/books/price_update_jobs/{self.price_job.pk}')
+
+        client = benchmarking.route_client()
+        for route, url in urls.items():
+            with self.subTest(route=route):
+                benchmarking.fetch(client, url)
+
+    def test_failed_requests_are_not_samples(self):
+        with self.assertRaises(benchmarking.RouteFailed):
+            benchmarking.fetch(benchmarking.route_client(), '/books/0/')
+
+
+class CompiledListTests(TestCase):
+    # The compiled fast path is opt-in and renders what DRF renders
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_title_length_only_where_it_was_annotated(self):
+        for url, expected in [('/books/annotate/', True), ('/books/select_related/', True),
+                              ('/books/defer/', True), ('/async/books/annotate/', True),
+                              ('/books/only/', False), ('/filtered_book_list/?query=river', False),
+                              ('/books/keyset_pagination_view', False)]:
+            with self.subTest(url=url):
+                data = self.client.get(url).json()
+                book = (data['results'] if isinstance(data, dict) else data)[0]
+                self.assertEqual('title_length' in book, expected)
+
+    def test_compiled_lists_match_drf(self):
+        for url in ['/books/annotate/', '/books/select_related/', '/books/prefetch_related/',
+                    '/books/defer/', '/books/only/', '/filtered_book_list/?query=river',
+                    '/books/limitoffset_pagination_view?limit=5&offset=5',
+                    '/books/keyset_pagination_view', '/author/one_to_one_relation']:
+            with self.subTest(url=url):
+                responses = []
+                for enabled in (False, True):
+                    with override_settings(COMPILED_LIST_VIEWS=enabled):
+                        responses.append(self.client.get(url).json())
+                self.assertEqual(responses[0], responses[1])
+
+
+class StreamingListTests(TestCase):
+    # ?stream=1 bodies are the same JSON as the buffered responses
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def test_streamed_lists_match(self):
+        urls = ['/books/annotate/', '/books/select_related/', '/books/prefetch_related/',
+                '/books/defer/', '/books/only/', '/books/raw/', '/books/extra/',
+                '/filtered_book_list/?query=river', '/books/annotate/?fields=id,title']
+        for url in urls:
+            for compiled in (False, True):
+                with self.subTest(url=url, compiled=compiled), \
+                        override_settings(COMPILED_LIST_VIEWS=compiled):
+                    cache.clear()
+                    expected = self.client.get(url).json()
+                    separator = '&' if '?' in url else '?'
+                    response = self.client.get(f'{url}{separator}stream=1')
+                    self.assertTrue(response.streaming)
+                    self.assertEqual(response['Content-Type'], 'application/json')
+                    self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+
+    def test_chunk_boundaries(self):
+        expected = self.client.get('/books/annotate/').json()
+        for chunk_size in (1, 5, 12, 13):
+            with self.subTest(chunk_size=chunk_size), \
+                    mock.patch.object(views.BookAnnotateView, 'stream_chunk_size', chunk_size):
+                response = self.client.get('/books/annotate/?stream=1')
+                self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+
+    def test_empty_list(self):
+        response = self.client.get('/filtered_book_list/?query=ocean&stream=1')
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+
+class SparseFieldsetTests(TestCase):
+    # ?fields= trims the output and the columns the queries read
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def test_only_requested_fields(self):
+        rows = self.client.get('/books/annotate/?fields=id,title').json()
+        self.assertEqual(len(rows), 12)
+        self.assertEqual({tuple(row) for row in rows}, {('id', 'title')})
+        book = Book.objects.first()
+        self.assertEqual(self.client.get(f'/books/{book.pk}/?fields=price').json(),
+                         {'price': str(book.price)})
+
+    def test_nested_selection(self):
+        rows = self.client.get('/books/annotate/?fields=title,author.name').json()
+        self.assertEqual({tuple(row) for row in rows}, {('title', 'author')})
+        self.assertEqual({tuple(row['author']) for row in rows}, {('name',)})
+
+        categories = self.client.get(
+            '/books/many_to_many_relation?fields=name,book_set.title').json()
+        self.assertEqual({tuple(category) for category in categories}, {('name', 'book_set')})
+        self.assertEqual({tuple(book) for category in categories for book in category['book_set']},
+                         {('title',)})
+
+    def test_unknown_fields_are_rejected(self):
+        for fields in ['id,colour', 'author.colour', 'title.name']:
+            with self.subTest(fields=fields):
+                response = self.client.get(f'/books/annotate/?fields={fields}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('fields', response.json())
+
+    def test_only_requested_columns_are_read(self):
+        with self.assertNumQueries(1), CaptureQueriesContext(connections['default']) as queries:
+            self.client.get('/books/annotate/?fields=id,title')
+        sql = queries[0]['sql']
+        self.assertIn('"title"', sql)
+        for column in ['"price"', '"publication_date"', '"author_name"']:
+            self.assertNotIn(column, sql)
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.client.get('/books/many_to_many_relation?fields=name,book_set.title')
+        book_query = next(query['sql'] for query in queries
+                          if 'FROM "presentation_book"' in query['sql'])
+        self.assertNotIn('"price"', book_query)
+
+
+class GenerationCacheTests(TestCase):
+    # A write bumps its model's generation, so the next read of a page
+    # keyed on it misses; pages not keyed on that model keep their entries
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def setUp(self):
+        cache.clear()
+
+    def generations(self):
+        return {model: caching.generation(model) for model in caching.CACHED_MODELS}
+
+    def assertCounted(self, url, counter):
+        before = caching.counters()[counter]
+        response = self.client.get(url)
+        self.assertEqual(caching.counters()[counter], before + 1, counter)
+        return response
+
+    def test_writes_make_the_next_read_miss(self):
+        self.assertCounted('/books/with_cache', 'misses')
+        self.assertCounted('/books/with_cache', 'hits')
+
+        generations = self.generations()
+        book = Book.objects.first()
+        book.title = 'Rewritten'
+        book.save()
+        self.assertEqual({model for model, value in self.generations().items()
+                          if value != generations[model]}, {Book})
+        response = self.assertCounted('/books/with_cache', 'misses')
+        self.assertIn('Rewritten', [row['title'] for row in response.json()])
+
+        self.client.get('/books/fragment_cached_book_list')
+        Author.objects.filter(pk=book.author_id).first().save()
+        self.assertContains(self.client.get('/books/fragment_cached_book_list'), 'Rewritten')
+        self.assertCounted('/books/with_cache', 'misses')
+
+    def test_unrelated_writes_keep_entries(self):
+        calls = []
+
+        @caching.generational_cache_page(60, models=(Book,))
+        def view(request):
+            calls.append(1)
+            return HttpResponse('books')
+
+        request = RequestFactory().get('/books-only')
+        view(request)
+        Category.objects.create(name='Travel')
+        view(request)
+        self.assertEqual(len(calls), 1)
+
+        # Models outside CACHED_MODELS bump nothing
+        self.assertCounted('/books/with_cache', 'misses')
+        generations = self.generations()
+        AuthorProfile.objects.first().save()
+        price_updates.create_job(multiplier='1.1')
+        self.assertEqual(self.generations(), generations)
+        self.assertCounted('/books/with_cache', 'hits')
+
+
+class PageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_entries_from_before_versioning_are_ignored(self):
+        # A bare response as cached before entries carried their timings
+        request = RequestFactory().get('/books/with_cache')
+        cache.set('presentation:page:' + caching.vary_key(request, caching.CACHED_MODELS, ''),
+                  HttpResponse('stale'))
+        for _ in range(2):
+            response = self.client.get('/books/with_cache')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), 12)
+
+
+class RendererTests(TestCase):
+    # MessagePack and columnar bodies decode to the JSON renderer's data,
+    # compressed as Accept-Encoding asks
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def get(self, url, accept='application/json', encoding=''):
+        return self.client.get(url, headers={'accept': accept, 'accept-encoding': encoding})
+
+    def test_msgpack_round_trip(self):
+        for url in ['/books/annotate/', f'/books/{Book.objects.first().pk}/',
+                    '/books/limitoffset_pagination_view?limit=5']:
+            with self.subTest(url=url):
+                response = self.get(url, 'application/msgpack')
+                self.assertEqual(response['Content-Type'], 'application/msgpack')
+                self.assertEqual(msgpack.unpackb(response.content), self.get(url).json())
+
+    def test_columnar_round_trip(self):
+        response = self.get('/books/annotate/', 'application/vnd.columnar+json')
+        payload = response.json()
+        self.assertEqual(len(payload['dictionaries']['author']), 3)
+        self.assertEqual(rows_from_columnar(payload), self.get('/books/annotate/').json())
+        paginated = self.get('/books/limitoffset_pagination_view?limit=5',
+                             'application/vnd.columnar+json').json()
+        self.assertEqual(rows_from_columnar(paginated['results']),
+                         self.get('/books/limitoffset_pagination_view?limit=5').json()['results'])
+
+    def test_columnar_nested_values(self):
+        rows = [{'id': 1, 'author': {'name': 'A', 'tags': ['x']}},
+                {'id': 2, 'author': {'tags': ['x'], 'name': 'A'}},
+                {'id': 3, 'author': {'name': 'B', 'tags': [{'y': 1}]}},
+                {'id': 4, 'author': None}]
+        payload = columnar(rows)
+        self.assertEqual(payload['columns']['author'], [0, 0, 1, None])
+        self.assertEqual(rows_from_columnar(payload), rows)
+
+    def test_compression_is_negotiated(self):
+        plain = self.get('/books/annotate/')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        for header, encoding, decompress in [
+                ('gzip, br', 'br', brotli.decompress),
+                ('br;q=0.5, gzip', 'gzip', gzip.decompress),
+                ('br;q=0, *', 'gzip', gzip.decompress)]:
+            with self.subTest(header=header):
+                response = self.get('/books/annotate/', encoding=header)
+                self.assertEqual(response['Content-Encoding'], encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(decompress(response.content), plain.content)
+        self.assertFalse(self.get('/books/annotate/', encoding='identity').has_header(
+            'Content-Encoding'))
+
+
+class BookExportTests(TestCase):
+    # CSV and NDJSON downloads of the whole catalogue
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+        cls.tricky = Book.objects.create(
+            title='Commas, "quotes"\nand a second line', author=Author.objects.first(),
+            publication_date=date(2001, 1, 1), price=Decimal('5.00'))
+        cls.tricky.categories.set(Category.objects.all())
+
+    def download(self, query=''):
+        response = self.client.get(f'/books/export{query}')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, body = self.download()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.csv"')
+        rows = list(csv.DictReader(io.StringIO(body.decode(), newline='')))
+        self.assertEqual(list(rows[0]), export.FIELDS)
+        self.assertEqual(len(rows), Book.objects.count())
+        self.assertEqual([int(row['id']) for row in rows],
+                         list(Book.objects.order_by('id').values_list('id', flat=True)))
+        tricky = rows[-1]
+        self.assertEqual(tricky['title'], self.tricky.title)
+        self.assertEqual(tricky['categories'], 'Poetry|Crime')
+        self.assertEqual(tricky['author'], 'Author 0')
+        self.assertEqual(tricky['publishing_house'], 'House 0')
+
+    def test_ndjson(self):
+        response, body = self.download('?format=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.ndjson"')
+        lines = body.decode().splitlines()
+        self.assertEqual(len(lines), Book.objects.count())
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(rows[-1], {
+            'id': self.tricky.pk, 'title': self.tricky.title, 'author': 'Author 0',
+            'publishing_house': 'House 0', 'categories': ['Poetry', 'Crime'],
+            'publication_date': '2001-01-01', 'price': '5.00'})
+
+    def test_format_negotiation(self):
+        _, csv_body = self.download('?format=csv')
+        self.assertEqual(csv_body, self.download()[1])
+        response, body = self.download('?format=ndjson&gzip=1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="books.ndjson.gz"')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(gzip.decompress(body), self.download('?format=ndjson')[1])
+
+        response = self.client.get('/books/export?format=xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('format', response.json())
+
+    def test_chunk_sizes_do_not_change_the_output(self):
+        for output_format in export.FORMATS:
+            with self.subTest(output_format=output_format):
+                self.assertEqual(b''.join(export.export(output_format, chunk_size=5)),
+                                 b''.join(export.export(output_format)))
+
+
+class CoalescingTests(SimpleTestCase):
+    # Identical reads in flight run the view once; cached pages are
+    # refreshed by one request ahead of their expiry
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_run_the_view_once(self):
+        calls, release = [], threading.Event()
+
+        def view():
+            calls.append(1)
+            release.wait(5)
+            response = HttpResponse(f'body {len(calls)}')
+            response['X-Leader'] = 'yes'
+            return response
+
+        def get(results):
+            request = RequestFactory().get('/books/with_cache')
+            results.append(coalescing.coalesced(request, view))
+
+        results = []
+        threads = [threading.Thread(target=get, args=(results,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        # Followers find the leader's flight and wait on it
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({response.content for response in results}, {b'body 1'})
+        self.assertEqual({response['X-Leader'] for response in results}, {'yes'})
+        # Every waiting request gets a response of its own
+        self.assertEqual(len({id(response) for response in results}), 4)
+
+    def test_followers_share_the_leaders_error(self):
+        flights, release = coalescing.SingleFlight(), threading.Event()
+        errors = []
+
+        def fail():
+            release.wait(5)
+            raise ValueError('boom')
+
+        def call():
+            try:
+                flights.do('key', fail)
+            except ValueError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(len({id(error) for error in errors}), 1)
+        self.assertEqual(flights.flights, {})
+
+    def test_early_refresh(self):
+        self.assertTrue(caching.refresh_early(0.5, time.time() - 1))
+        self.assertFalse(caching.refresh_early(0.001, time.time() + 3600))
+        self.assertFalse(caching.refresh_early(10, time.time() + 1, beta=0))
+
+        calls = []
+
+        @caching.generational_cache_page(60)
+        def view(request):
+            calls.append(1)
+            return HttpResponse(f'body {len(calls)}')
+
+        request = RequestFactory().get('/page')
+        self.assertEqual(view(request).content, b'body 1')
+        self.assertEqual(view(request).content, b'body 1')
+        # An entry at its expiry is recomputed while still in the cache
+        key = 'presentation:page:v2:' + caching.vary_key(request, caching.CACHED_MODELS, '')
+        response, delta, _ = cache.get(key)
+        cache.set(key, (response, delta, time.time()), None)
+        before = caching.counters()['early_refreshes']
+        self.assertEqual(view(request).content, b'body 2')
+        self.assertEqual(caching.counters()['early_refreshes'], before + 1)
+        self.assertEqual(view(request).content, b'body 2')
+        self.assertEqual(len(calls), 2)
+
+
+class RowFragmentTests(TestCase):
+    # An edit re-renders the edited book's row only
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_edit_refreshes_one_row(self):
+        self.client.get('/books/fragment_cached_book_list')
+        books = list(Book.objects.order_by('id'))
+        # Stand-ins in the cache show which rows are served from it
+        for book in books:
+            key = caching.row_cache_key('book_row.html', book)
+            self.assertIsNotNone(cache.get(key))
+            cache.set(key, f'<tr><td>cached {book.pk}</td></tr>')
+
+        edited = books[3]
+        edited.title = 'Edited title'
+        edited.save()
+        response = self.client.get('/books/fragment_cached_book_list')
+        self.assertContains(response, 'Edited title')
+        self.assertNotContains(response, f'cached {edited.pk}<')
+        for book in books:
+            if book != edited:
+                self.assertContains(response, f'cached {book.pk}<')
+        edited.refresh_from_db()
+        self.assertIn('Edited title', cache.get(caching.row_cache_key('book_row.html', edited)))
+
+    def test_author_rename_refreshes_its_rows(self):
+        self.client.get('/books/keyset_pagination_based_on_template')
+        books = list(Book.objects.order_by('id')[:2])
+        for book in books:
+            cache.set(caching.row_cache_key('book_row.html', book), f'<tr>cached {book.pk}</tr>')
+        Author.objects.filter(pk=books[0].author_id).update(name='Renamed author')
+        response = self.client.get('/books/keyset_pagination_based_on_template')
+        self.assertContains(response, 'Renamed author', count=2)
+        self.assertNotContains(response, 'cached')
+
+
+class KeysetPaginationTests(TestCase):
+    # Cursor pages cover every row exactly once in both directions
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+        # Ties on publication_date, broken by id
+        Book.objects.filter(author__name='Author 1').update(publication_date=date(2001, 1, 1))
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url, link='next'):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pages.append([book['id'] for book in data['results']])
+            url = data[link]
+        return pages
+
+    def test_pages_follow_the_ordering(self):
+        for url, ordering in [('/books/keyset_pagination_view', ('id',)),
+                              ('/books/keyset_pagination_by_date_view', ('publication_date', 'id')),
+                              ('/async/books/keyset_pagination_view', ('id',)),
+                              ('/async/books/keyset_pagination_by_date_view',
+                               ('publication_date', 'id'))]:
+            with self.subTest(url=url):
+                expected = list(Book.objects.order_by(*ordering).values_list('id', flat=True))
+                pages = self.walk(url)
+                self.assertEqual([pk for page in pages for pk in page], expected)
+                self.assertTrue(all(len(page) == 2 for page in pages))
+
+    def test_previous_links_walk_back(self):
+        url = '/books/keyset_pagination_by_date_view'
+        forward = self.walk(url)
+        last = self.client.get(url)
+        while last.json()['next']:
+            last = self.client.get(last.json()['next'])
+        self.assertIsNone(self.client.get(url).json()['previous'])
+        backward = self.walk(last.json()['previous'], link='previous')
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_edits_between_pages_neither_repeat_nor_skip_rows(self):
+        first = self.client.get('/books/keyset_pagination_view').json()
+        Book.objects.create(title='Early book', author=Author.objects.first(),
+                            publication_date=date(1990, 1, 1), price=Decimal('5.00'))
+        Book.objects.filter(pk=first['results'][0]['id']).delete()
+        seen = [book['id'] for book in first['results']]
+        pages = self.walk(first['next'])
+        seen += [pk for page in pages for pk in page]
+        self.assertEqual(len(seen), len(set(seen)))
+        remaining = Book.objects.order_by('id').values_list('id', flat=True)
+        self.assertEqual(seen[2:], list(remaining)[1:])
+
+    def test_tampered_cursors(self):
+        cursor = pagination.encode_cursor([Book.objects.order_by('id')[1].pk])
+        forged = signing.dumps({'p': [0], 'r': False}, salt='another salt', compress=True)
+        for bad in (cursor[:-2] + ('AA' if cursor[-2:] != 'AA' else 'BB'), forged, 'garbage'):
+            with self.subTest(cursor=bad):
+                response = self.client.get('/books/keyset_pagination_view', {'cursor': bad})
+                self.assertEqual(response.status_code, 404)
+                # The template page falls back to the first page instead
+                response = self.client.get('/books/keyset_pagination_based_on_template',
+                                           {'cursor': bad})
+                self.assertContains(response, Book.objects.order_by('id')[0].title)
+
+    def test_paginator_pages_values_rows(self):
+        queryset = Book.objects.values('id', 'publication_date')
+        paginator = pagination.KeysetPaginator(queryset, 5, ('-publication_date', 'id'))
+        page = paginator.page()
+        ids = [row['id'] for row in page]
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            ids += [row['id'] for row in page]
+        self.assertEqual(ids, list(queryset.order_by('-publication_date', 'id')
+                                   .values_list('id', flat=True)))
+        self.assertFalse(paginator.page().has_previous())
+
+
+class TemplatePaginationTests(TestCase):
+    # The template pages say whether their count is exact, as the JSON does
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_exact_count(self):
+        response = self.client.get('/books/pagination_based_on_template?page=2')
+        self.assertContains(response, 'data-count-exact="true"')
+        self.assertContains(response, '12 books')
+        self.assertNotContains(response, 'About')
+
+    @override_settings(APPROXIMATE_COUNT_THRESHOLD=1)
+    def test_estimated_count(self):
+        with connections['default'].cursor() as cursor:
+            cursor.execute('ANALYZE')
+        response = self.client.get('/books/pagination_based_on_template?page=2')
+        self.assertContains(response, 'data-count-exact="false"')
+        self.assertContains(response, 'About 12 books')
+
+    def test_keyset_pages_have_no_count(self):
+        response = self.client.get('/books/keyset_pagination_based_on_template')
+        self.assertNotContains(response, 'data-count-exact')
+
+
+class PriceUpdateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def test_invalid_jobs_are_rejected(self):
+        for data in [{'multiplier': '1.1', 'batch_size': 0},
+                     {'multiplier': '1.1', 'sleep': 'x'},
+                     {'multiplier': '1.1', 'sleep': -1}]:
+            with self.subTest(data=data):
+                response = self.client.post('/books/price_update_jobs', data,
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_runners_apply_each_batch_once(self):
+        prices = dict(Book.objects.values_list('id', 'price'))
+        job = price_updates.create_job(multiplier='2', batch_size=5)
+        first = price_updates.PriceUpdateRunner(job)
+        second = price_updates.PriceUpdateRunner(PriceUpdateJob.objects.get(pk=job.pk))
+        first.run_batch()
+        second.run()
+        first.run()
+        for book_id, price in Book.objects.values_list('id', 'price'):
+            self.assertEqual(price, prices[book_id] * 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PriceUpdateJob.DONE)
+        self.assertEqual(job.rows_updated, len(prices))
+
+    def test_jobs_are_queued_for_a_worker(self):
+        prices = dict(Book.objects.values_list('id', 'price'))
+        response = self.client.post('/books/price_update_jobs',
+                                    {'multiplier': '2', 'batch_size': 5},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        price_job = PriceUpdateJob.objects.get(pk=response.data['price_update_job'])
+        self.assertEqual(price_job.status, PriceUpdateJob.PENDING)
+
+        # A resume of a job still queued is the same background job
+        resumed = self.client.post(f'/books/price_update_jobs/{price_job.pk}')
+        self.assertEqual(resumed.status_code, 202)
+        jobs.run(jobs.claim('worker'))
+        price_job.refresh_from_db()
+        self.assertEqual(price_job.status, PriceUpdateJob.DONE)
+        self.assertEqual(dict(Book.objects.values_list('id', 'price')),
+                         {book_id: price * 2 for book_id, price in prices.items()})
+        self.assertEqual(self.client.post(f'/books/price_update_jobs/{price_job.pk}').status_code,
+                         200)
+
+    def test_expired_lease_rolls_the_batch_back(self):
+        prices = dict(Book.objects.values_list('id', 'price'))
+        price_job = price_updates.create_job(multiplier='2', batch_size=5)
+        jobs.enqueue('price_update', {'price_job': price_job.pk})
+        slow = jobs.claim('slow')
+        # The slow worker stops reporting and another one takes the job over
+        BackgroundJob.objects.filter(pk=slow.pk).update(
+            locked_at=timezone.now() - timedelta(seconds=settings.JOB_LEASE_SECONDS + 1))
+        jobs.release_expired()
+        fast = jobs.claim('fast')
+
+        with self.assertLogs('presentation', 'WARNING'):
+            jobs.run(slow)
+        price_job.refresh_from_db()
+        self.assertEqual((price_job.status, price_job.last_id), (PriceUpdateJob.RUNNING, 0))
+        self.assertEqual(dict(Book.objects.values_list('id', 'price')), prices)
+
+        jobs.run(fast)
+        price_job.refresh_from_db()
+        self.assertEqual(price_job.status, PriceUpdateJob.DONE)
+        self.assertEqual(price_job.rows_updated, len(prices))
+        self.assertEqual(BackgroundJob.objects.get(pk=fast.pk).status, BackgroundJob.DONE)
+
+    def test_worker_batches_invalidate_the_web_caches(self):
+        def prices():
+            return {book['id']: Decimal(book['price'])
+                    for book in self.client.get('/books/with_cache').json()}
+
+        cache.clear()
+        before = prices()
+        price_job = price_updates.create_job(multiplier='2', batch_size=5)
+        jobs.enqueue('price_update', {'price_job': price_job.pk})
+        # The run_jobs worker is another process, with a local cache of its own
+        worker_caches = {**settings.CACHES, 'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker'}}
+        with override_settings(CACHES=worker_caches):
+            price_updates.PriceUpdateRunner(price_job).run_batch()
+        first_batch = sorted(before)[:5]
+        self.assertEqual(prices(), {book_id: price * 2 if book_id in first_batch else price
+                                    for book_id, price in before.items()})
+
+        with override_settings(CACHES=worker_caches):
+            jobs.run(jobs.claim('worker'))
+        self.assertEqual(prices(), {book_id: price * 2 for book_id, price in before.items()})
+
+
+class BookBulkCreateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [Category.objects.create(name=name).pk for name in ('Poetry', 'Crime')]
+
+    def row(self, index):
+        return {'title': f'Bulk {index}', 'author': {'name': f'Bulk author {index % 3}'},
+                'publication_date': '2001-01-01', 'price': '5.00',
+                'categories': self.categories}
+
+    def test_non_list_bodies_are_rejected(self):
+        for body in [5, 'books', None, {'title': 'Bulk'}]:
+            with self.subTest(body=body):
+                response = self.client.post('/books/bulk_create/', json.dumps(body),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_links_go_in_batches(self):
+        # More category links than SQLite takes parameters in one INSERT
+        rows = [self.row(index) for index in range(600)]
+        response = self.client.post('/books/bulk_create/', rows, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 600)
+        self.assertEqual(Book.categories.through.objects.count(), 1200)
+
+    def test_ndjson_rows(self):
+        body = '\n'.join(json.dumps(self.row(index)) for index in range(3))
+        response = self.client.post('/books/bulk_create/', body,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+
+
+class AsyncRequestTests(TestCase):
+    # Under ASGI the middleware stays async and the async views negotiate
+    # their renderer like DRF's
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def test_middleware_is_async_capable(self):
+        async def get_response(request):
+            pass
+
+        for middleware in [RequestMetricsMiddleware, SlowQueryViewMiddleware,
+                           CompressionMiddleware, ReplicaPinMiddleware]:
+            with self.subTest(middleware=middleware.__name__):
+                self.assertTrue(iscoroutinefunction(middleware(get_response)))
+                self.assertFalse(iscoroutinefunction(middleware(lambda request: None)))
+
+    async def test_async_requests_are_measured_and_compressed(self):
+        metrics.registry.reset()
+        response = await self.async_client.get('/async/books/annotate/',
+                                               headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        histograms = metrics.registry.histograms['async/books/annotate/', 'GET']
+        self.assertEqual(histograms['request_duration_seconds'].count, 1)
+        self.assertGreater(histograms['request_db_queries'].total, 0)
+
+    async def test_renderer_is_negotiated(self):
+        url = '/async/books/limitoffset_pagination_view?limit=5'
+        data = (await self.async_client.get(url)).json()
+        response = await self.async_client.get(url, headers={'accept': 'application/msgpack'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), data)
+        response = await self.async_client.get(url + '&format=msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['results'], data['results'])
+
+        response = await self.async_client.get(url, headers={'accept': 'text/csv'})
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+@override_settings(DATABASE_REPLICAS={'default': {'replica1': 1, 'replica2': 1}},
+                   REPLICA_SELECTION='weighted')
+class ReplicaRoutingTests(ExtraDatabasesMixin, TransactionTestCase):
+    # Every database holds one category named after its alias, which tells
+    # where a read went. Outside TestCase's transaction, as reads in an
+    # atomic block stay on the primary.
+    extra_databases = ('replica1', 'replica2')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Registered after the test databases, its connection fails like a
+        # replica that went away
+        add_sqlite_database('broken', os.path.join(cls.database_dir, 'missing', 'broken.sqlite3'))
+
+    @classmethod
+    def tearDownClass(cls):
+        remove_database('broken')
+        super().tearDownClass()
+
+    def setUp(self):
+        replicas.health.reset()
+        replicas.selector.last_used.clear()
+        for alias in self.databases:
+            Category.objects.using(alias).create(name=alias)
+
+    @staticmethod
+    def read():
+        return Category.objects.order_by('id').first().name
+
+    def reads(self, count):
+        with replicas.pinning_scope():
+            return [self.read() for _ in range(count)]
+
+    def test_weighted_selection(self):
+        random.seed(0)
+        with override_settings(DATABASE_REPLICAS={'default': {'replica1': 3, 'replica2': 1}}):
+            counts = Counter(self.reads(400))
+        self.assertEqual(set(counts), {'replica1', 'replica2'})
+        self.assertGreater(counts['replica1'], 2 * counts['replica2'])
+
+        with override_settings(DATABASE_REPLICAS={'default': {'replica1': 1, 'replica2': 0}}):
+            self.assertEqual(set(self.reads(20)), {'replica1'})
+
+    @override_settings(REPLICA_SELECTION='lru')
+    def test_lru_selection(self):
+        self.assertEqual(self.reads(4), ['replica1', 'replica2', 'replica1', 'replica2'])
+
+    def test_failed_replica_is_skipped(self):
+        with override_settings(DATABASE_REPLICAS={'default': {'broken': 5, 'replica1': 1}}), \
+                self.assertLogs('routers.replicas', 'WARNING'):
+            self.assertEqual(set(self.reads(20)), {'replica1'})
+            self.assertIn('broken', replicas.health.down_until)
+        with override_settings(DATABASE_REPLICAS={'default': {'broken': 1}}):
+            self.assertEqual(self.reads(1), ['default'])
+
+    def test_writes_pin_reads_to_the_primary(self):
+        with replicas.pinning_scope() as state:
+            self.assertNotEqual(self.read(), 'default')
+            Category.objects.create(name='written')
+            self.assertTrue(state.wrote)
+            self.assertEqual(self.read(), 'default')
+
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            with replicas.pinning_scope():
+                Category.objects.create(name='written')
+                self.assertNotEqual(self.read(), 'default')
+
+    def test_pin_cookie_keeps_the_client_on_the_primary(self):
+        response = self.client.post('/books/annotate/', {
+            'title': 'Pinned', 'author': {'name': 'Pinned author'},
+            'publication_date': '2001-01-01', 'price': '5.00',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        cookie = response.cookies[ReplicaPinMiddleware.cookie_name]
+        self.assertTrue(cookie.value.startswith('default:'))
+        self.assertTrue(cookie['httponly'])
+
+        # The book is on the primary only
+        self.assertEqual(len(self.client.get('/books/annotate/').json()), 1)
+        self.assertEqual(self.client_class().get('/books/annotate/').json(), [])
+        self.client.cookies[ReplicaPinMiddleware.cookie_name] = 'default:0'
+        self.assertEqual(self.client.get('/books/annotate/').json(), [])
+
+
+@override_settings(BOOK_SHARDS=['default', 'shard1', 'shard2'])
+class ShardingTests(ExtraDatabasesMixin, TransactionTestCase):
+    # Books spread over three SQLite shards by author; what scatter-gather
+    # returns is checked against the rows read from every shard directly
+    extra_databases = ('shard1', 'shard2')
+
+    def setUp(self):
+        cache.clear()
+        create_catalogue(authors=6, books_per_author=5)
+
+    def all_books(self, *fields):
+        return [row for alias in self.databases
+                for row in Book.objects.using(alias).values(*fields)]
+
+    def test_books_are_spread_with_unique_ids(self):
+        BookIngest().ingest([
+            {'title': f'Ingested {index}', 'author': {'name': f'Author {index}'},
+             'publication_date': '2001-01-01', 'price': '5.00'}
+            for index in range(6)
+        ])
+        for alias in self.databases:
+            self.assertTrue(Book.objects.using(alias).exists(), alias)
+            # Every shard keeps a full copy of the reference rows
+            self.assertEqual(Author.objects.using(alias).count(), 6)
+        ids = [row['id'] for row in self.all_books('id')]
+        self.assertEqual(len(ids), 36)
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ShardSequence.objects.get(name='presentation.book').last_value, max(ids))
+
+    def test_merged_ordering_and_slices(self):
+        books = self.all_books('id', 'publication_date', 'price')
+        for ordering, key in [
+            (['id'], lambda row: row['id']),
+            (['publication_date', 'id'], lambda row: (row['publication_date'], row['id'])),
+            (['-price', 'id'], lambda row: (-row['price'], row['id'])),
+        ]:
+            with self.subTest(ordering=ordering):
+                expected = [row['id'] for row in sorted(books, key=key)]
+                queryset = sharding.sharded(Book.objects.order_by(*ordering))
+                self.assertEqual([book.id for book in queryset], expected)
+                self.assertEqual([row['id'] for row in queryset.values('id')[3:9]], expected[3:9])
+                self.assertEqual(queryset[10].id, expected[10])
+                self.assertEqual([book.id for book in queryset.iterator(chunk_size=4)], expected)
+
+        expected = sorted(row['id'] for row in books)[5:10]
+        response = self.client.get('/books/limitoffset_pagination_view?limit=5&offset=5')
+        self.assertEqual([book['id'] for book in response.json()['results']], expected)
+
+    def test_counts_and_aggregates(self):
+        books = self.all_books('id', 'price')
+        prices = [row['price'] for row in books]
+        queryset = sharding.sharded(Book.objects.all())
+        self.assertEqual(queryset.count(), len(books))
+        self.assertEqual(queryset[5:12].count(), 7)
+        self.assertEqual(sharding.sharded(Book.objects.filter(price__gte=12)).count(),
+                         sum(price >= 12 for price in prices))
+        self.assertTrue(sharding.sharded(Book.objects.filter(price=prices[-1])).exists())
+        self.assertEqual(queryset.aggregate(
+            count=Count('id'), total=Sum('price'), low=Min('price'), high=Max('price'),
+            average=Avg('price'),
+        ), {
+            'count': len(prices), 'total': sum(prices), 'low': min(prices),
+            'high': max(prices), 'average': sum(prices) / len(prices),
+        })
+        with self.assertRaises(sharding.NotMergeable):
+            queryset.aggregate(Count('author', distinct=True))
+
+    def test_price_update_writes_every_shard(self):
+        prices = {row['id']: row['price'] for row in self.all_books('id', 'price')}
+        job = price_updates.create_job(multiplier='2', batch_size=7)
+        price_updates.PriceUpdateRunner(job).run()
+        self.assertEqual(job.rows_updated, len(prices))
+        for row in self.all_books('id', 'price'):
+            self.assertEqual(row['price'], prices[row['id']] * 2)
+
+
+class RequestMetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+
+    def test_serializer_and_template_time(self):
+        self.client.get('/books/annotate/')
+        self.client.get('/books/pagination_based_on_template?page=2')
+        histograms = metrics.registry.histograms
+        self.assertGreater(
+            histograms['books/annotate/', 'GET']['request_serializer_seconds'].total, 0)
+        self.assertGreater(histograms['books/pagination_based_on_template', 'GET'][
+            'request_template_seconds'].total, 0)
+
+    def test_library_classes_are_left_alone(self):
+        self.assertEqual(BaseSerializer.data.fget.__module__, 'rest_framework.serializers')
+        self.assertEqual(Template.render.__module__, 'django.template.backends.django')
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+class SlowQueryLogTests(TestCase):
+    # With a zero threshold every query is logged with its view and plan
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue()
+
+    def setUp(self):
+        cache.clear()
+
+    def logged(self, run):
+        with self.assertLogs('presentation.slow_queries', 'WARNING') as logs:
+            run()
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_normalize(self):
+        self.assertEqual(
+            slow_queries.normalize("SELECT * FROM book WHERE id IN (%s, %s, %s) "
+                                   "AND title = 'it''s'  LIMIT 21"),
+            'SELECT * FROM book WHERE id IN (...) AND title = ? LIMIT ?')
+        self.assertEqual(slow_queries.normalize('SELECT 1 WHERE id IN (%s)'),
+                         slow_queries.normalize('SELECT 2 WHERE id IN (%s, %s)'))
+
+    def test_entries_carry_the_view_and_plan(self):
+        entries = self.logged(lambda: self.client.get('/books/keyset_pagination_view'))
+        books = [entry for entry in entries if 'presentation_book' in entry['sql']]
+        self.assertTrue(books)
+        for entry in books:
+            self.assertEqual(entry['view'], 'presentation.views.KeysetPaginationView')
+            self.assertEqual(entry['alias'], 'default')
+            self.assertEqual(entry['fingerprint'], slow_queries.fingerprint(entry['normalized']))
+            self.assertIn('presentation_book', entry['plan'])
+
+    def test_streamed_queries_are_tagged(self):
+        def download():
+            response = self.client.get('/books/export')
+            b''.join(response.streaming_content)
+
+        entries = [entry for entry in self.logged(download)
+                   if 'presentation_book' in entry['sql']]
+        self.assertTrue(entries)
+        self.assertEqual({entry['view'] for entry in entries},
+                         {'presentation.views.BookExportView'})
+
+    def test_queries_outside_views_are_untagged(self):
+        entries = self.logged(lambda: list(Book.objects.all()))
+        self.assertEqual([entry['view'] for entry in entries], [None])
+
+    def test_failed_explain_leaves_the_transaction_usable(self):
+        plan = slow_queries.explain(connections['default'], 'SELECT * FROM missing_table', ())
+        self.assertTrue(plan.startswith('EXPLAIN failed'))
+        self.assertEqual(Book.objects.count(), 12)
+
+    def test_explain_is_not_counted(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            entries = self.logged(lambda: Book.objects.filter(pk__in=[1, 2]).count())
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(entries), 1)
+        self.assertIn('presentation_book', entries[0]['plan'])
+
+    def test_command_ranks_rotated_logs(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log = os.path.join(directory, 'slow.log')
+
+        def entry(sql, duration_ms, view):
+            normalized = slow_queries.normalize(sql)
+            return json.dumps({
+                'fingerprint': slow_queries.fingerprint(normalized), 'normalized': normalized,
+                'duration_ms': duration_ms, 'view': view, 'sql': sql, 'plan': 'SCAN book',
+            })
+
+        with open(log + '.1', 'w') as backup:
+            backup.write(entry('SELECT 1 FROM book', 300, 'views.A') + '\nnot json\n')
+        with open(log, 'w') as current:
+            current.write('\n'.join([entry('SELECT 2 FROM book', 150, 'views.B'),
+                                     entry('SELECT 3 FROM book', 150, 'views.C'),
+                                     entry('SELECT * FROM author', 200, 'views.A')]) + '\n')
+
+        groups = slow_queries.rank(slow_queries.read_entries(Path(log)))
+        self.assertEqual([(group['normalized'], group['count'], group['total_ms'])
+                          for group in groups],
+                         [('SELECT ? FROM book', 3, 600), ('SELECT * FROM author', 1, 200)])
+        self.assertEqual(groups[0]['views'], {'views.A', 'views.B', 'views.C'})
+
+        out = StringIO()
+        call_command('slow_queries', log=log, view='views.A', plans=True, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('total      300.0ms', lines[0])
+        self.assertIn('SCAN book', out.getvalue())
+        self.assertEqual(len([line for line in lines if ' runs ' in line]), 2)
+
+
+class IndexAdvisorTests(TransactionTestCase):
+    # Candidates are tried on a scratch copy, never on the database itself;
+    # committed rows, SQLite cannot back up a connection mid-transaction
+
+    def setUp(self):
+        create_catalogue()
+        author = Author.objects.first()
+        Book.objects.bulk_create(
+            Book(title=f'Bulk book {number}', author=author, price=Decimal('1.00'),
+                 publication_date=date(2010, 1, 1) + timedelta(days=number))
+            for number in range(3000))
+
+    def scratch(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        db = index_advisor.scratch_copy('default', os.path.join(directory, 'scratch.sqlite3'))
+        self.addCleanup(db.close)
+        return db
+
+    def title_workload(self, runs=20):
+        workload = index_advisor.Workload()
+        for number in range(runs):
+            workload.capture(lambda: list(Book.objects.filter(title=f'Bulk book {number}')))
+        workload.capture(lambda: Book.objects.filter(pk=1).first())
+        return workload
+
+    def test_workload_groups_reads_by_fingerprint(self):
+        workload = self.title_workload(runs=3)
+        workload.capture(lambda: Book.objects.filter(pk=1).update(price=Decimal('2.00')))
+        self.assertEqual(sorted(query.count for query in workload.queries.values()), [1, 3])
+
+        replayed = index_advisor.Workload()
+        replayed.add_entries(json.loads(json.dumps(entry)) for entry in workload.entries())
+        self.assertEqual({key: query.count for key, query in replayed.queries.items()},
+                         {key: query.count for key, query in workload.queries.items()})
+
+    def test_candidates_skip_existing_indexes(self):
+        workload = index_advisor.Workload()
+        workload.capture(lambda: list(Book.objects.filter(
+            title='River book 0-0', publication_date__gte=date(2001, 1, 1)).order_by('price')))
+        advisor = index_advisor.Advisor(self.scratch(), workload, 'presentation')
+        self.assertEqual({candidate.columns for candidate in advisor.candidates()}, {
+            ('title',), ('price',), ('title', 'publication_date'), ('title', 'price'),
+        })
+
+    def test_advisor_picks_the_index_that_pays_off(self):
+        db = self.scratch()
+        advisor = index_advisor.Advisor(db, self.title_workload(), 'presentation', min_ms=0)
+        result = advisor.run()
+        self.assertEqual([chosen['candidate'] for chosen in result['chosen']],
+                         [index_advisor.Candidate('presentation_book', ('title',))])
+        self.assertIn(('title',), index_advisor.existing_indexes(db, 'presentation_book'))
+        with connections['default'].cursor() as cursor:
+            self.assertNotIn(('title',), index_advisor.existing_indexes(
+                cursor.connection, 'presentation_book'))
+
+    def test_advised_migration(self):
+        chosen = [{'candidate': index_advisor.Candidate('presentation_book', ('title',))}]
+        indexes = list(index_advisor.advised_indexes(chosen, 'presentation'))
+        self.assertEqual([(model, index.fields) for model, index in indexes],
+                         [(Book, ['title'])])
+        writer = index_advisor.build_migration(indexes, 'presentation')
+        self.assertEqual(writer.migration.name, '0014_advised_indexes')
+        self.assertEqual(writer.migration.dependencies,
+                         [('presentation', '0013_synccheckpoint_last_run_at')])
+        self.assertIn("migrations.AddIndex(\n            model_name='book'",
+                      writer.as_string())
+
+    def test_command_reads_a_saved_workload(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log = os.path.join(directory, 'workload.log')
+        with open(log, 'w') as output:
+            for entry in self.title_workload().entries():
+                output.write(json.dumps(entry) + '\n')
+        out = StringIO()
+        call_command('advise_indexes', log=[log], min_ms=0, stdout=out)
+        self.assertIn('presentation_book(title)', out.getvalue())
+        self.assertIn("Book: models.Index(fields=['title']", out.getvalue())
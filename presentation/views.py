@@ -1,149 +1,316 @@
-from django.core.paginator import Paginator
-from django.http import JsonResponse
+from collections.abc import Iterator
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import generics
-from rest_framework.pagination import LimitOffsetPagination
-
-from .models import Book, Author, AuthorProfile, Category, SecondTableBooks
+from rest_framework.exceptions import APIException, NotFound, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models import Book, Author, AuthorProfile, Category, BookStats, PriceUpdateJob, \
+    BackgroundJob
 from .serializers import BookSerializer, AuthorSerializer, OnlyBookSerializer, \
-    AuthorProfileSerializer, \
-    CategorySerializer, Db2BookSerializer
-from django.db.models.functions import Length
+    AnnotatedBookSerializer, AuthorProfileSerializer, \
+    CategorySerializer, PriceUpdateJobSerializer, BackgroundJobSerializer
+from .pagination import KeysetPaginator, KeysetPagination, PublicationDateKeysetPagination, \
+    AsyncLimitOffsetPagination, CountedLimitOffsetPagination, CountedPaginator
+from . import caching, export, jobs, metrics, price_updates, stats as book_stats
+from .caching import generational_cache_page
+from .compiled import get_compiled_serializer
+from .ingest import BookIngest
+from .mixins import CoalescedRequestMixin, CompiledListMixin, OptimizedQueryMixin, \
+    QueryBudgetMixin, StreamingListMixin, optimize_queryset, pagination_fields, sparse_fields
+from .parsers import NDJSONParser
+from .streaming import iter_raw
+from .search import get_search_backend
+from .sharding import QUERYSET_TYPES, sharded
 from rest_framework.response import Response
-from django.db.models import Avg, Count
 from django.db import connection
-from django.db.models import F, Q
 from rest_framework import views, status
-from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
+from django.urls import reverse
+from django.views import View
+
+
+def render_template(request, template_name, context):
+    # render() counted as the request's template time (presentation.metrics),
+    # including the lazy querysets the template evaluates
+    with metrics.stage('template'):
+        return render(request, template_name, context)
 
 
-class BookList(generics.RetrieveAPIView):
+class BookList(OptimizedQueryMixin, generics.RetrieveAPIView):
     # Queryset
+    max_queries = 1
     queryset = Book.objects.all()
     serializer_class = BookSerializer
 
 
-class BookAnnotateView(generics.ListCreateAPIView):
-    # Queryset with annotation
-    queryset = Book.objects.annotate(
-        title_length=Length('title')
-    )
-    serializer_class = BookSerializer
+class BookAnnotateView(StreamingListMixin, CompiledListMixin, OptimizedQueryMixin, generics.ListCreateAPIView):
+    # Queryset with annotation, title_length is now a stored column. Lists
+    # take 1 query, creating a book with a new author 8, or 10 inside an
+    # outer transaction (tests, ATOMIC_REQUESTS) where atomic() adds savepoints.
+    max_queries = 10
+    queryset = Book.objects.all()
+    serializer_class = AnnotatedBookSerializer
+
 
+class BookBulkCreateView(views.APIView):
+    # Bulk creation from a JSON array or an NDJSON stream of books
+    parser_classes = [JSONParser, NDJSONParser]
 
-class BookAggregateView(generics.GenericAPIView):
-    # Queryset with aggregation
+    def post(self, request, *args, **kwargs):
+        rows = request.data
+        # A JSON array, or the rows NDJSONParser yields while reading
+        if not isinstance(rows, (list, Iterator)):
+            raise ParseError('Expected a list of books.')
+        report = BookIngest().ingest(rows)
+        if report['errors'] and not report['created']:
+            return Response(report, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_201_CREATED)
+
+
+class BookAggregateView(CoalescedRequestMixin, OptimizedQueryMixin, generics.GenericAPIView):
+    # Aggregation read from the incrementally maintained BookStats rows
+    max_queries = 2
     queryset = Book.objects.all()
+    group_by_scopes = {'author': BookStats.SCOPE_AUTHOR, 'category': BookStats.SCOPE_CATEGORY}
 
     def get(self, request, *args, **kwargs):
-        aggregate_data = self.queryset.aggregate(average_price=Avg('price'),
-                                                 total_books=Count('id'))
-        return Response(aggregate_data)
+        group_by = request.query_params.get('group_by')
+        grouped = None
+        if group_by in self.group_by_scopes:
+            grouped = book_stats.summary(self.group_by_scopes[group_by])
+        return Response(self.aggregate_data(book_stats.summary(), group_by, grouped))
 
+    @staticmethod
+    def aggregate_data(overall, group_by=None, grouped=None):
+        aggregate_data = {
+            'average_price': overall[0]['average_price'] if overall else None,
+            'total_books': overall[0]['total_books'] if overall else 0,
+        }
+        if grouped is not None:
+            aggregate_data[group_by] = [{group_by: row.pop('key'), **row} for row in grouped]
+        return aggregate_data
 
-class BookSelectRelatedView(generics.ListAPIView):
-    # Queryset with annotation and select_related
-    serializer_class = BookSerializer
+
+class BookSelectRelatedView(StreamingListMixin, CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
+    # Queryset with select_related; title_length and the author's name
+    # are stored on the book, so there is nothing left to join
+    max_queries = 1
+    serializer_class = AnnotatedBookSerializer
 
     def get_queryset(self):
-        return Book.objects.select_related('author').annotate(
-            title_length=Length('title'))
+        return Book.objects.all()
 
 
-class BookPrefetchRelatedView(generics.ListAPIView):
+class BookPrefetchRelatedView(CoalescedRequestMixin, StreamingListMixin, CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
     # Queryset with prefetch_related
+    max_queries = 2
     serializer_class = AuthorSerializer
 
     def get_queryset(self):
         return Author.objects.prefetch_related('book_set')
 
 
-class BookDeferView(generics.ListAPIView):
+class BookDeferView(StreamingListMixin, CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
     # Queryset with Defer
-    serializer_class = BookSerializer
+    max_queries = 1
+    serializer_class = AnnotatedBookSerializer
 
     def get_queryset(self):
-        return Book.objects.defer('publication_date').annotate(
-            title_length=Length('title'))
+        return Book.objects.defer('updated_at')
 
 
-class BookOnlyView(generics.ListAPIView):
+class BookOnlyView(StreamingListMixin, CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
     # Queryset with Only
+    max_queries = 1
     serializer_class = OnlyBookSerializer
 
     def get_queryset(self):
         return Book.objects.only('title', 'price')
 
 
-class BookRawView(generics.ListAPIView):
+class BookRawView(StreamingListMixin, OptimizedQueryMixin, generics.ListAPIView):
     # Queryset with RAW
+    max_queries = 1
     serializer_class = OnlyBookSerializer
+    raw_sql = 'SELECT title, price FROM presentation_book'
 
     def get_queryset(self):
-        raw_sql = 'SELECT title, price FROM presentation_book'
         with connection.cursor() as cursor:
-            cursor.execute(raw_sql)
+            cursor.execute(self.raw_sql)
             results = cursor.fetchall()
             return [
                 Book(title=row[0], price=row[1])
                 for row in results
             ]
 
+    def get_stream_items(self):
+        # Raw rows go straight to the output, no Book instances in between
+        compiled = get_compiled_serializer(self.get_serializer_class())
+        return (compiled.build(row, compiled.nodes)
+                for row in iter_raw(self.raw_sql, chunk_size=self.stream_chunk_size))
 
-class BookExtraView(generics.ListAPIView):
+
+class BookExtraView(StreamingListMixin, OptimizedQueryMixin, generics.ListAPIView):
     # Queryset with Extra
+    max_queries = 1
     serializer_class = OnlyBookSerializer
 
     def get_queryset(self):
         return Book.objects.extra(select={'title': 'title', 'price': 'price'})
 
 
-class UpdateBookPricesView(views.APIView):
-    # Queryset with F Object
+def job_accepted(request, job, message, **extra):
+    # 202 for a queued background job, polled at its status URL
+    status_url = request.build_absolute_uri(reverse('background-job', args=[job.pk]))
+    response = Response({'message': message, 'job': job.pk, 'status': job.status,
+                         'status_url': status_url, **extra},
+                        status=status.HTTP_202_ACCEPTED)
+    response['Location'] = status_url
+    return response
+
+
+class UpdateBookPricesView(QueryBudgetMixin, views.APIView):
+    # Queryset with F Object, applied in primary-key batches by a run_jobs
+    # worker instead of the request
+    max_queries = 3
+    # Left out of the route benchmarks, which only send GETs
+    writes_on_get = True
+
     @staticmethod
     def get(request, *args, **kwargs):
-        Book.objects.update(price=F('price') * 1.1)
-        return Response({"message": "Book prices updated"}, status=status.HTTP_200_OK)
+        price_job = price_updates.create_job(multiplier='1.1')
+        job = jobs.enqueue('price_update', {'price_job': price_job.pk})
+        return job_accepted(request, job, 'Book price update queued',
+                            price_update_job=price_job.pk)
+
+
+class BackgroundJobDetailView(QueryBudgetMixin, generics.RetrieveAPIView):
+    # Status and progress of a queued job, read from the queue's primary
+    max_queries = 1
+    queryset = BackgroundJob.objects.using(jobs.JOBS_ALIAS)
+    serializer_class = BackgroundJobSerializer
+
 
+class PriceUpdateJobListView(QueryBudgetMixin, views.APIView):
+    # Creates a job and queues it for a run_jobs worker, like UpdateBookPricesView
+    max_queries = 3
 
-class FilteredBookListView(generics.ListAPIView):
-    # Queryset with Q Object
+    @staticmethod
+    def post(request, *args, **kwargs):
+        serializer = PriceUpdateJobSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = dict(serializer.validated_data)
+        sleep = data.pop('sleep')
+        price_job = price_updates.create_job(**data)
+        job = jobs.enqueue('price_update', {'price_job': price_job.pk, 'sleep': sleep})
+        return job_accepted(request, job, 'Book price update queued',
+                            price_update_job=price_job.pk)
+
+
+class PriceUpdateJobDetailView(QueryBudgetMixin, generics.RetrieveAPIView):
+    # A resume reads the job, looks for a queued run of it and queues one
+    max_queries = 3
+    queryset = PriceUpdateJob.objects.all()
+    serializer_class = PriceUpdateJobSerializer
+
+    def post(self, request, *args, **kwargs):
+        # Resume a stopped or failed job, a finished one is left untouched
+        price_job = self.get_object()
+        if price_job.status == PriceUpdateJob.DONE:
+            return Response(PriceUpdateJobSerializer(price_job).data)
+        job = jobs.enqueue('price_update', {'price_job': price_job.pk}, coalesce=True)
+        return job_accepted(request, job, 'Book price update resume queued',
+                            price_update_job=price_job.pk)
+
+
+class FilteredBookListView(StreamingListMixin, CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
+    # Ranked, indexed search over title and author name
+    max_queries = 1
     serializer_class = BookSerializer
 
     def get_queryset(self):
         query = self.request.query_params.get('query', '')
-        queryset = Book.objects.filter(
-            Q(title__icontains=query)
-        )
-        return queryset
+        return get_search_backend().search(Book.objects.all(), query)
 
 
-class CachedBookList(generics.ListCreateAPIView):
-    # Queryset with catch used MethodDecorator
+class CachedBookList(CoalescedRequestMixin, CompiledListMixin, OptimizedQueryMixin, generics.ListCreateAPIView):
+    # Queryset with catch used MethodDecorator, invalidated by writes. A
+    # cached list takes no query, creating a book as in BookAnnotateView.
+    max_queries = 10
     queryset = Book.objects.all()
     serializer_class = BookSerializer
 
-    @method_decorator(cache_page(60))
+    @method_decorator(generational_cache_page(60 * 60 * 6))
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
 
-class FragmentCachedBookList(generics.ListCreateAPIView):
-    # A query set with a catch function using fragment capture
+class FragmentCachedBookList(OptimizedQueryMixin, generics.ListCreateAPIView):
+    # A query set with a catch function using fragment capture. Creating a
+    # book takes the queries of BookAnnotateView's.
+    max_queries = 10
     queryset = Book.objects.all()
     serializer_class = BookSerializer
+    # The template reads every column of the books
+    fields_query_param = None
 
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        context = {'book_list': queryset}
-        return render(request, 'book_list.html', context)
+        queryset = self.filter_queryset(self.get_queryset())
+        # Rows are cached one by one inside the page fragment, a write
+        # re-renders the page from the cached rows of the untouched books
+        context = {
+            'book_rows': caching.RowFragments(queryset, timeout=60 * 60 * 6),
+            'cache_timeout': 60 * 60 * 6,
+            'cache_version': caching.vary_key(request),
+        }
+        return render_template(request, 'book_list.html', context)
 
 
-class PaginatorBooksView(generics.ListCreateAPIView):
+class CacheStatsView(QueryBudgetMixin, views.APIView):
+    max_queries = 0
+    @staticmethod
+    def get(request, *args, **kwargs):
+        return Response(caching.counters())
+
+
+class BookExportView(View):
+    # The whole catalogue in one streamed pass, ?format=csv (default) or
+    # ndjson, ?gzip=1 for a .gz download
+    def get(self, request, *args, **kwargs):
+        output_format = request.GET.get('format', 'csv')
+        if output_format not in export.FORMATS:
+            return JsonResponse(
+                {'format': [f"Choose one of {', '.join(export.FORMATS)}."]}, status=400)
+        gzip = request.GET.get('gzip') in ('1', 'true')
+        content_type, extension = export.FORMATS[output_format]
+        filename = f'books.{extension}'
+        if gzip:
+            content_type, filename = 'application/gzip', filename + '.gz'
+        response = StreamingHttpResponse(export.export(output_format, gzip),
+                                         content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class MetricsView(View):
+    # Prometheus scrape endpoint for the RequestMetricsMiddleware histograms
     def get(self, request, *args, **kwargs):
-        queryset = Book.objects.all().order_by('id')
-        paginator = Paginator(queryset, 2)
+        return HttpResponse(metrics.render(),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class PaginatorBooksView(OptimizedQueryMixin, generics.ListCreateAPIView):
+    # Page and count, plus the table estimate while it is not cached
+    max_queries = 3
+    def get(self, request, *args, **kwargs):
+        queryset = sharded(optimize_queryset(Book.objects.all().order_by('id'), BookSerializer()))
+        paginator = CountedPaginator(queryset, 2)
         page = request.GET.get('page')
         items = paginator.get_page(page)
 
@@ -155,73 +322,222 @@ class PaginatorBooksView(generics.ListCreateAPIView):
             'has_next': items.has_next(),
             'has_previous': items.has_previous(),
             'num_pages': paginator.num_pages,
+            'count_exact': paginator.count_exact,
         }
 
         return JsonResponse(response_data)
 
 
-class PaginationBasedOnTemplate(generics.ListAPIView):
+class PaginationBasedOnTemplate(OptimizedQueryMixin, generics.ListAPIView):
+    # Page and count, plus the table estimate while it is not cached
+    max_queries = 3
     queryset = Book.objects.all()
     serializer_class = BookSerializer
+    fields_query_param = None
 
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset().order_by('id')
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
 
-        paginator = Paginator(queryset, 2)
+        paginator = CountedPaginator(queryset, 2)
         page = request.GET.get('page')
         books = paginator.get_page(page)
 
-        context = {'book_list': books}
-        return render(request, 'book_list_2.html', context)
+        # An estimated count (count_exact False) is shown as approximate
+        context = {'book_list': books, 'book_rows': caching.RowFragments(books),
+                   'count': paginator.count, 'count_exact': paginator.count_exact}
+        return render_template(request, 'book_list_2.html', context)
 
 
-class LimitOffsetPaginationView(generics.ListAPIView):
+class LimitOffsetPaginationView(CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
+    # Page and count, plus the table estimate while it is not cached
+    max_queries = 3
     serializer_class = BookSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = CountedLimitOffsetPagination
     queryset = Book.objects.all()
 
 
-class CustomLimitOffsetPagination(LimitOffsetPagination):
+class CustomLimitOffsetPagination(CountedLimitOffsetPagination):
     default_limit = 2
 
 
-class CustomLimitOffsetPaginationView(generics.ListAPIView):
+class CustomLimitOffsetPaginationView(CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
+    # Page and count, plus the table estimate while it is not cached
+    max_queries = 3
     serializer_class = BookSerializer
     pagination_class = CustomLimitOffsetPagination
     queryset = Book.objects.all()
 
 
-class OneToOneRelationView(generics.ListCreateAPIView):
+class KeysetPaginationView(CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
+    # Cursor pagination seeking on id, no COUNT and no OFFSET
+    max_queries = 1
+    serializer_class = BookSerializer
+    pagination_class = KeysetPagination
+    queryset = Book.objects.all()
+
+
+class PublicationDateKeysetPaginationView(CompiledListMixin, OptimizedQueryMixin, generics.ListAPIView):
+    # Cursor pagination seeking on (publication_date, id)
+    max_queries = 1
+    serializer_class = BookSerializer
+    pagination_class = PublicationDateKeysetPagination
+    queryset = Book.objects.all()
+
+
+class KeysetPaginationBasedOnTemplate(OptimizedQueryMixin, generics.ListAPIView):
+    max_queries = 1
+    queryset = Book.objects.all()
+    serializer_class = BookSerializer
+    fields_query_param = None
+
+    def get(self, request, *args, **kwargs):
+        paginator = KeysetPaginator(self.filter_queryset(self.get_queryset()), 2)
+        books = paginator.get_page(request.GET.get('cursor'))
+
+        context = {'book_list': books, 'book_rows': caching.RowFragments(books)}
+        return render_template(request, 'book_list_2.html', context)
+
+
+class OneToOneRelationView(CompiledListMixin, OptimizedQueryMixin, generics.ListCreateAPIView):
+    max_queries = 5
     serializer_class = AuthorProfileSerializer
     queryset = AuthorProfile.objects.all()
 
 
-class ManyToManyRelationView(generics.ListAPIView):
+class ManyToManyRelationView(CoalescedRequestMixin, OptimizedQueryMixin, generics.ListAPIView):
+    max_queries = 2
     serializer_class = CategorySerializer
     queryset = Category.objects.all()
 
 
-class FilteredBooksToDb2(generics.ListAPIView):
-    serializer_class = Db2BookSerializer
+class FilteredBooksToDb2(QueryBudgetMixin, views.APIView):
+    # Incremental, batched copy of books to the second database, run by a
+    # run_jobs worker. Requests while a copy is waiting share its job.
+    max_queries = 2
+    writes_on_get = True
 
-    def get_queryset(self):
-        all_books = Book.objects.all()
-        book_serializer = OnlyBookSerializer(all_books, many=True)
+    @staticmethod
+    def get(request, *args, **kwargs):
+        job = jobs.enqueue('sync_books_to_db2', coalesce=True)
+        return job_accepted(request, job, 'Book sync to db2 queued')
 
-        for book_data, original_book in zip(book_serializer.data, all_books):
-            if not original_book:
-                continue
 
-            new_book = SecondTableBooks()
-            new_book.title = book_data['title']
-            new_book.price = book_data['price']
+class AsyncAPIView(View):
+    # DRF views are sync, so under ASGI each one holds a thread from the
+    # sync-to-async pool for the whole request. These counterparts await
+    # the async ORM instead and render the same bodies as the sync views,
+    # negotiated over the same renderers but for the browsable API, which
+    # needs a DRF view.
+    serializer_class = BookSerializer
+    pagination_class = None
+    fields_query_param = 'fields'
+    renderer_classes = [renderer for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+                        if not issubclass(renderer, BrowsableAPIRenderer)]
+    content_negotiation_class = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            self.negotiate(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            # Same body as DRF's exception handler
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return self.render(data, status=exc.status_code)
+
+    def negotiate(self, request):
+        # Accept header or ?format=, as in DRF's views. Without a match (a
+        # 406) the error is rendered with the first renderer.
+        renderers = [renderer() for renderer in self.renderer_classes]
+        self.renderer, self.media_type = renderers[0], renderers[0].media_type
+        self.renderer, self.media_type = self.content_negotiation_class().select_renderer(
+            Request(request), renderers)
+
+    def render(self, data, status=200):
+        # Same bytes and content type as a DRF Response
+        content_type = self.renderer.media_type
+        if self.renderer.charset:
+            content_type = f'{content_type}; charset={self.renderer.charset}'
+        return HttpResponse(self.renderer.render(data, self.media_type), status=status,
+                            content_type=content_type)
+
+    def get_sparse_fields(self):
+        return sparse_fields(self.request, self.serializer_class, self.fields_query_param)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return self.serializer_class(*args, **kwargs)
 
-            author = original_book.author
-            author_serializer = AuthorProfileSerializer(author.authorprofile)
+    def get_queryset(self):
+        return sharded(optimize_queryset(Book.objects.all(), self.get_serializer(),
+                                         pagination_fields(self.pagination_class)))
 
-            author_name = author_serializer.data['author']['name']
-            new_book.author = author_name
 
-            new_book.save(using='mydatabase')
+class AsyncBookListView(AsyncAPIView):
+    # Async counterpart of the list views, paginated when pagination_class is set
+    chunk_size = 2000
 
-        return all_books
+    async def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        compiled = get_compiled_serializer(self.serializer_class, self.get_sparse_fields())
+        if self.pagination_class is None:
+            if compiled is not None:
+                return self.render([
+                    item async for item in compiled.aiter_representation(queryset, self.chunk_size)
+                ])
+            return self.render(await self.serialize(queryset))
+
+        paginator = self.pagination_class()
+        rows = compiled.values(queryset, pagination_fields(paginator)) \
+            if compiled is not None else queryset
+        page = await paginator.apaginate_queryset(rows, Request(request), view=self)
+        if page is None:
+            return self.render(await self.serialize(rows, compiled, queryset))
+        data = await self.serialize(page, compiled, queryset)
+        return self.render(paginator.get_paginated_response(data).data)
+
+    async def serialize(self, rows, compiled=None, queryset=None):
+        if compiled is not None:
+            if isinstance(rows, QUERYSET_TYPES):
+                rows = [row async for row in rows]
+            return compiled.to_representation(rows, queryset)
+        # Serializers the compiler cannot reproduce may query per row
+        return await sync_to_async(lambda: self.get_serializer(rows, many=True).data)()
+
+
+class AsyncBookAnnotateView(AsyncBookListView):
+    # title_length is a stored column, there is nothing left to annotate
+    serializer_class = AnnotatedBookSerializer
+
+
+class AsyncBookDetailView(AsyncAPIView):
+    async def get(self, request, pk, *args, **kwargs):
+        try:
+            book = await self.get_queryset().aget(pk=pk)
+        except Book.DoesNotExist:
+            raise NotFound('No Book matches the given query.')
+        # The author is read from the book's stored columns, serializing does not query
+        return self.render(self.get_serializer(book).data)
+
+
+class AsyncBookAggregateView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        group_by = request.GET.get('group_by')
+        grouped = None
+        if group_by in BookAggregateView.group_by_scopes:
+            grouped = await book_stats.asummary(BookAggregateView.group_by_scopes[group_by])
+        return self.render(
+            BookAggregateView.aggregate_data(await book_stats.asummary(), group_by, grouped))
+
+
+class AsyncLimitOffsetPaginationView(AsyncBookListView):
+    pagination_class = AsyncLimitOffsetPagination
+
+
+class AsyncKeysetPaginationView(AsyncBookListView):
+    pagination_class = KeysetPagination
+
+
+class AsyncPublicationDateKeysetPaginationView(AsyncBookListView):
+    pagination_class = PublicationDateKeysetPagination
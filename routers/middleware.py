@@ -0,0 +1,57 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import replicas
+
+
+class ReplicaPinMiddleware:
+    # Read-your-writes across requests: after a write the client gets a
+    # cookie that keeps its reads on the primary for REPLICA_PIN_SECONDS.
+    cookie_name = 'db_pinned_until'
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with replicas.pinning_scope(self.read_cookie(request)) as state:
+            response = self.get_response(request)
+        return self.set_cookie(response, state)
+
+    async def __acall__(self, request):
+        with replicas.pinning_scope(self.read_cookie(request)) as state:
+            response = await self.get_response(request)
+        return self.set_cookie(response, state)
+
+    def set_cookie(self, response, state):
+        if state.wrote:
+            now = time.time()
+            pinned = {alias: until for alias, until in state.pinned_until.items() if until > now}
+            if pinned:
+                response.set_cookie(
+                    self.cookie_name,
+                    '|'.join(f'{alias}:{until:.3f}' for alias, until in pinned.items()),
+                    max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5) + 1,
+                    httponly=True,
+                    samesite='Lax',
+                )
+        return response
+
+    def read_cookie(self, request):
+        # The cookie only ever sends reads to the primary, so a forged one is harmless
+        pinned = {}
+        for part in request.COOKIES.get(self.cookie_name, '').split('|'):
+            alias, _, until = part.partition(':')
+            try:
+                pinned[alias] = float(until)
+            except ValueError:
+                continue
+        return pinned
@@ -0,0 +1,163 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Read-your-writes state of the current request (or thread, outside one)
+_pins = ContextVar('replica_pins', default=None)
+
+
+def replicas_of(primary):
+    # {replica alias: weight} configured for a primary alias
+    return getattr(settings, 'DATABASE_REPLICAS', {}).get(primary, {})
+
+
+def replica_aliases():
+    return {alias for replicas in getattr(settings, 'DATABASE_REPLICAS', {}).values()
+            for alias in replicas}
+
+
+class PinState:
+    def __init__(self, pinned_until=None):
+        # alias -> wall-clock time until which its reads stay on the primary
+        self.pinned_until = dict(pinned_until or {})
+        self.wrote = False
+
+
+def current_pins():
+    state = _pins.get()
+    if state is None:
+        state = PinState()
+        _pins.set(state)
+    return state
+
+
+@contextmanager
+def pinning_scope(pinned_until=None):
+    # Fresh read-your-writes state for one request, seeded from the client
+    token = _pins.set(PinState(pinned_until))
+    try:
+        yield _pins.get()
+    finally:
+        _pins.reset(token)
+
+
+def pin(alias):
+    state = current_pins()
+    seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+    state.pinned_until[alias] = time.time() + seconds
+    state.wrote = True
+
+
+def is_pinned(alias):
+    return current_pins().pinned_until.get(alias, 0) > time.time()
+
+
+def replica_lag(connection):
+    # Seconds behind the primary, None where the backend cannot tell. The
+    # last replayed commit only ages while the primary is idle, so a
+    # replica that has replayed all WAL it received counts as 0.
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT CASE WHEN NOT pg_is_in_recovery() THEN NULL '
+            'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+        )
+        lag = cursor.fetchone()[0]
+    return float(lag) if lag is not None else None
+
+
+class ReplicaHealth:
+    # Checks a replica at most every REPLICA_CHECK_SECONDS; one that cannot
+    # answer or lags more than REPLICA_MAX_LAG_SECONDS is left out of
+    # rotation for REPLICA_DOWN_SECONDS.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = {}
+        self.down_until = {}
+
+    def is_available(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            if self.down_until.get(alias, 0) > now:
+                return False
+            due = now - self.checked_at.get(alias, float('-inf')) >= getattr(
+                settings, 'REPLICA_CHECK_SECONDS', 10)
+            if due:
+                self.checked_at[alias] = now
+        if due and not self.check(alias):
+            self.mark_down(alias)
+            return False
+        return True
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            lag = replica_lag(connection)
+        except SynchronousOnlyOperation:
+            # Routed from an event loop, check again on the next sync read
+            with self.lock:
+                self.checked_at.pop(alias, None)
+            return True
+        except DatabaseError as exc:
+            logger.warning('Replica %s failed its health check: %s', alias, exc)
+            return False
+        max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+        if lag is not None and lag > max_lag:
+            logger.warning('Replica %s is %.1fs behind, over %ss', alias, lag, max_lag)
+            return False
+        return True
+
+    def mark_down(self, alias):
+        with self.lock:
+            self.down_until[alias] = time.monotonic() + getattr(
+                settings, 'REPLICA_DOWN_SECONDS', 30)
+
+    def reset(self):
+        with self.lock:
+            self.checked_at.clear()
+            self.down_until.clear()
+
+
+class ReplicaSelector:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_used = {}
+
+    def choose(self, replicas):
+        # replicas: {alias: weight} of the healthy replicas
+        if getattr(settings, 'REPLICA_SELECTION', 'weighted') == 'lru':
+            with self.lock:
+                alias = min(replicas, key=lambda name: self.last_used.get(name, 0))
+                self.last_used[alias] = time.monotonic()
+            return alias
+        return random.choices(list(replicas), weights=list(replicas.values()))[0]
+
+
+health = ReplicaHealth()
+selector = ReplicaSelector()
+
+
+def read_alias(primary):
+    # Where a read of a model living on primary should go
+    replicas = replicas_of(primary)
+    if not replicas or is_pinned(primary) or connections[primary].in_atomic_block:
+        return primary
+    available = {alias: weight for alias, weight in replicas.items()
+                 if weight > 0 and health.is_available(alias)}
+    if not available:
+        return primary
+    return selector.choose(available)
@@ -1,19 +1,44 @@
+from . import replicas, shards
+
+SECOND_DATABASE_MODELS = {'secondtablebooks', 'synccheckpoint'}
+
+
 class MyDatabaseRouter:
-    def db_for_read(self, model, **hints):
-        if model._meta.model_name == 'secondtablebooks':
+    # Writes go to the model's primary alias; reads are spread over the
+    # primary's DATABASE_REPLICAS unless a recent write pinned them to it.
+    # With BOOK_SHARDS set, books and their category links live on the shard
+    # of their author and queries tied to one row follow it there.
+    @staticmethod
+    def primary_for(model, hints):
+        if model._meta.model_name in SECOND_DATABASE_MODELS:
             return 'mydatabase'
+        shard = shards.shard_for_hints(model, hints)
+        if shard is not None:
+            return shard
+        if shards.is_sharded(model):
+            # Queries not tied to a row use the first shard; scatter-gather
+            # over all of them goes through presentation.sharding
+            return shards.shard_aliases()[0]
         return 'default'
 
+    def db_for_read(self, model, **hints):
+        return replicas.read_alias(self.primary_for(model, hints))
+
     def db_for_write(self, model, **hints):
-        if model._meta.model_name == 'secondtablebooks':
-            return 'mydatabase'
-        return 'default'
+        primary = self.primary_for(model, hints)
+        replicas.pin(primary)
+        return primary
 
     def allow_relation(self, obj1, obj2, **hints):
         return True
 
     def allow_migrate(self, db, app_label, model_name=None, **hints):
-        if model_name == 'secondtablebooks':
+        # Replicas copy their primary's schema
+        if db in replicas.replica_aliases():
+            return False
+        if model_name in SECOND_DATABASE_MODELS:
             return db == 'mydatabase'
+        if db != 'default' and db in shards.shard_aliases():
+            return model_name in shards.SHARDED_MODELS | shards.REFERENCE_MODELS
         else:
             return db == 'default'
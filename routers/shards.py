@@ -0,0 +1,48 @@
+from django.conf import settings
+
+# Rows spread over BOOK_SHARDS by author, and the models every shard keeps a
+# full copy of so the sharded rows' foreign keys hold on each shard
+SHARDED_MODELS = {'book', 'book_categories'}
+REFERENCE_MODELS = {'author', 'authorprofile', 'category'}
+
+
+def shard_aliases():
+    return list(getattr(settings, 'BOOK_SHARDS', []))
+
+
+def is_sharded(model):
+    return bool(getattr(settings, 'BOOK_SHARDS', None)) and \
+        model._meta.model_name in SHARDED_MODELS
+
+
+def shard_for_author(author_id):
+    shards = shard_aliases()
+    return shards[author_id % len(shards)]
+
+
+def shard_for_instance(instance):
+    # Shard owning a Book, a link row or an author's books; None if unknown
+    model_name = instance._meta.model_name
+    if model_name in SHARDED_MODELS and instance._state.db in shard_aliases():
+        # Rows stay where they were written, also if their author changes
+        return instance._state.db
+    if model_name == 'book' and instance.author_id is not None:
+        return shard_for_author(instance.author_id)
+    if model_name == 'author' and instance.pk is not None:
+        return shard_for_author(instance.pk)
+    return None
+
+
+def shard_for_hints(model, hints):
+    # Alias for a query on model given the router hints, None when the
+    # query is not tied to a shard
+    instance = hints.get('instance')
+    if instance is None or not shard_aliases():
+        return None
+    if instance._meta.model_name in SHARDED_MODELS:
+        # Relations followed from a sharded row (book.author, book.categories)
+        return shard_for_instance(instance)
+    if model._meta.model_name in SHARDED_MODELS:
+        # Sharded rows reached from a reference row (author.book_set)
+        return shard_for_instance(instance)
+    return None
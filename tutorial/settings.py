@@ -10,8 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
-import debug_toolbar
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,20 +38,70 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     'rest_framework',
     'presentation',
-    "debug_toolbar",
 ]
 
 MIDDLEWARE = [
+    "presentation.middleware.RequestMetricsMiddleware",
+    "presentation.middleware.SlowQueryViewMiddleware",
+    "presentation.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "routers.middleware.ReplicaPinMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# Brotli/gzip response compression (presentation.middleware.CompressionMiddleware)
+RESPONSE_COMPRESSION_MIN_BYTES = 200
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+# Per-route latency, DB, serializer and template time, query count and
+# response size, served in the Prometheus text format at /metrics
+REQUEST_METRICS_ENABLED = True
+
+# Queries slower than this are written with their EXPLAIN plan to
+# SLOW_QUERY_LOG, rotated by the LOGGING handler below; `manage.py
+# slow_queries` ranks them. None turns the wrapper off. The log lives
+# outside the source tree.
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_LOG = Path(tempfile.gettempdir()) / 'tutorial_slow_queries.log'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'presentation.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# The debug toolbar instruments every query and template and is only meant
+# for development
+DEBUG_TOOLBAR_ENABLED = DEBUG
+if DEBUG_TOOLBAR_ENABLED:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 INTERNAL_IPS = [
     # ...
     "127.0.0.1",
@@ -60,12 +110,21 @@ INTERNAL_IPS = [
 
 ROOT_URLCONF = "tutorial.urls"
 
+# Templates are compiled once per process by the cached loader (Django's
+# default since 4.1, spelled out so it stays on). The runserver autoreloader
+# clears it when a template changes; benchmark_templates compares it with
+# reading and compiling the templates on every render.
+TEMPLATE_LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": ['presentation/templates'],
-        "APP_DIRS": True,
         "OPTIONS": {
+            "loaders": [("django.template.loaders.cached.Loader", TEMPLATE_LOADERS)],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
@@ -98,11 +157,98 @@ DATABASES = {
 
 DATABASE_ROUTERS = ['routers.routers.MyDatabaseRouter']
 
+# The db2 book sync rereads books stamped up to this long before its
+# high-water mark, for rows that committed after a later one was copied
+BOOK_SYNC_OVERLAP_SECONDS = 60
+
+# Shards of Book and its category links, e.g. ['default', 'shard1', 'shard2'].
+# Books go to shards[author_id % len(shards)]; authors and categories are
+# copied to every shard. Empty keeps every book on default.
+BOOK_SHARDS = []
+# Threads running the per-shard queries of a scatter-gather
+BOOK_SHARD_WORKERS = 8
+
+# Read replicas per primary alias, {primary: {replica alias: weight}}. Each
+# replica also needs a DATABASES entry, e.g. SQLite copies kept in sync with
+# refresh_sqlite_replicas:
+#     'replica1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica1.sqlite3'},
+#     DATABASE_REPLICAS = {'default': {'replica1': 2, 'replica2': 1}}
+DATABASE_REPLICAS = {}
+# 'weighted' (random by weight) or 'lru' (least recently used replica)
+REPLICA_SELECTION = 'weighted'
+# Reads stay on the primary this long after a write in the same request/client
+REPLICA_PIN_SECONDS = 5
+# Health check interval, how long a failing replica is left out, and the
+# replication lag (Postgres) over which a replica counts as failing
+REPLICA_CHECK_SECONDS = 10
+REPLICA_DOWN_SECONDS = 30
+REPLICA_MAX_LAG_SECONDS = 5
+
+# List responses are keyed on model generations (presentation.caching). The
+# HTML book lists cache one entry per row, more than LocMemCache's default
+# 300. The generations themselves are bumped by run_jobs workers as well as
+# the web processes, so they live in a cache every process sees: a file
+# cache on one host, Redis or Memcached across hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 200_000},
+    },
+    'generations': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'tutorial_cache_generations',
+    },
+}
+
+# Paginator counts (presentation.counting) are cached per query and model
+# generations. Unfiltered counts of tables the planner estimates at
+# APPROXIMATE_COUNT_THRESHOLD rows or more use the estimate, read from
+# pg_class on Postgres and sqlite_stat1 on SQLite (filled by ANALYZE).
+COUNT_CACHE_SECONDS = 60 * 60
+APPROXIMATE_COUNT_THRESHOLD = 1_000_000
+ESTIMATED_COUNT_SECONDS = 60 * 10
+
+# Identical reads of the coalesced views wait up to COALESCE_WAIT_SECONDS for
+# the one in flight (presentation.coalescing). Cached pages are refreshed
+# early at random as they near expiry, sooner the larger
+# CACHE_EARLY_REFRESH_BETA; 0 only refreshes them once expired.
+COALESCE_WAIT_SECONDS = 30
+CACHE_EARLY_REFRESH_BETA = 1.0
+
+# Background jobs (presentation.jobs) run in `manage.py run_jobs` worker
+# threads. A failed attempt is retried after JOB_RETRY_BASE_SECONDS doubled
+# per attempt, up to JOB_RETRY_MAX_SECONDS; a running job whose worker has
+# not reported progress for JOB_LEASE_SECONDS is handed to another worker.
+JOB_WORKERS = 4
+JOB_POLL_SECONDS = 1.0
+JOB_RETRY_BASE_SECONDS = 5
+JOB_RETRY_MAX_SECONDS = 600
+JOB_LEASE_SECONDS = 300
+
+# List views with CompiledListMixin serialize values() rows through compiled
+# serializers (presentation.compiled) instead of DRF's per-instance path;
+# a view's compiled_list attribute overrides this
+COMPILED_LIST_VIEWS = False
+
+# Views over their max_queries log a warning; tests set this to raise instead
+QUERY_BUDGET_RAISE = False
+
 # REST_FRAMEWORK = {
 #     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
 #     'PAGE_SIZE': 1,
 # }
 
+# Accept: application/msgpack or application/vnd.columnar+json (or
+# ?format=msgpack / ?format=columnar) next to JSON and the browsable API
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'presentation.renderers.MessagePackRenderer',
+        'presentation.renderers.ColumnarJSONRenderer',
+    ],
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -1,4 +1,4 @@
-import debug_toolbar
+from django.conf import settings
 from django.urls import path, include
 from rest_framework import routers
 
@@ -9,15 +9,22 @@ from presentation.views import BookList, BookAnnotateView, BookAggregateView, \
     FilteredBookListView, CachedBookList, FragmentCachedBookList, PaginatorBooksView, \
     PaginationBasedOnTemplate, LimitOffsetPaginationView, \
     CustomLimitOffsetPaginationView, OneToOneRelationView, \
-    ManyToManyRelationView, FilteredBooksToDb2
+    ManyToManyRelationView, FilteredBooksToDb2, KeysetPaginationView, \
+    PublicationDateKeysetPaginationView, KeysetPaginationBasedOnTemplate, CacheStatsView, \
+    PriceUpdateJobListView, PriceUpdateJobDetailView, BookBulkCreateView, \
+    AsyncBookAnnotateView, AsyncBookDetailView, AsyncBookAggregateView, \
+    AsyncLimitOffsetPaginationView, AsyncKeysetPaginationView, \
+    AsyncPublicationDateKeysetPaginationView, MetricsView, BookExportView, BackgroundJobDetailView
 
 router = routers.DefaultRouter()
 router.register(r'presentation', BookList, basename='presentation')
 
 urlpatterns = [
-    path('__debug__/', include(debug_toolbar.urls)),
+    path('metrics', MetricsView.as_view()),
     path('books/<int:pk>/', BookList.as_view()),
     path('books/annotate/', BookAnnotateView.as_view()),
+    path('books/bulk_create/', BookBulkCreateView.as_view()),
+    path('books/export', BookExportView.as_view()),
     path('books/aggregate/', BookAggregateView.as_view()),
     path('books/select_related/', BookSelectRelatedView.as_view()),
     path('books/prefetch_related/', BookPrefetchRelatedView.as_view()),
@@ -26,14 +33,33 @@ urlpatterns = [
     path('books/raw/', BookRawView.as_view()),
     path('books/extra/', BookExtraView.as_view()),
     path('update_prices_with_f_objects/', UpdateBookPricesView.as_view()),
+    path('jobs/<int:pk>', BackgroundJobDetailView.as_view(), name='background-job'),
+    path('books/price_update_jobs', PriceUpdateJobListView.as_view()),
+    path('books/price_update_jobs/<int:pk>', PriceUpdateJobDetailView.as_view()),
     path('filtered_book_list/', FilteredBookListView.as_view()),
     path('books/with_cache', CachedBookList.as_view()),
     path('books/fragment_cached_book_list', FragmentCachedBookList.as_view()),
+    path('cache/stats', CacheStatsView.as_view()),
     path('books/list_with_paginator', PaginatorBooksView.as_view()),
     path('books/pagination_based_on_template', PaginationBasedOnTemplate.as_view()),
     path('books/limitoffset_pagination_view', LimitOffsetPaginationView.as_view()),
     path('books/custom_limitoffset_pagination_view', CustomLimitOffsetPaginationView.as_view()),
+    path('books/keyset_pagination_view', KeysetPaginationView.as_view()),
+    path('books/keyset_pagination_by_date_view', PublicationDateKeysetPaginationView.as_view()),
+    path('books/keyset_pagination_based_on_template', KeysetPaginationBasedOnTemplate.as_view()),
     path('author/one_to_one_relation', OneToOneRelationView.as_view()),
     path('books/many_to_many_relation', ManyToManyRelationView.as_view()),
     path('books/filtered_books_to_db2', FilteredBooksToDb2.as_view()),
+    path('async/books/<int:pk>/', AsyncBookDetailView.as_view()),
+    path('async/books/annotate/', AsyncBookAnnotateView.as_view()),
+    path('async/books/aggregate/', AsyncBookAggregateView.as_view()),
+    path('async/books/limitoffset_pagination_view', AsyncLimitOffsetPaginationView.as_view()),
+    path('async/books/keyset_pagination_view', AsyncKeysetPaginationView.as_view()),
+    path('async/books/keyset_pagination_by_date_view',
+         AsyncPublicationDateKeysetPaginationView.as_view()),
 ]
+
+if getattr(settings, 'DEBUG_TOOLBAR_ENABLED', False):
+    import debug_toolbar
+
+    urlpatterns.append(path('__debug__/', include(debug_toolbar.urls)))